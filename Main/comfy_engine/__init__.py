@@ -0,0 +1,60 @@
+from .admission import AdmissionController, AdmissionRejected
+from .bindings import BindingError, PatchPlan
+from .client import ComfyClient
+from .engine import ComfyEngine, GenerationResult, is_temp_output, select_final_output, use_websocket_outputs
+from .jobs import (
+    GenerationJob,
+    build_standard_job,
+    build_redux_job,
+    build_reduxprompt_job,
+    build_video_job,
+    discard_request_files,
+    job_from_request_item,
+    request_model_family
+)
+from .loras import LoraRegistry
+from .output_cache import OutputCache, workflow_key
+from .outputs import OutputRef, open_output
+from .pool import Backend, BackendPool, BackendUnavailable
+from .reporters import HttpReporter
+from .residency import model_family
+from .router import PromptRouter
+from .scheduler import FairScheduler
+from .templates import TemplateCache, WorkflowInstance, load_template, plan_for
+
+__all__ = [
+    'AdmissionController',
+    'AdmissionRejected',
+    'BindingError',
+    'PatchPlan',
+    'ComfyClient',
+    'ComfyEngine',
+    'GenerationResult',
+    'select_final_output',
+    'is_temp_output',
+    'use_websocket_outputs',
+    'GenerationJob',
+    'build_standard_job',
+    'build_redux_job',
+    'build_reduxprompt_job',
+    'build_video_job',
+    'discard_request_files',
+    'job_from_request_item',
+    'request_model_family',
+    'LoraRegistry',
+    'model_family',
+    'Backend',
+    'BackendPool',
+    'BackendUnavailable',
+    'OutputCache',
+    'workflow_key',
+    'OutputRef',
+    'open_output',
+    'HttpReporter',
+    'PromptRouter',
+    'FairScheduler',
+    'TemplateCache',
+    'WorkflowInstance',
+    'load_template',
+    'plan_for'
+]
@@ -0,0 +1,120 @@
+import logging
+import math
+import time
+from typing import Dict, Hashable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOB_SECONDS = 60.0  # duration estimate until real jobs have been timed
+DURATION_SMOOTHING = 0.2  # weight of the newest job in the moving average
+
+
+class AdmissionRejected(Exception):
+    """Raised when the queue cannot take another job right now"""
+
+    def __init__(self, reason: str, retry_after: int):
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__(f"{reason} Please try again in about {format_retry_after(retry_after)}.")
+
+
+def format_retry_after(seconds: int) -> str:
+    if seconds < 60:
+        return f"{seconds} seconds"
+    minutes = math.ceil(seconds / 60)
+    return f"{minutes} minute{'s' if minutes != 1 else ''}"
+
+
+class AdmissionController:
+    """
+    Bounds the generation backlog. Tracks every admitted job until it finishes,
+    enforcing a maximum number of waiting jobs plus per-guild and per-user caps on
+    jobs in flight (waiting or running). A cap of 0 disables that check.
+    """
+
+    def __init__(self, max_queue: int = 0, max_per_guild: int = 0, max_per_user: int = 0, workers: int = 1):
+        self.max_queue = max_queue
+        self.max_per_guild = max_per_guild
+        self.max_per_user = max_per_user
+        self.workers = max(1, workers)
+        self.average_job_seconds = DEFAULT_JOB_SECONDS
+        # ticket -> (user_id, guild_id, started_at or None while waiting)
+        self._tickets: Dict[Hashable, Tuple[str, str, Optional[float]]] = {}
+        self._per_user: Dict[str, int] = {}
+        self._per_guild: Dict[str, int] = {}
+        self._waiting = 0
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tickets)
+
+    def _estimate(self, jobs_ahead: int) -> int:
+        """Seconds until jobs_ahead more jobs have finished across all workers"""
+        return max(1, math.ceil(max(1, jobs_ahead) * self.average_job_seconds / self.workers))
+
+    def check(self, user_id: str, guild_id: str) -> Optional[AdmissionRejected]:
+        """Return the rejection a new job from this user would get, or None if it fits"""
+        if self.max_queue and self._waiting >= self.max_queue:
+            return AdmissionRejected(
+                "The generation queue is full.",
+                self._estimate(self._waiting - self.max_queue + 1)
+            )
+        if self.max_per_user and self._per_user.get(user_id, 0) >= self.max_per_user:
+            return AdmissionRejected(
+                f"You already have {self._per_user[user_id]} generations in progress.",
+                self._estimate(self._waiting + 1)
+            )
+        if guild_id and self.max_per_guild and self._per_guild.get(guild_id, 0) >= self.max_per_guild:
+            return AdmissionRejected(
+                "This server has too many generations in progress.",
+                self._estimate(self._waiting + 1)
+            )
+        return None
+
+    def admit(self, ticket: Hashable, user_id: str, guild_id: str):
+        """Register a job as waiting; raises AdmissionRejected if it does not fit"""
+        if ticket in self._tickets:
+            return
+        rejection = self.check(user_id, guild_id)
+        if rejection is not None:
+            raise rejection
+        self._tickets[ticket] = (user_id, guild_id, None)
+        self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+        if guild_id:
+            self._per_guild[guild_id] = self._per_guild.get(guild_id, 0) + 1
+        self._waiting += 1
+
+    def started(self, ticket: Hashable):
+        entry = self._tickets.get(ticket)
+        if entry is None or entry[2] is not None:
+            return
+        user_id, guild_id, _ = entry
+        self._tickets[ticket] = (user_id, guild_id, time.monotonic())
+        self._waiting -= 1
+
+    def release(self, ticket: Hashable):
+        entry = self._tickets.pop(ticket, None)
+        if entry is None:
+            return
+        user_id, guild_id, started_at = entry
+        if started_at is None:
+            self._waiting -= 1
+        else:
+            duration = time.monotonic() - started_at
+            self.average_job_seconds += DURATION_SMOOTHING * (duration - self.average_job_seconds)
+
+        self._decrement(self._per_user, user_id)
+        if guild_id:
+            self._decrement(self._per_guild, guild_id)
+
+    @staticmethod
+    def _decrement(counts: Dict[str, int], key: str):
+        remaining = counts.get(key, 0) - 1
+        if remaining > 0:
+            counts[key] = remaining
+        else:
+            counts.pop(key, None)
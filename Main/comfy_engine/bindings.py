@@ -0,0 +1,89 @@
+import fnmatch
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Manifest in Main/Datasets mapping each template family's logical parameters to node inputs
+MANIFEST_FILE = 'bindings.json'
+
+VALUE = 'value'
+LORA_STACK = 'lora_stack'  # a Power Lora Loader whose lora_N entries are replaced
+
+
+class BindingError(ValueError):
+    """A template does not match its binding manifest"""
+
+
+@dataclass(frozen=True)
+class Binding:
+    node: str
+    input: Optional[str] = None
+    type: str = VALUE
+
+
+def set_lora_stack(inputs: Dict[str, Any], loras: Iterable[Tuple[str, float]]):
+    """Replace the lora_N entries of a Power Lora Loader with (file, strength) pairs"""
+    for key in [key for key in inputs if key.startswith('lora_')]:
+        del inputs[key]
+    for i, (lora, strength) in enumerate(loras, start=1):
+        inputs[f'lora_{i}'] = {'on': True, 'lora': lora, 'strength': strength}
+
+
+class PatchPlan:
+    """
+    A template's bindings, checked against the template once, applied to a job's
+    workflow with one node lookup per parameter
+    """
+
+    def __init__(self, family: str, bindings: Dict[str, Binding], template: Optional[str] = None):
+        self.family = family
+        self.bindings = bindings
+        self.template = template
+
+    def __contains__(self, parameter: str) -> bool:
+        return parameter in self.bindings
+
+    def apply(self, workflow: Dict[str, Any], **parameters) -> Dict[str, Any]:
+        """Set each bound parameter in place; None values and unbound parameters are skipped"""
+        for parameter, value in parameters.items():
+            binding = self.bindings.get(parameter)
+            if binding is None or value is None:
+                continue
+            inputs = workflow[binding.node]['inputs']
+            if binding.type == LORA_STACK:
+                set_lora_stack(inputs, value)
+            else:
+                inputs[binding.input] = value
+        return workflow
+
+
+def compile_plan(family: str, workflow: Dict[str, Any], parameters: Dict[str, Dict[str, Any]],
+                 template: Optional[str] = None) -> PatchPlan:
+    """Check a manifest entry's bindings against a workflow and build its patch plan"""
+    name = template or family
+    bindings = {}
+    for parameter, spec in parameters.items():
+        binding = Binding(node=str(spec['node']), input=spec.get('input'), type=spec.get('type', VALUE))
+        node = dict.get(workflow, binding.node)  # plain lookup, no copy-on-write
+        if not isinstance(node, dict) or not isinstance(node.get('inputs'), dict):
+            raise BindingError(f"{name}: node {binding.node} for '{parameter}' is missing or has no inputs")
+        if binding.type == VALUE:
+            if binding.input not in node['inputs']:
+                raise BindingError(f"{name}: node {binding.node} has no input '{binding.input}' for '{parameter}'")
+        elif binding.type == LORA_STACK:
+            if 'lora' not in str(node.get('class_type', '')).lower():
+                raise BindingError(f"{name}: node {binding.node} for '{parameter}' is not a LoRA loader")
+        else:
+            raise BindingError(f"{name}: unknown binding type '{binding.type}' for '{parameter}'")
+        bindings[parameter] = binding
+    return PatchPlan(family, bindings, template)
+
+
+def manifest_entry(manifest: Dict[str, Any], template_name: str) -> Tuple[str, Dict[str, Any]]:
+    """Return (family, parameters) of the manifest entry whose patterns match a template filename"""
+    for family, entry in manifest.items():
+        if any(fnmatch.fnmatch(template_name, pattern) for pattern in entry.get('templates', ())):
+            return family, entry['parameters']
+    raise BindingError(f"No binding manifest entry matches {template_name}")
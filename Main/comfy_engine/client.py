@@ -0,0 +1,116 @@
+import json
+import logging
+from typing import Any, Dict, Optional
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = aiohttp.ClientTimeout(total=120)
+HEALTH_TIMEOUT = aiohttp.ClientTimeout(total=5)
+# Large videos may take a while; only a stalled transfer counts as a failure
+DOWNLOAD_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=120)
+CHUNK_SIZE = 256 * 1024
+
+
+class ComfyClient:
+    """Async HTTP and websocket client for a single ComfyUI server."""
+
+    def __init__(self, server_address: str, port: int = 8188, session: Optional[aiohttp.ClientSession] = None):
+        self.server_address = server_address
+        self.port = port
+        self._session = session
+        self._owns_session = session is None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.server_address}:{self.port}"
+
+    @property
+    def ws_url(self) -> str:
+        return f"ws://{self.server_address}:{self.port}/ws"
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Shared keep-alive session, created lazily inside the running loop"""
+        if self._session is None or self._session.closed:
+            # No session-wide timeout: the shared websocket stays open indefinitely
+            self._session = aiohttp.ClientSession()
+            self._owns_session = True
+        return self._session
+
+    async def queue_prompt(self, workflow: Dict[str, Any], client_id: str,
+                           prompt_id: Optional[str] = None) -> Dict[str, Any]:
+        """Queue a workflow on ComfyUI and return the /prompt response"""
+        if not isinstance(workflow, dict):
+            raise ValueError("Workflow must be a dictionary")
+
+        body = {"prompt": workflow, "client_id": client_id}
+        if prompt_id:
+            # Recent ComfyUI versions honour a client-chosen prompt_id
+            body["prompt_id"] = prompt_id
+        payload = json.dumps(
+            body,
+            ensure_ascii=False,
+            separators=(',', ':')
+        ).encode('utf-8')
+        logger.debug(f"Sending request to ComfyUI prompt endpoint ({len(payload)} bytes)")
+
+        async with self.session.post(
+            f"{self.base_url}/prompt",
+            data=payload,
+            headers={'Content-Type': 'application/json'},
+            timeout=DEFAULT_TIMEOUT
+        ) as response:
+            if response.status != 200:
+                body = await response.text()
+                logger.error(f"HTTP Error: {response.status} - {body}")
+                response.raise_for_status()
+            result = await response.json(content_type=None)
+
+        if not isinstance(result, dict):
+            raise ValueError("Expected dictionary response from ComfyUI")
+        logger.debug("Successfully queued prompt with ComfyUI")
+        return result
+
+    async def get_history(self, prompt_id: str) -> Dict[str, Any]:
+        async with self.session.get(f"{self.base_url}/history/{prompt_id}", timeout=DEFAULT_TIMEOUT) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    async def get_queue(self) -> Dict[str, Any]:
+        """Running and pending prompts, as returned by /queue"""
+        async with self.session.get(f"{self.base_url}/queue", timeout=HEALTH_TIMEOUT) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    async def get_system_stats(self) -> Dict[str, Any]:
+        async with self.session.get(f"{self.base_url}/system_stats", timeout=HEALTH_TIMEOUT) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    async def get_output(self, filename: str, subfolder: str, folder_type: str) -> bytes:
+        """Download a file from ComfyUI's output, input or temp directory"""
+        params = {"filename": filename, "subfolder": subfolder, "type": folder_type}
+        async with self.session.get(f"{self.base_url}/view", params=params, timeout=DEFAULT_TIMEOUT) as response:
+            response.raise_for_status()
+            return await response.read()
+
+    async def save_output(self, filename: str, subfolder: str, folder_type: str, path: str):
+        """Stream a file from ComfyUI to a local path without buffering it in memory"""
+        params = {"filename": filename, "subfolder": subfolder, "type": folder_type}
+        async with self.session.get(f"{self.base_url}/view", params=params, timeout=DOWNLOAD_TIMEOUT) as response:
+            response.raise_for_status()
+            with open(path, 'wb') as f:
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    f.write(chunk)
+
+    async def connect_websocket(self, client_id: str) -> aiohttp.ClientWebSocketResponse:
+        return await self.session.ws_connect(
+            f"{self.ws_url}?clientId={client_id}",
+            heartbeat=30
+        )
+
+    async def close(self):
+        if self._owns_session and self._session is not None and not self._session.closed:
+            await self._session.close()
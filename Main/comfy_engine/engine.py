@@ -0,0 +1,523 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+import aiohttp
+
+
+from .jobs import GenerationJob, TEMP_DIR, resolve_dataset_path
+from .output_cache import OutputCache, workflow_key
+from .outputs import DELIVERY_BYTES, DELIVERY_REFERENCE, OutputRef
+from .pool import Backend, BackendPool, BackendUnavailable
+from .residency import model_family
+from .router import RECONNECTED, DISCONNECTED, OUTPUT_IMAGE
+
+logger = logging.getLogger(__name__)
+
+CONNECT_TIMEOUT = 30  # seconds
+RECONNECT_GRACE = 30  # seconds a running job waits for its backend to come back
+FETCH_CONCURRENCY = 4  # output downloads in flight at once, across all jobs
+
+# Image save nodes that can be swapped for SaveImageWebsocket
+SAVE_IMAGE_NODES = ('SaveImage', 'Image Save')
+# Name prefix of websocket images whose save node has no usable filename_prefix
+WEBSOCKET_OUTPUT_PREFIX = 'FluxBot'
+
+# Failures that mean the backend, not the workflow, is at fault
+BACKEND_ERRORS = (ConnectionError, aiohttp.ClientConnectionError, asyncio.TimeoutError)
+
+# An output file: its contents, or a reference to it in reference delivery mode
+Output = Union[bytes, OutputRef]
+
+
+@dataclass
+class GenerationResult:
+    """The final output of a job, ready to be delivered to Discord, as bytes or a reference"""
+    job: GenerationJob
+    filename: str
+    data: Optional[bytes] = None
+    ref: Optional[OutputRef] = None
+
+    @property
+    def is_video(self) -> bool:
+        return self.filename.lower().endswith('.mp4')
+
+    def form_fields(self) -> Dict[str, str]:
+        """The text fields of the /send_image callback, as strings"""
+        job = self.job
+        return {
+            'request_id': str(job.request_id),
+            'user_id': str(job.user_id),
+            'channel_id': str(job.channel_id),
+            'interaction_id': str(job.interaction_id),
+            'original_message_id': str(job.original_message_id),
+            'prompt': str(job.prompt),
+            'resolution': str(job.resolution),
+            'upscaled_resolution': str(job.upscaled_resolution),
+            'loras': json.dumps(job.loras),
+            'upscale_factor': str(job.upscale_factor),
+            'seed': str(job.seed),
+            'is_video': str(self.is_video)
+        }
+
+    def history_record(self) -> Dict[str, Any]:
+        """Keyword arguments of add_to_history for this result, JSON serialisable"""
+        job = self.job
+        return {
+            'user_id': job.user_id,
+            'prompt': job.prompt,
+            'workflow': job.workflow,
+            'image_filename': self.filename,
+            'resolution': job.resolution,
+            'loras': job.loras,
+            'upscale_factor': job.upscale_factor,
+            'request_id': job.request_id
+        }
+
+
+def is_temp_output(file_info: Dict[str, Any]) -> bool:
+    """Previews ComfyUI writes to its temp directory are never the final output"""
+    return file_info.get('type') == 'temp' or file_info['filename'].startswith('ComfyUI_temp')
+
+
+def use_websocket_outputs(workflow: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    Return a copy of the workflow whose image save nodes are replaced by
+    SaveImageWebsocket, which pushes the images over the websocket instead of
+    writing them to disk, along with the ids of the replaced nodes.
+    """
+    workflow = dict(workflow)
+    node_ids = []
+    for node_id, node in workflow.items():
+        if isinstance(node, dict) and node.get('class_type') in SAVE_IMAGE_NODES:
+            workflow[node_id] = {
+                'class_type': 'SaveImageWebsocket',
+                'inputs': {'images': node['inputs']['images']}
+            }
+            node_ids.append(node_id)
+    return workflow, node_ids
+
+
+def websocket_output_name(workflow: Dict[str, Any], node_id: str, prompt_id: str, index: int,
+                          image_format: str) -> str:
+    """
+    Filename for an image pushed over the websocket, built from the filename_prefix
+    of the save node it replaced. Names starting with 'ComfyUI' are ComfyUI's
+    temporary files and are kept out of the history, so that prefix is not used.
+    """
+    node = workflow.get(node_id)
+    prefix = node.get('inputs', {}).get('filename_prefix') if isinstance(node, dict) else None
+    prefix = os.path.basename(prefix) if isinstance(prefix, str) else ''
+    if not prefix or prefix.startswith('ComfyUI'):
+        prefix = WEBSOCKET_OUTPUT_PREFIX
+    extension = 'jpg' if image_format == 'jpeg' else 'png'
+    return f"{prefix}_{prompt_id[:8]}_{node_id}_{index:05}.{extension}"
+
+
+def select_final_output(outputs: Dict[str, List[Tuple[Output, str]]]) -> Optional[Tuple[Output, str]]:
+    """Pick the last non-temporary file produced by the workflow"""
+    for node_id, files in reversed(list(outputs.items())):
+        for data, filename in reversed(files):
+            if not filename.startswith('ComfyUI_temp'):
+                return data, filename
+    return None
+
+
+def cleanup_job_files(job: GenerationJob):
+    """Delete the job's temporary input images and, if it was read from one, its workflow file"""
+    paths = list(job.temp_files)
+    if job.workflow_filename and job.workflow_on_disk:
+        paths.append(resolve_dataset_path(job.workflow_filename))
+
+    # Files written by the views carry the request uuid from the workflow filename
+    request_uuid = None
+    if job.workflow_filename and '_' in job.workflow_filename:
+        request_uuid = job.workflow_filename.split('_', 1)[1].rsplit('.', 1)[0]
+    if request_uuid and os.path.isdir(TEMP_DIR):
+        paths.extend(
+            os.path.join(TEMP_DIR, name) for name in os.listdir(TEMP_DIR)
+            if request_uuid in name
+        )
+
+    for path in paths:
+        try:
+            if path and os.path.isfile(path):
+                os.remove(path)
+                logger.debug(f"Deleted temporary file: {path}")
+        except Exception as e:
+            logger.error(f"Error removing temporary file {path}: {str(e)}")
+
+
+class ComfyEngine:
+    """
+    Executes generation jobs against ComfyUI from inside the running event loop.
+    Progress and results are handed to a reporter, which either updates Discord
+    directly (bot process) or posts to the bot's callback server (comfygen CLI).
+    In reference delivery mode outputs are not downloaded; the reporter receives
+    an OutputRef and the bot streams the file from ComfyUI or disk itself.
+    """
+
+    def __init__(self, backends: Union[str, Iterable[str]], reporter, workers: int = 1, session=None,
+                 cache: Optional[OutputCache] = None, delivery: str = DELIVERY_BYTES,
+                 fetch_concurrency: int = FETCH_CONCURRENCY, websocket_outputs: bool = False):
+        if isinstance(backends, str):
+            backends = [backends]
+        if delivery not in (DELIVERY_BYTES, DELIVERY_REFERENCE):
+            raise ValueError(f"Unknown output delivery mode: {delivery}")
+        self.pool = BackendPool(backends, session=session)
+        self.cache = cache
+        self.delivery = delivery
+        self._fetch_slots = asyncio.Semaphore(max(1, int(fetch_concurrency)))
+        self.websocket_outputs = websocket_outputs
+        # workflow hash -> future of the execution producing it, shared by identical jobs
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.reporter = reporter
+        self.worker_count = max(1, int(workers))
+        self._workers: List[asyncio.Task] = []
+
+    def start(self, queue: asyncio.Queue, job_factory: Callable[[Any], Awaitable[GenerationJob]]):
+        """Start the worker tasks consuming request items from the queue"""
+        self.pool.start()
+        for index in range(self.worker_count):
+            task = asyncio.create_task(self._worker(index, queue, job_factory))
+            self._workers.append(task)
+        logger.info(f"Started {self.worker_count} ComfyUI worker(s)")
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+        await self.pool.stop()
+
+    async def _worker(self, index: int, queue: asyncio.Queue, job_factory):
+        while True:
+            request_item = await queue.get()
+            try:
+                job = await job_factory(request_item)
+                await self.run_job(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in ComfyUI worker {index}: {e}", exc_info=True)
+            finally:
+                queue.task_done()
+
+    async def _progress(self, job: GenerationJob, progress_data: Dict[str, Any]):
+        try:
+            await self.reporter.progress(job, progress_data)
+        except Exception as e:
+            logger.error(f"Error sending progress update: {str(e)}")
+
+    async def _ensure_connected(self, job: GenerationJob, backend: Backend):
+        if backend.router.connected:
+            return
+        await self._progress(job, {
+            'status': 'connecting',
+            'message': 'Connecting to ComfyUI...'
+        })
+        if not await backend.router.wait_connected(CONNECT_TIMEOUT):
+            raise BackendUnavailable(f"Could not connect to ComfyUI at {backend.name}")
+
+    async def run_job(self, job: GenerationJob) -> Optional[GenerationResult]:
+        """Run one job end to end: queue, track progress, fetch and deliver the output"""
+        # Cache entries checked out for this job, kept on disk until it is delivered
+        pinned: List[str] = []
+        try:
+            if job.start_message:
+                await self._progress(job, {'status': 'starting', 'message': job.start_message})
+
+            final_output = await self._generate(job, pinned)
+            if not final_output:
+                logger.error("No final image found to send.")
+                await self._progress(job, {'status': 'error', 'message': 'No final image generated'})
+                return None
+
+            output, filename = final_output
+            if isinstance(output, OutputRef):
+                result = GenerationResult(job=job, filename=filename, ref=output)
+            else:
+                result = GenerationResult(job=job, filename=filename, data=output)
+            await self.reporter.deliver(job, result)
+
+            await self.reporter.record_history(job, result)
+            return result
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error during image generation: {str(e)}", exc_info=True)
+            await self._progress(job, {
+                'status': 'error',
+                'message': f'Error during generation: {str(e)}'
+            })
+            return None
+        finally:
+            for key in pinned:
+                await asyncio.to_thread(self.cache.release, key)
+            await asyncio.to_thread(cleanup_job_files, job)
+            try:
+                await self.reporter.finished(job)
+            except Exception as e:
+                logger.error(f"Error finalising request {job.request_id}: {str(e)}")
+
+    async def _generate(self, job: GenerationJob, pinned: List[str]) -> Optional[Tuple[Output, str]]:
+        """
+        Produce the job's final output: by joining an identical execution already
+        in flight, from the output cache when there is one, or by running the
+        workflow. Cache entries handed out by reference are added to pinned and
+        must be released.
+        """
+        key = workflow_key(job.workflow)
+        if self.cache is not None:
+            cached = await asyncio.to_thread(self._cache_get, key, pinned)
+            if cached is not None:
+                logger.info(f"Output cache hit for request {job.request_id}")
+                await self._progress(job, {
+                    "status": "complete",
+                    "message": "Generation complete!"
+                })
+                return cached
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            logger.info(f"Request {job.request_id} joined an identical generation in progress")
+            final_output = await asyncio.shield(inflight)
+            if final_output is not None and self.cache is not None:
+                final_output = await asyncio.to_thread(self._cache_ref, key, final_output, pinned)
+            return final_output
+
+        future = asyncio.get_running_loop().create_future()
+        # Nobody may be waiting on the future, so don't warn about unretrieved errors
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[key] = future
+        try:
+            final_output = select_final_output(await self._run_on_pool(job))
+            if final_output is not None and self.cache is not None:
+                await self._cache_put(key, *final_output)
+            future.set_result(final_output)
+            if final_output is not None and self.cache is not None:
+                final_output = await asyncio.to_thread(self._cache_ref, key, final_output, pinned)
+            return final_output
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def _cache_get(self, key: str, pinned: List[str]) -> Optional[Tuple[Output, str]]:
+        if self.delivery == DELIVERY_REFERENCE:
+            cached = self.cache.checkout(key)
+            if cached is None:
+                return None
+            pinned.append(key)
+            path, filename = cached
+            return OutputRef(filename=filename, path=path), filename
+        return self.cache.get(key)
+
+    def _cache_ref(self, key: str, final_output: Tuple[Output, str], pinned: List[str]) -> Tuple[Output, str]:
+        """Point a ComfyUI reference at the cached copy, checked out for this job, when there is one"""
+        output, filename = final_output
+        if not isinstance(output, OutputRef):
+            return final_output
+        cached = self.cache.checkout(key)
+        if cached is None:
+            # Not cached (too large, or already evicted): read it from ComfyUI
+            return final_output
+        pinned.append(key)
+        return OutputRef(filename=filename, path=cached[0]), filename
+
+    async def _cache_put(self, key: str, output: Output, filename: str):
+        """Store a fresh output; references are streamed from ComfyUI into the cache"""
+        if not isinstance(output, OutputRef):
+            await asyncio.to_thread(self.cache.put, key, output, filename)
+            return
+
+        client = self.pool.client_for(output.server)
+        if client is None:
+            return
+        temp_path = self.cache.staging_path(key, filename)
+        try:
+            await client.save_output(output.filename, output.subfolder, output.type, temp_path)
+        except Exception as e:
+            logger.warning(f"Could not cache output {output.filename}: {e}")
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return
+        await asyncio.to_thread(self.cache.adopt, key, temp_path, filename)
+
+    async def _run_on_pool(self, job: GenerationJob) -> Dict[str, List[Tuple[Output, str]]]:
+        """Run the job on the least busy backend, moving it to another one if that backend fails"""
+        family = model_family(job.workflow)
+        tried = set()
+        while True:
+            backend = self.pool.acquire(exclude=tried, family=family)
+            try:
+                await self._ensure_connected(job, backend)
+
+                # Only clear ComfyUI's cache when the job needs different models
+                if backend.loaded_family != family:
+                    await backend.router.send_json({"type": "clear_cache"})
+                    logger.debug(f"Sent clear_cache message to ComfyUI at {backend.name}")
+                    backend.loaded_family = family
+
+                await self._progress(job, {
+                    'status': 'loading_models',
+                    'message': 'Loading models and preparing generation...'
+                })
+
+                return await self.get_outputs(job, backend)
+
+            except BACKEND_ERRORS as e:
+                tried.add(backend.name)
+                self.pool.mark_failed(backend)
+                if len(tried) >= len(self.pool):
+                    raise
+                logger.warning(f"ComfyUI backend {backend.name} failed for request {job.request_id}: {e}, requeueing")
+                await self._progress(job, {
+                    'status': 'connecting',
+                    'message': 'ComfyUI server stopped responding, moving to another server...'
+                })
+            finally:
+                self.pool.release(backend)
+
+    async def _fetch(self, backend: Backend, file_info: Dict[str, Any]) -> Output:
+        """Download an output file, or just reference it in reference delivery mode"""
+        filename = file_info['filename']
+        subfolder = file_info.get('subfolder', '')
+        folder_type = file_info.get('type', 'output')
+        if self.delivery == DELIVERY_REFERENCE:
+            return OutputRef(filename=filename, subfolder=subfolder, type=folder_type, server=backend.name)
+        async with self._fetch_slots:
+            return await backend.client.get_output(filename, subfolder, folder_type)
+
+    async def get_outputs(self, job: GenerationJob, backend: Backend) -> Dict[str, List[Tuple[Output, str]]]:
+        """Queue the workflow on a backend, follow its progress and collect every output file"""
+        client, router = backend.client, backend.router
+
+        workflow, image_nodes = job.workflow, []
+        if self.websocket_outputs:
+            workflow, image_nodes = use_websocket_outputs(job.workflow)
+
+        # Subscribe before queueing so no event can slip past the router
+        prompt_id = str(uuid.uuid4())
+        events = router.subscribe(prompt_id, image_nodes)
+        try:
+            prompt_response = await client.queue_prompt(workflow, router.client_id, prompt_id)
+            if 'prompt_id' not in prompt_response:
+                raise ValueError("No prompt_id in response from queue_prompt")
+
+            if prompt_response['prompt_id'] != prompt_id:
+                # Older servers assign their own id; the router kept its early events
+                router.unsubscribe(prompt_id)
+                prompt_id = prompt_response['prompt_id']
+                events = router.subscribe(prompt_id, image_nodes)
+
+            pushed_images = await self._follow_prompt(job, backend, prompt_id, events)
+        finally:
+            router.unsubscribe(prompt_id)
+
+        if pushed_images:
+            # Images arrived over the websocket; no /history or /view round-trips needed
+            return pushed_images
+        if image_nodes:
+            logger.warning(f"No websocket images received for prompt {prompt_id}, checking history")
+
+        history = (await client.get_history(prompt_id))[prompt_id]
+        logger.debug(f"Available outputs in history: {list(history['outputs'].keys())}")
+
+        # Decide what to fetch from the metadata alone, so temp previews are never downloaded
+        wanted = []
+        for node_id, node_output in history['outputs'].items():
+            # VHS_VideoCombine reports its mp4 under 'gifs'
+            if 'gifs' in node_output:
+                video = next((g for g in node_output['gifs'] if g['filename'].endswith('.mp4')), None)
+                if video:
+                    wanted.append((node_id, video))
+            elif 'images' in node_output:
+                wanted.extend(
+                    (node_id, image) for image in node_output['images'] if not is_temp_output(image)
+                )
+
+        # Downloads share the client's keep-alive connections and run concurrently up to the cap
+        fetched = await asyncio.gather(*(self._fetch(backend, file_info) for _, file_info in wanted))
+
+        output_images = {}
+        for (node_id, file_info), data in zip(wanted, fetched):
+            output_images.setdefault(node_id, []).append((data, file_info['filename']))
+        logger.debug(f"Fetched {len(wanted)} output file(s) for prompt {prompt_id}")
+
+        if not output_images:
+            logger.error(f"History outputs: {history['outputs']}")
+            raise ValueError("No outputs generated from workflow")
+
+        return output_images
+
+    async def _follow_prompt(self, job: GenerationJob, backend: Backend, prompt_id: str,
+                             events: asyncio.Queue) -> Dict[str, List[Tuple[bytes, str]]]:
+        """
+        Relay the router's events for one prompt until it finishes. Returns the
+        images pushed over the websocket by SaveImageWebsocket nodes, by node id.
+        """
+        last_milestone = 0
+        pushed_images: Dict[str, List[Tuple[bytes, str]]] = {}
+
+        while True:
+            message = await events.get()
+            message_type = message.get('type')
+            data = message.get('data') or {}
+
+            if message_type == 'execution_start':
+                await self._progress(job, {
+                    "status": "execution",
+                    "message": "Starting execution..."
+                })
+
+            elif message_type == 'executing':
+                if data.get('node') is None:
+                    break
+
+            elif message_type == 'progress':
+                progress = int((data['value'] / data['max']) * 100)
+                current_milestone = (progress // 10) * 10
+                if current_milestone > last_milestone:
+                    await self._progress(job, {
+                        "status": "generating",
+                        "progress": progress
+                    })
+                    last_milestone = current_milestone
+
+            elif message_type == OUTPUT_IMAGE:
+                images = pushed_images.setdefault(data['node'], [])
+                filename = websocket_output_name(job.workflow, data['node'], prompt_id, len(images), data['format'])
+                images.append((data['image'], filename))
+
+            elif message_type in ('execution_error', 'execution_interrupted'):
+                raise RuntimeError(data.get('exception_message') or f"ComfyUI reported {message_type}")
+
+            elif message_type == DISCONNECTED:
+                if not await backend.router.wait_connected(RECONNECT_GRACE):
+                    raise BackendUnavailable(f"Lost connection to ComfyUI at {backend.name}")
+
+            elif message_type == RECONNECTED:
+                # Completion may have been sent while the socket was down
+                if prompt_id in await backend.client.get_history(prompt_id):
+                    break
+                # A restarted server forgets its queue
+                if not await backend.has_prompt(prompt_id):
+                    raise BackendUnavailable(f"ComfyUI at {backend.name} lost prompt {prompt_id}")
+
+        await self._progress(job, {
+            "status": "complete",
+            "message": "Generation complete!"
+        })
+        return pushed_images
@@ -0,0 +1,351 @@
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from Main.utils import generate_random_seed
+
+from .residency import model_family
+from . import loras as lora_registry
+from .bindings import BindingError
+from .templates import DATASET_DIRS, WorkflowInstance, plan_for
+
+logger = logging.getLogger(__name__)
+
+TEMP_DIR = os.path.join('Main', 'DataSets', 'temp')
+
+
+@dataclass
+class GenerationJob:
+    """A fully prepared ComfyUI job, independent of how it was requested"""
+    request_id: str
+    user_id: str
+    channel_id: str
+    interaction_id: str
+    original_message_id: str
+    request_type: str
+    workflow: Dict[str, Any]
+    prompt: str
+    resolution: str
+    loras: List[str] = field(default_factory=list)
+    upscale_factor: int = 1
+    seed: Optional[int] = None
+    upscaled_resolution: Optional[str] = None
+    workflow_filename: Optional[str] = None
+    workflow_on_disk: bool = False
+    temp_files: List[str] = field(default_factory=list)
+    start_message: Optional[str] = None
+
+    def __post_init__(self):
+        if self.upscaled_resolution is None:
+            self.upscaled_resolution = self.resolution
+
+
+def resolve_dataset_path(filename: str) -> str:
+    """Return the path of a file in the Datasets directory, whichever casing exists"""
+    for directory in DATASET_DIRS:
+        path = os.path.join(directory, filename)
+        if os.path.exists(path):
+            return path
+    return os.path.join(DATASET_DIRS[-1], filename)
+
+
+def open_workflow(workflow_filename: str) -> Dict[str, Any]:
+    """Opens and loads workflow file from DataSets directory with validation"""
+    workflow_path = resolve_dataset_path(workflow_filename)
+    logger.debug(f"Opening workflow file: {workflow_path}")
+    try:
+        with open(workflow_path, "r", encoding="utf-8") as f:
+            content = f.read().strip()
+
+        # Remove any BOM characters that might be present
+        if content.startswith('\ufeff'):
+            content = content[1:]
+
+        workflow = json.loads(content)
+        if not isinstance(workflow, dict):
+            raise ValueError("Workflow must be a dictionary")
+
+        logger.debug(f"Successfully loaded workflow with {len(workflow)} nodes")
+        return workflow
+
+    except FileNotFoundError:
+        logger.error(f"Workflow file not found: {workflow_path}")
+        raise
+    except json.JSONDecodeError as e:
+        logger.error(f"JSON parsing error in workflow: {e}")
+        raise
+
+
+def apply_standard_parameters(workflow, prompt, resolution, loras, upscale_factor, seed):
+    """Re-applies the /comfy parameters to a saved workflow; non-Flux workflows are left as they are"""
+    try:
+        # Copy-on-write overlay: only the nodes patched below are copied
+        workflow = WorkflowInstance(workflow)
+        try:
+            plan = plan_for(workflow, 'flux')
+        except BindingError:
+            logger.debug("Workflow has no Flux bindings, keeping its saved parameters")
+            return workflow
+
+        registry = lora_registry.current()
+        stack = [(lora, registry.weight(lora)) for lora in loras if lora in registry]
+
+        plan.apply(
+            workflow,
+            prompt=prompt,
+            resolution=resolution,
+            loras=stack,
+            upscale_factor=upscale_factor,
+            seed=seed
+        )
+        logger.debug(f"Updated LoRAs in workflow: {len(stack)} LoRAs configured")
+        return workflow
+
+    except Exception as e:
+        logger.error(f"Error updating workflow: {str(e)}")
+        raise ValueError(f"Failed to update workflow: {str(e)}")
+
+
+def _comfy_path(path: str) -> str:
+    return os.path.abspath(path).replace('\\', '/')
+
+
+def build_standard_job(request_id, user_id, channel_id, interaction_id, original_message_id,
+                       prompt, resolution, loras, upscale_factor, workflow_filename, seed=None, workflow=None):
+    """
+    Standard /comfy, /pulid and /video generation. A workflow passed in memory was
+    already parameterised by the command that queued it, so only the seed is set;
+    otherwise the saved workflow file is read and re-parameterised.
+    """
+    try:
+        seed = int(seed) if seed is not None and str(seed) != "None" else generate_random_seed()
+    except ValueError:
+        seed = generate_random_seed()
+    logger.debug(f"Using seed: {seed}")
+
+    on_disk = workflow is None
+    if on_disk:
+        workflow = apply_standard_parameters(
+            open_workflow(workflow_filename),
+            prompt,
+            resolution,
+            loras,
+            upscale_factor,
+            seed
+        )
+    else:
+        workflow = WorkflowInstance(workflow)
+        try:
+            plan_for(workflow, 'flux').apply(workflow, seed=seed)
+        except BindingError:
+            pass
+
+    return GenerationJob(
+        request_id=request_id,
+        user_id=user_id,
+        channel_id=channel_id,
+        interaction_id=interaction_id,
+        original_message_id=original_message_id,
+        request_type='standard',
+        workflow=workflow,
+        prompt=prompt,
+        resolution=resolution,
+        loras=list(loras),
+        upscale_factor=int(upscale_factor),
+        seed=seed,
+        workflow_filename=workflow_filename,
+        workflow_on_disk=on_disk,
+        start_message='Starting Generation process...'
+    )
+
+
+def build_redux_job(request_id, user_id, channel_id, interaction_id, original_message_id,
+                    resolution, strength1, strength2, workflow_filename, image1_path, image2_path,
+                    workflow=None):
+    """Redux generation from two reference images"""
+    on_disk = workflow is None
+    workflow = open_workflow(workflow_filename) if on_disk else WorkflowInstance(workflow)
+    seed = generate_random_seed()
+
+    plan_for(workflow, 'redux').apply(
+        workflow,
+        image1=_comfy_path(image1_path),
+        image2=_comfy_path(image2_path),
+        strength1=float(strength1),
+        strength2=float(strength2),
+        resolution=resolution,
+        seed=seed
+    )
+    logger.debug(f"Set random seed for redux: {seed}")
+
+    return GenerationJob(
+        request_id=request_id,
+        user_id=user_id,
+        channel_id=channel_id,
+        interaction_id=interaction_id,
+        original_message_id=original_message_id,
+        request_type='redux',
+        workflow=workflow,
+        prompt="Redux image generation",
+        resolution=resolution,
+        seed=seed,
+        workflow_filename=workflow_filename,
+        workflow_on_disk=on_disk,
+        temp_files=[image1_path, image2_path]
+    )
+
+
+def build_reduxprompt_job(request_id, user_id, channel_id, interaction_id, original_message_id,
+                          prompt, resolution, strength, workflow_filename, image_path, workflow=None):
+    """Redux generation from one reference image and a prompt"""
+    on_disk = workflow is None
+    workflow = open_workflow(workflow_filename) if on_disk else WorkflowInstance(workflow)
+    seed = generate_random_seed()
+
+    plan_for(workflow, 'reduxprompt').apply(
+        workflow,
+        image=_comfy_path(image_path),
+        prompt=prompt,
+        strength=strength,
+        resolution=resolution,
+        seed=seed
+    )
+    logger.debug(f"Set random seed for reduxprompt: {seed}")
+
+    return GenerationJob(
+        request_id=request_id,
+        user_id=user_id,
+        channel_id=channel_id,
+        interaction_id=interaction_id,
+        original_message_id=original_message_id,
+        request_type='reduxprompt',
+        workflow=workflow,
+        prompt=prompt,
+        resolution=resolution,
+        workflow_filename=workflow_filename,
+        workflow_on_disk=on_disk,
+        temp_files=[image_path],
+        start_message='Loading workflow and preparing generation...'
+    )
+
+
+def build_video_job(request_id, user_id, channel_id, interaction_id, original_message_id,
+                    prompt, workflow_filename, workflow=None):
+    """Video generation"""
+    on_disk = workflow is None
+    workflow = open_workflow(workflow_filename) if on_disk else WorkflowInstance(workflow)
+    seed = generate_random_seed()
+
+    plan_for(workflow, 'video').apply(workflow, seed=seed, prompt=prompt)
+
+    return GenerationJob(
+        request_id=request_id,
+        user_id=user_id,
+        channel_id=channel_id,
+        interaction_id=interaction_id,
+        original_message_id=original_message_id,
+        request_type='video',
+        workflow=workflow,
+        prompt=prompt,
+        resolution="video",
+        seed=seed,
+        workflow_filename=workflow_filename,
+        workflow_on_disk=on_disk,
+        start_message='Starting video generation process...'
+    )
+
+
+def save_redux_images(request_item) -> List[str]:
+    """Write the two uploaded redux images to the temp directory"""
+    temp_dir = os.path.abspath(TEMP_DIR)
+    os.makedirs(temp_dir, exist_ok=True)
+
+    paths = []
+    for filename, data in ((request_item.image1_filename, request_item.image1),
+                           (request_item.image2_filename, request_item.image2)):
+        path = os.path.join(temp_dir, filename)
+        with open(path, 'wb') as f:
+            f.write(data)
+        paths.append(path.replace('\\', '/'))
+
+    logger.debug(f"Saved images at: {paths}")
+    return paths
+
+
+def discard_request_files(request_item):
+    """Remove the files a request wrote before it was queued, for requests that never run"""
+    paths = []
+    if request_item.workflow is None and request_item.workflow_filename:
+        paths.append(resolve_dataset_path(request_item.workflow_filename))
+    image_path = getattr(request_item, 'image_path', None)
+    if image_path:
+        paths.append(image_path)
+
+    for path in paths:
+        try:
+            if os.path.isfile(path):
+                os.remove(path)
+        except Exception as e:
+            logger.error(f"Error removing request file {path}: {str(e)}")
+
+
+def request_model_family(request_item) -> str:
+    """Model family of a queued request's workflow; empty if unknown"""
+    try:
+        workflow = request_item.workflow
+        if workflow is None:
+            workflow = open_workflow(request_item.workflow_filename)
+        return model_family(workflow)
+    except Exception as e:
+        logger.warning(f"Could not determine models for {request_item.workflow_filename}: {e}")
+        return ''
+
+
+def job_from_request_item(request_id: str, request_item) -> GenerationJob:
+    """Build a GenerationJob from one of the bot's queued request items"""
+    from Main.custom_commands.models import ReduxRequestItem, ReduxPromptRequestItem
+
+    common = dict(
+        request_id=request_id,
+        user_id=request_item.user_id,
+        channel_id=request_item.channel_id,
+        interaction_id=request_item.interaction_id,
+        original_message_id=request_item.original_message_id
+    )
+
+    if isinstance(request_item, ReduxRequestItem):
+        image1_path, image2_path = save_redux_images(request_item)
+        return build_redux_job(
+            **common,
+            resolution=request_item.resolution,
+            strength1=request_item.strength1,
+            strength2=request_item.strength2,
+            workflow_filename=request_item.workflow_filename,
+            image1_path=image1_path,
+            image2_path=image2_path,
+            workflow=request_item.workflow
+        )
+
+    if isinstance(request_item, ReduxPromptRequestItem):
+        return build_reduxprompt_job(
+            **common,
+            prompt=request_item.prompt,
+            resolution=request_item.resolution,
+            strength=request_item.strength,
+            workflow_filename=request_item.workflow_filename,
+            image_path=request_item.image_path,
+            workflow=request_item.workflow
+        )
+
+    return build_standard_job(
+        **common,
+        prompt=request_item.prompt,
+        resolution=request_item.resolution,
+        loras=request_item.loras,
+        upscale_factor=request_item.upscale_factor,
+        workflow_filename=request_item.workflow_filename,
+        seed=request_item.seed,
+        workflow=request_item.workflow
+    )
@@ -0,0 +1,93 @@
+import logging
+import re
+import threading
+from types import MappingProxyType
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from Main.utils import load_json
+
+logger = logging.getLogger(__name__)
+
+LORA_FILE = 'lora.json'
+
+
+def _weight(entry: Mapping[str, Any]) -> float:
+    try:
+        return float(entry.get('weight', 1.0))
+    except (TypeError, ValueError):
+        logger.warning(f"Invalid weight for LoRA {entry.get('name', entry.get('file'))}, using 1.0")
+        return 1.0
+
+
+class LoraRegistry:
+    """
+    Read-only snapshot of lora.json, indexed by file and display name, with each
+    LoRA's weight and trigger words worked out once. A reload builds a new registry
+    and swaps it in with install(); code holding the old one keeps a consistent view.
+    """
+
+    def __init__(self, entries: Iterable[Mapping[str, Any]] = ()):
+        self.entries: Tuple[Mapping[str, Any], ...] = tuple(
+            MappingProxyType(dict(entry)) for entry in entries if entry.get('file')
+        )
+        self.by_file = MappingProxyType({entry['file']: entry for entry in self.entries})
+        self.by_name = MappingProxyType({entry['name']: entry for entry in self.entries if entry.get('name')})
+        self.weights = MappingProxyType({entry['file']: _weight(entry) for entry in self.entries})
+        self.trigger_words = MappingProxyType({
+            entry['file']: str(entry['add_prompt']).strip()
+            for entry in self.entries if str(entry.get('add_prompt') or '').strip()
+        })
+        # Longest first so a trigger word that prefixes another is not matched early
+        triggers = sorted(set(self.trigger_words.values()), key=len, reverse=True)
+        self._trigger_pattern = re.compile(
+            r',?\s*(?:' + '|'.join(re.escape(t) for t in triggers) + r'),?\s*', re.IGNORECASE
+        ) if triggers else None
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> 'LoraRegistry':
+        return cls(config.get('available_loras', []))
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, lora_file: str) -> bool:
+        return lora_file in self.by_file
+
+    def get(self, lora_file: str) -> Optional[Mapping[str, Any]]:
+        return self.by_file.get(lora_file)
+
+    def weight(self, lora_file: str, default: float = 1.0) -> float:
+        return self.weights.get(lora_file, default)
+
+    def triggers_for(self, lora_files: Iterable[str]) -> List[str]:
+        """Trigger words of the given LoRAs, in order, skipping LoRAs without any"""
+        return [self.trigger_words[f] for f in lora_files if f in self.trigger_words]
+
+    def strip_triggers(self, prompt: str) -> str:
+        """Remove every known trigger word from a prompt and tidy the leftover commas"""
+        if self._trigger_pattern is not None:
+            prompt = self._trigger_pattern.sub(', ', prompt)
+        return re.sub(r'\s*,\s*,\s*', ', ', prompt).strip(' ,')
+
+
+_registry = LoraRegistry()
+_lock = threading.Lock()
+
+
+def current() -> LoraRegistry:
+    """The registry in use; take one reference per request rather than re-reading it"""
+    return _registry
+
+
+def install(registry: LoraRegistry) -> LoraRegistry:
+    """Atomically replace the shared registry"""
+    global _registry
+    with _lock:
+        _registry = registry
+    logger.info(f"LoRA registry updated with {len(registry)} entries")
+    return registry
+
+
+def load_registry() -> LoraRegistry:
+    """Read lora.json from Main/Datasets and install it as the shared registry"""
+    return install(LoraRegistry.from_config(load_json(LORA_FILE)))
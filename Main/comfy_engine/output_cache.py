@@ -0,0 +1,180 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+KEY_SEPARATOR = '-'
+
+
+def workflow_key(workflow: Dict[str, Any]) -> str:
+    """Canonical hash of a fully parameterised workflow"""
+    canonical = json.dumps(workflow, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class OutputCache:
+    """
+    Content-addressed store of final outputs on disk, keyed by workflow hash.
+    Files are named '<key>-<original filename>' so the index can be rebuilt from
+    the directory at startup. Least recently used entries are evicted once the
+    total size exceeds max_bytes; entries checked out for delivery are not evicted
+    until released. Methods block on disk I/O and are meant to be called through
+    asyncio.to_thread.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[str, str, int]]" = OrderedDict()
+        self._total_bytes = 0
+        # key -> number of deliveries still reading the entry's file
+        self._pins: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        files = []
+        for name in os.listdir(self.directory):
+            key, sep, filename = name.partition(KEY_SEPARATOR)
+            path = os.path.join(self.directory, name)
+            if not sep or len(key) != 64 or not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            files.append((stat.st_mtime, key, path, filename, stat.st_size))
+
+        # Oldest first, so the most recently written entries survive eviction longest
+        for _, key, path, filename, size in sorted(files):
+            self._entries[key] = (path, filename, size)
+            self._total_bytes += size
+        self._evict()
+        logger.info(f"Output cache loaded {len(self._entries)} entries ({self._total_bytes // (1024 * 1024)} MB)")
+
+    def get(self, key: str) -> Optional[Tuple[bytes, str]]:
+        """Return (data, filename) for a cached output, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+        path, filename, _ = entry
+
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            logger.warning(f"Dropping unreadable cache entry {path}: {e}")
+            self._remove(key)
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data, filename
+
+    def checkout(self, key: str) -> Optional[Tuple[str, str]]:
+        """
+        Return (absolute path, filename) of a cached output without reading it, or
+        None. The entry stays on disk until release(key) is called.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            self._pins[key] = self._pins.get(key, 0) + 1
+        path, filename, _ = entry
+        if not os.path.isfile(path):
+            self.release(key)
+            self._remove(key)
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return os.path.abspath(path), filename
+
+    def release(self, key: str):
+        """End a checkout; the entry may be evicted again"""
+        with self._lock:
+            count = self._pins.get(key, 0) - 1
+            if count > 0:
+                self._pins[key] = count
+            else:
+                self._pins.pop(key, None)
+        self._evict()
+
+    def _entry_path(self, key: str, filename: str) -> str:
+        return os.path.join(self.directory, f"{key}{KEY_SEPARATOR}{os.path.basename(filename)}")
+
+    def staging_path(self, key: str, filename: str) -> str:
+        """Temporary path to write an entry to before handing it to adopt()"""
+        return f"{self._entry_path(key, filename)}.tmp"
+
+    def put(self, key: str, data: bytes, filename: str):
+        if len(data) > self.max_bytes:
+            return
+        temp_path = self.staging_path(key, filename)
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+        except OSError as e:
+            logger.error(f"Error writing cache entry {temp_path}: {e}")
+            return
+        self.adopt(key, temp_path, filename)
+
+    def adopt(self, key: str, temp_path: str, filename: str):
+        """Move a file written to staging_path() into the cache"""
+        path = self._entry_path(key, filename)
+        try:
+            size = os.path.getsize(temp_path)
+            if size > self.max_bytes:
+                os.remove(temp_path)
+                return
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.error(f"Error writing cache entry {path}: {e}")
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._total_bytes -= previous[2]
+            self._entries[key] = (path, filename, size)
+            self._total_bytes += size
+        self._evict()
+
+    def _remove(self, key: str):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return
+            self._total_bytes -= entry[2]
+        try:
+            os.remove(entry[0])
+        except OSError:
+            pass
+
+    def _evict(self):
+        while True:
+            with self._lock:
+                if self._total_bytes <= self.max_bytes:
+                    return
+                # Least recently used first, skipping entries being delivered
+                key = next((k for k in self._entries if k not in self._pins), None)
+                if key is None:
+                    return
+                path, _, size = self._entries.pop(key)
+                self._total_bytes -= size
+            try:
+                os.remove(path)
+                logger.debug(f"Evicted cached output {path}")
+            except OSError as e:
+                logger.warning(f"Error evicting cached output {path}: {e}")
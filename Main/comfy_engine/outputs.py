@@ -0,0 +1,85 @@
+import logging
+import os
+import tempfile
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable, Optional
+
+from .client import ComfyClient
+
+logger = logging.getLogger(__name__)
+
+DELIVERY_BYTES = 'bytes'
+DELIVERY_REFERENCE = 'reference'
+
+
+@dataclass(frozen=True)
+class OutputRef:
+    """
+    Where a finished output lives, handed to the bot instead of the file contents.
+    Either a ComfyUI /view location on a backend or a path on a filesystem the bot
+    can read (the output cache, or a ComfyUI output directory shared with the bot).
+    """
+    filename: str
+    subfolder: str = ''
+    type: str = 'output'
+    server: str = ''
+    path: str = ''
+
+
+def _inside(path: str, root: str) -> bool:
+    """Whether path, with symlinks resolved, lies within the root directory"""
+    root = os.path.realpath(root)
+    return os.path.commonpath([os.path.realpath(path), root]) == root
+
+
+def shared_output_path(ref: OutputRef, output_dir: Optional[str], cache_dir: Optional[str] = None) -> Optional[str]:
+    """
+    The ref's file inside a ComfyUI output directory mounted locally, or the
+    output cache, if it exists. Paths outside those directories are never used.
+    """
+    if ref.path:
+        if not any(root and _inside(ref.path, root) for root in (output_dir, cache_dir)):
+            logger.warning(f"Refusing output path outside the output directories: {ref.path}")
+            return None
+        return ref.path if os.path.isfile(ref.path) else None
+    if not output_dir or ref.type != 'output':
+        return None
+    path = os.path.normpath(os.path.join(output_dir, ref.subfolder, ref.filename))
+    # Never follow a subfolder or filename out of the shared directory
+    if not _inside(path, output_dir):
+        return None
+    return path if os.path.isfile(path) else None
+
+
+@asynccontextmanager
+async def open_output(ref: OutputRef, client_for: Callable[[str], Optional[ComfyClient]],
+                      output_dir: Optional[str] = None, cache_dir: Optional[str] = None) -> AsyncIterator[str]:
+    """
+    Yield a local path holding the output. Files in the shared output directory or
+    the output cache are used in place; anything else is streamed from its ComfyUI
+    server, which must be one of client_for's backends, into a temporary file that
+    is removed when the block exits. The contents are never held in memory.
+    """
+    path = shared_output_path(ref, output_dir, cache_dir)
+    if path is not None:
+        yield path
+        return
+
+    if not ref.server:
+        raise FileNotFoundError(f"Output {ref.filename} is not available locally and has no server")
+    client = client_for(ref.server)
+    if client is None:
+        raise ValueError(f"Output server {ref.server} is not a configured ComfyUI backend")
+
+    suffix = os.path.splitext(ref.filename)[1]
+    fd, temp_path = tempfile.mkstemp(prefix='comfy_output_', suffix=suffix)
+    os.close(fd)
+    try:
+        await client.save_output(ref.filename, ref.subfolder, ref.type, temp_path)
+        yield temp_path
+    finally:
+        try:
+            os.remove(temp_path)
+        except OSError as e:
+            logger.warning(f"Error removing temporary output {temp_path}: {e}")
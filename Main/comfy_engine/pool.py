@@ -0,0 +1,143 @@
+import asyncio
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from .client import ComfyClient
+from .router import PromptRouter
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 5  # seconds
+DEFAULT_PORT = 8188
+
+
+class BackendUnavailable(ConnectionError):
+    """A ComfyUI backend stopped responding; the job can be retried elsewhere"""
+
+
+def parse_backend_address(address: str):
+    """Split 'host' or 'host:port' into (host, port)"""
+    address = address.strip()
+    if address.startswith('http://'):
+        address = address[len('http://'):]
+    address = address.rstrip('/')
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit():
+        return host, int(port)
+    return address, DEFAULT_PORT
+
+
+class Backend:
+    """One ComfyUI server: its HTTP client, shared websocket and last known load"""
+
+    def __init__(self, address: str, session=None):
+        host, port = parse_backend_address(address)
+        self.name = f"{host}:{port}"
+        self.client = ComfyClient(host, port=port, session=session)
+        self.router = PromptRouter(self.client)
+        self.healthy = True
+        self.queue_depth = 0
+        self.dispatched_since_poll = 0
+        self.active_jobs = 0
+        self.system_stats: Dict[str, Any] = {}
+        # Model family of the last job queued here, i.e. what is most likely resident on the GPU
+        self.loaded_family: Optional[str] = None
+
+    @property
+    def pending_work(self) -> int:
+        # /queue already counts everything dispatched before the last poll
+        return self.queue_depth + self.dispatched_since_poll
+
+    async def poll(self):
+        """Refresh queue depth and system stats; marks the backend unhealthy on failure"""
+        try:
+            queue = await self.client.get_queue()
+            self.system_stats = await self.client.get_system_stats()
+        except Exception as e:
+            if self.healthy:
+                logger.warning(f"ComfyUI backend {self.name} failed health check: {e}")
+            self.healthy = False
+            # A server that went away has to load its models again
+            self.loaded_family = None
+            return
+
+        self.queue_depth = len(queue.get('queue_running', [])) + len(queue.get('queue_pending', []))
+        self.dispatched_since_poll = 0
+        if not self.healthy:
+            logger.info(f"ComfyUI backend {self.name} is healthy again")
+        self.healthy = True
+
+    async def has_prompt(self, prompt_id: str) -> bool:
+        """True if the prompt is still running or waiting on this backend"""
+        queue = await self.client.get_queue()
+        for item in queue.get('queue_running', []) + queue.get('queue_pending', []):
+            if len(item) > 1 and item[1] == prompt_id:
+                return True
+        return False
+
+
+class BackendPool:
+    """Health-checked set of ComfyUI backends with least-pending-work selection"""
+
+    def __init__(self, addresses: Iterable[str], session=None, poll_interval: float = POLL_INTERVAL):
+        self.backends: List[Backend] = [Backend(address, session=session) for address in addresses]
+        if not self.backends:
+            raise ValueError("At least one ComfyUI backend must be configured")
+        self.poll_interval = poll_interval
+        self._poll_task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self.backends)
+
+    def start(self):
+        for backend in self.backends:
+            backend.router.start()
+        if self._poll_task is None or self._poll_task.done():
+            self._poll_task = asyncio.create_task(self._poll_loop())
+
+    async def stop(self):
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+            await asyncio.gather(self._poll_task, return_exceptions=True)
+            self._poll_task = None
+        for backend in self.backends:
+            await backend.router.stop()
+            await backend.client.close()
+
+    async def _poll_loop(self):
+        while True:
+            await asyncio.gather(*(backend.poll() for backend in self.backends))
+            await asyncio.sleep(self.poll_interval)
+
+    def client_for(self, name: str) -> Optional[ComfyClient]:
+        """HTTP client of the backend with the given 'host:port' name, if it is in the pool"""
+        return next((b.client for b in self.backends if b.name == name), None)
+
+    def acquire(self, exclude: Optional[Set[str]] = None, family: Optional[str] = None) -> Backend:
+        """
+        Pick the backend with the least pending work, preferring healthy ones and,
+        between equally busy ones, the one that already has the job's models loaded
+        """
+        exclude = exclude or set()
+        candidates = [b for b in self.backends if b.name not in exclude]
+        if not candidates:
+            raise BackendUnavailable("No ComfyUI backend is available")
+
+        # Health data may be stale; an unhealthy backend is still worth a try if nothing else is left
+        healthy = [b for b in candidates if b.healthy]
+        backend = min(
+            healthy or candidates,
+            key=lambda b: (b.pending_work, family is not None and b.loaded_family != family, b.active_jobs)
+        )
+        backend.dispatched_since_poll += 1
+        backend.active_jobs += 1
+        return backend
+
+    def release(self, backend: Backend):
+        backend.active_jobs = max(0, backend.active_jobs - 1)
+
+    def mark_failed(self, backend: Backend):
+        if backend.healthy:
+            logger.warning(f"Marking ComfyUI backend {backend.name} as unavailable")
+        backend.healthy = False
+        backend.loaded_family = None
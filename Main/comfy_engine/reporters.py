@@ -0,0 +1,81 @@
+import asyncio
+import logging
+from typing import Any, Dict
+
+import aiohttp
+
+from Main.database import add_to_history
+
+logger = logging.getLogger(__name__)
+
+RETRIES = 3
+RETRY_DELAY = 1  # seconds
+
+
+class HttpReporter:
+    """Reports progress and results to the bot's callback server (used by the comfygen CLI)"""
+
+    def __init__(self, bot_server: str, session: aiohttp.ClientSession, port: int = 8080):
+        self.base_url = f"http://{bot_server}:{port}"
+        self.session = session
+
+    async def _post(self, path: str, json=None, form_factory=None) -> bool:
+        retry_delay = RETRY_DELAY
+        for attempt in range(RETRIES):
+            try:
+                # Multipart bodies can only be sent once, so rebuild them per attempt
+                data = form_factory() if form_factory else None
+                async with self.session.post(f"{self.base_url}{path}", json=json, data=data) as response:
+                    if response.status == 200:
+                        return True
+                    logger.warning(f"POST {path} failed with status {response.status}: {await response.text()}")
+                    return False
+            except aiohttp.ClientError as e:
+                if attempt < RETRIES - 1:
+                    logger.warning(f"Attempt {attempt + 1} failed, retrying in {retry_delay} seconds...")
+                    await asyncio.sleep(retry_delay)
+                    retry_delay *= 2
+                else:
+                    logger.error(f"All retry attempts failed: {str(e)}")
+                    raise
+        return False
+
+    async def progress(self, job, progress_data: Dict[str, Any]):
+        await self._post('/update_progress', json={
+            'request_id': job.request_id,
+            'progress_data': progress_data
+        })
+        logger.debug(f"Progress update sent: {progress_data}")
+
+    async def deliver(self, job, result):
+        def build_form():
+            form = aiohttp.FormData()
+            for name, value in result.form_fields().items():
+                form.add_field(name, value)
+            if result.is_video:
+                form.add_field('video_data', result.data, filename=result.filename, content_type='video/mp4')
+            else:
+                form.add_field('image_data', result.data, filename=result.filename)
+            return form
+
+        if result.ref is not None:
+            # The bot only trusts output references from its own engine
+            raise ValueError("Output references cannot be sent to the bot; use bytes delivery")
+
+        if await self._post('/send_image', form_factory=build_form):
+            logger.info(f"Successfully sent {'video' if result.is_video else 'image'}")
+        else:
+            raise RuntimeError(f"Failed to send {'video' if result.is_video else 'image'} to the bot")
+
+    async def record_history(self, job, result):
+        # The bot batches history writes from every worker into one transaction
+        try:
+            if await self._post('/history', json=result.history_record()):
+                return
+        except aiohttp.ClientError:
+            pass
+        logger.warning(f"Bot did not accept history for {job.request_id}, writing it directly")
+        await add_to_history.aio(**result.history_record())
+
+    async def finished(self, job):
+        pass
@@ -0,0 +1,39 @@
+import logging
+from typing import Any, Dict, Set
+
+logger = logging.getLogger(__name__)
+
+MODEL_EXTENSIONS = ('.safetensors', '.gguf', '.ckpt', '.pt', '.pth', '.bin', '.sft')
+
+
+def _referenced_nodes(workflow: Dict[str, Any]) -> Set[str]:
+    """Ids of nodes whose output feeds another node"""
+    referenced = set()
+    for node in workflow.values():
+        if not isinstance(node, dict):
+            continue
+        for value in node.get('inputs', {}).values():
+            if isinstance(value, list) and len(value) == 2 and isinstance(value[0], str):
+                referenced.add(value[0])
+    return referenced
+
+
+def model_family(workflow: Dict[str, Any]) -> str:
+    """
+    Identify the large models a workflow keeps resident on the GPU: the model files
+    named by its loader nodes, ignoring LoRAs and loaders nothing is wired to (the
+    templates carry both a GGUF and a safetensors UNet loader, only one of them
+    connected). Workflows with the same family can run back to back without a reload.
+    """
+    referenced = _referenced_nodes(workflow)
+    files = set()
+    for node_id, node in workflow.items():
+        if not isinstance(node, dict) or node_id not in referenced:
+            continue
+        class_type = str(node.get('class_type', ''))
+        if 'loader' not in class_type.lower() or 'lora' in class_type.lower():
+            continue
+        for value in node.get('inputs', {}).values():
+            if isinstance(value, str) and value.lower().endswith(MODEL_EXTENSIONS):
+                files.add(value)
+    return '|'.join(sorted(files))
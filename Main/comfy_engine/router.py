@@ -0,0 +1,211 @@
+import asyncio
+import json
+import logging
+import struct
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from aiohttp import WSMsgType
+
+logger = logging.getLogger(__name__)
+
+RECONNECT_DELAY = 1  # seconds
+MAX_RECONNECT_DELAY = 30  # seconds
+BACKLOG_PROMPTS = 64  # prompts whose early events are held until someone subscribes
+BACKLOG_EVENTS = 256  # events kept per unclaimed prompt
+
+# Synthetic events pushed to every subscriber when the socket drops and when it
+# comes back; events sent while it was down are lost, so jobs re-check /history
+RECONNECTED = 'reconnected'
+DISCONNECTED = 'disconnected'
+
+# Event for an image pushed as a binary frame by a SaveImageWebsocket node
+OUTPUT_IMAGE = 'output_image'
+PREVIEW_IMAGE_EVENT = 1  # ComfyUI BinaryEventTypes.PREVIEW_IMAGE
+IMAGE_FORMATS = {1: 'jpeg', 2: 'png'}
+
+
+class PromptRouter:
+    """
+    Keeps one websocket open to a ComfyUI server and hands each message to the
+    queue of the prompt it belongs to. All jobs on the server share the router's
+    client_id, so ComfyUI only has to fan progress out to a single socket.
+    Binary image frames carry no prompt id; they are attributed to the node that
+    is executing and only forwarded for nodes a subscriber asked for.
+    """
+
+    def __init__(self, client, client_id: Optional[str] = None):
+        self.client = client
+        self.client_id = client_id or str(uuid.uuid4())
+        self._subscribers: Dict[str, asyncio.Queue] = {}
+        self._backlog: OrderedDict[str, List[Dict[str, Any]]] = OrderedDict()
+        self._ws = None
+        self._task: Optional[asyncio.Task] = None
+        self._connected = asyncio.Event()
+        self._executing_prompt: Optional[str] = None
+        self._executing_node: Optional[str] = None
+        self._image_nodes: Dict[str, Set[str]] = {}
+
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    def start(self):
+        """Start the connection loop; safe to call more than once"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._ws is not None and not self._ws.closed:
+            await self._ws.close()
+        self._connected.clear()
+
+    async def wait_connected(self, timeout: Optional[float] = None) -> bool:
+        self.start()
+        try:
+            await asyncio.wait_for(self._connected.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def subscribe(self, prompt_id: str, image_nodes: Iterable[str] = ()) -> asyncio.Queue:
+        """
+        Return the event queue for a prompt, including anything received before subscribing.
+        Images pushed over the socket by any of image_nodes arrive as OUTPUT_IMAGE events.
+        """
+        if image_nodes:
+            self._image_nodes[prompt_id] = set(image_nodes)
+        queue = self._subscribers.get(prompt_id)
+        if queue is None:
+            queue = asyncio.Queue()
+            self._subscribers[prompt_id] = queue
+            for event in self._backlog.pop(prompt_id, ()):
+                queue.put_nowait(event)
+        return queue
+
+    def unsubscribe(self, prompt_id: str):
+        self._subscribers.pop(prompt_id, None)
+        self._backlog.pop(prompt_id, None)
+        self._image_nodes.pop(prompt_id, None)
+
+    async def send_json(self, message: Dict[str, Any]):
+        if self._ws is None or self._ws.closed:
+            raise ConnectionError("ComfyUI websocket is not connected")
+        await self._ws.send_str(json.dumps(message))
+
+    async def _run(self):
+        delay = RECONNECT_DELAY
+        first_connection = True
+        while True:
+            try:
+                self._ws = await self.client.connect_websocket(self.client_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"ComfyUI websocket connection to {self.client.ws_url} failed: {e}, "
+                               f"retrying in {delay}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+                continue
+
+            logger.info(f"Connected to ComfyUI websocket at {self.client.ws_url}")
+            delay = RECONNECT_DELAY
+            self._connected.set()
+            if not first_connection:
+                self._broadcast({'type': RECONNECTED, 'data': {}})
+            first_connection = False
+
+            try:
+                async for msg in self._ws:
+                    if msg.type == WSMsgType.TEXT:
+                        self._dispatch_text(msg.data)
+                    elif msg.type == WSMsgType.BINARY:
+                        self._dispatch_binary(msg.data)
+                    elif msg.type in (WSMsgType.CLOSED, WSMsgType.ERROR):
+                        break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"ComfyUI websocket error: {e}")
+            finally:
+                self._connected.clear()
+                self._executing_prompt = None
+                self._executing_node = None
+                self._broadcast({'type': DISCONNECTED, 'data': {}})
+
+            logger.warning(f"ComfyUI websocket at {self.client.ws_url} disconnected, reconnecting")
+            await asyncio.sleep(delay)
+
+    def _dispatch_text(self, raw: str):
+        try:
+            message = json.loads(raw)
+        except json.JSONDecodeError as e:
+            logger.error(f"Error parsing WebSocket message: {e}")
+            return
+
+        data = message.get('data') or {}
+        prompt_id = data.get('prompt_id') if isinstance(data, dict) else None
+        message_type = message.get('type')
+
+        if message_type == 'execution_start':
+            self._executing_prompt = prompt_id
+            self._executing_node = None
+        elif message_type == 'executing':
+            self._executing_node = data.get('node')
+            if self._executing_node is None:
+                self._executing_prompt = None
+            elif prompt_id is not None:
+                self._executing_prompt = prompt_id
+
+        # Older ComfyUI builds omit prompt_id from progress frames
+        if prompt_id is None and message_type == 'progress':
+            prompt_id = self._executing_prompt
+        if prompt_id is None:
+            return
+
+        self._deliver(prompt_id, message)
+
+    def _dispatch_binary(self, raw: bytes):
+        # Frame layout: 4-byte event type, 4-byte image format, then the encoded image
+        if len(raw) < 8:
+            return
+        event, image_format = struct.unpack('>II', raw[:8])
+        prompt_id, node = self._executing_prompt, self._executing_node
+        # Sampler previews use the same event; only frames from a watched save node are outputs
+        if event != PREVIEW_IMAGE_EVENT or prompt_id is None or node not in self._image_nodes.get(prompt_id, ()):
+            return
+
+        queue = self._subscribers.get(prompt_id)
+        if queue is not None:
+            queue.put_nowait({
+                'type': OUTPUT_IMAGE,
+                'data': {
+                    'prompt_id': prompt_id,
+                    'node': node,
+                    'format': IMAGE_FORMATS.get(image_format, 'png'),
+                    'image': raw[8:]
+                }
+            })
+
+    def _deliver(self, prompt_id: str, message: Dict[str, Any]):
+        queue = self._subscribers.get(prompt_id)
+        if queue is not None:
+            queue.put_nowait(message)
+            return
+
+        events = self._backlog.get(prompt_id)
+        if events is None:
+            events = self._backlog[prompt_id] = []
+            if len(self._backlog) > BACKLOG_PROMPTS:
+                self._backlog.popitem(last=False)
+        if len(events) < BACKLOG_EVENTS:
+            events.append(message)
+
+    def _broadcast(self, message: Dict[str, Any]):
+        for queue in self._subscribers.values():
+            queue.put_nowait(message)
@@ -0,0 +1,230 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WEIGHT = 1.0
+# Queued users an affinity lookup may examine, keeping get() bounded
+AFFINITY_SCAN_LIMIT = 64
+
+
+class _Flow:
+    """A user's queue of jobs inside a guild"""
+    __slots__ = ('key', 'jobs', 'tag', 'last_finish')
+
+    def __init__(self, key: str):
+        self.key = key
+        self.jobs: Deque[Tuple[Any, float, str]] = deque()
+        self.tag = 0.0
+        self.last_finish = 0.0
+
+
+class _Guild:
+    """A guild's active users, ordered by virtual start tag"""
+    __slots__ = ('key', 'flows', 'heap', 'vtime', 'tag', 'last_finish', 'size')
+
+    def __init__(self, key: str):
+        self.key = key
+        self.flows: Dict[str, _Flow] = {}
+        self.heap: List[Tuple[float, int, _Flow]] = []
+        self.vtime = 0.0
+        self.tag = 0.0
+        self.last_finish = 0.0
+        self.size = 0
+
+
+class FairScheduler:
+    """
+    Drop-in replacement for the request asyncio.Queue that serves jobs by
+    hierarchical weighted fair queueing: guilds share the workers in proportion
+    to their weights, and each guild's share is split between its users the same
+    way. Each user's own jobs stay FIFO. put and get are O(log n) in the number
+    of active guilds and users.
+
+    With an affinity window, a job using the same model family as the previous one
+    may be served ahead of the fair choice, as long as its guild and user are no
+    more than affinity_window virtual time units behind, so same-model jobs run back
+    to back without GPU model swaps and nobody is delayed by more than the window.
+    The lookup walks only the heap entries inside the window, at most
+    AFFINITY_SCAN_LIMIT of them, and tombstones the entries it takes instead of
+    removing them, so get stays O(log n).
+    """
+
+    def __init__(self, affinity_window: float = 0.0):
+        self._guilds: Dict[str, _Guild] = {}
+        self._heap: List[Tuple[float, int, _Guild]] = []
+        self._vtime = 0.0
+        self._seq = itertools.count()
+        self._size = 0
+        self._unfinished = 0
+        self._not_empty = asyncio.Event()
+        self._all_done = asyncio.Event()
+        self._all_done.set()
+        self.user_weights: Dict[str, float] = {}
+        self.guild_weights: Dict[str, float] = {}
+        self.affinity_window = affinity_window
+        self._last_family = ''
+        # Sequence numbers of heap entries taken out of order by the affinity lookup
+        self._dead: Set[int] = set()
+
+    def qsize(self) -> int:
+        return self._size
+
+    def empty(self) -> bool:
+        return self._size == 0
+
+    def set_weights(self, user_weights: Dict[str, float] = None, guild_weights: Dict[str, float] = None):
+        if user_weights is not None:
+            self.user_weights = dict(user_weights)
+        if guild_weights is not None:
+            self.guild_weights = dict(guild_weights)
+
+    def set_user_weight(self, user_id: str, weight: float):
+        """Takes effect from the user's next scheduled job"""
+        self.user_weights[user_id] = weight
+
+    def set_guild_weight(self, guild_id: str, weight: float):
+        self.guild_weights[guild_id] = weight
+
+    def _weight(self, weights: Dict[str, float], key: str) -> float:
+        return max(weights.get(key, DEFAULT_WEIGHT), 0.01)
+
+    async def put(self, item, user_id: str = '', guild_id: str = '', cost: float = 1.0, family: str = ''):
+        self.put_nowait(item, user_id, guild_id, cost, family)
+
+    def put_nowait(self, item, user_id: str = '', guild_id: str = '', cost: float = 1.0, family: str = ''):
+        guild = self._guilds.get(guild_id)
+        if guild is None:
+            guild = self._guilds[guild_id] = _Guild(guild_id)
+        flow = guild.flows.get(user_id)
+        if flow is None:
+            flow = guild.flows[user_id] = _Flow(user_id)
+
+        flow.jobs.append((item, cost, family))
+        if len(flow.jobs) == 1:
+            # Idle flows restart at the guild's virtual time and cannot bank credit
+            flow.tag = max(guild.vtime, flow.last_finish)
+            heapq.heappush(guild.heap, (flow.tag, next(self._seq), flow))
+
+        guild.size += 1
+        if guild.size == 1:
+            guild.tag = max(self._vtime, guild.last_finish)
+            heapq.heappush(self._heap, (guild.tag, next(self._seq), guild))
+
+        self._size += 1
+        self._unfinished += 1
+        self._all_done.clear()
+        self._not_empty.set()
+
+    def get_nowait(self):
+        if self._size == 0:
+            raise asyncio.QueueEmpty
+
+        guild, flow = self._pop_affine() or self._pop_fair()
+        self._vtime = max(self._vtime, guild.tag)
+        guild.vtime = max(guild.vtime, flow.tag)
+        item, cost, self._last_family = flow.jobs.popleft()
+
+        flow.last_finish = flow.tag + cost / self._weight(self.user_weights, flow.key)
+        if flow.jobs:
+            flow.tag = flow.last_finish
+            heapq.heappush(guild.heap, (flow.tag, next(self._seq), flow))
+
+        guild.size -= 1
+        guild.last_finish = guild.tag + cost / self._weight(self.guild_weights, guild.key)
+        if guild.size:
+            guild.tag = guild.last_finish
+            heapq.heappush(self._heap, (guild.tag, next(self._seq), guild))
+        else:
+            self._clear(guild.heap)
+
+        self._size -= 1
+        if self._size == 0:
+            self._clear(self._heap)
+            self._not_empty.clear()
+        return item
+
+    def _prune(self, heap: List[Tuple[float, int, Any]]):
+        """Drop tombstoned entries from the top of a heap"""
+        while heap and heap[0][1] in self._dead:
+            self._dead.discard(heapq.heappop(heap)[1])
+
+    def _clear(self, heap: List[Tuple[float, int, Any]]):
+        """Empty a heap that holds only tombstoned entries"""
+        for entry in heap:
+            self._dead.discard(entry[1])
+        heap.clear()
+
+    def _within(self, heap: List[Tuple[float, int, Any]], limit: float) -> Iterator[Tuple[float, int, Any]]:
+        """Live entries with a tag up to limit, visiting only that part of the heap"""
+        pending = [0]
+        while pending:
+            i = pending.pop()
+            if i >= len(heap) or heap[i][0] > limit:
+                # Children never have a smaller tag than their parent
+                continue
+            if heap[i][1] not in self._dead:
+                yield heap[i]
+            pending.extend((2 * i + 1, 2 * i + 2))
+
+    def _pop_fair(self) -> Tuple[_Guild, _Flow]:
+        self._prune(self._heap)
+        _, _, guild = heapq.heappop(self._heap)
+        self._prune(guild.heap)
+        _, _, flow = heapq.heappop(guild.heap)
+        return guild, flow
+
+    def _pop_affine(self) -> Optional[Tuple[_Guild, _Flow]]:
+        """
+        Pop the earliest flow whose next job shares the last job's model family,
+        if it lies within the affinity window of the fair choice
+        """
+        if self.affinity_window <= 0 or not self._last_family:
+            return None
+        self._prune(self._heap)
+        head_guild = self._heap[0][2]
+        self._prune(head_guild.heap)
+        if head_guild.heap[0][2].jobs[0][2] == self._last_family:
+            return None
+
+        best = None
+        budget = AFFINITY_SCAN_LIMIT
+        for guild_entry in self._within(self._heap, head_guild.tag + self.affinity_window):
+            guild = guild_entry[2]
+            self._prune(guild.heap)
+            for flow_entry in self._within(guild.heap, guild.heap[0][0] + self.affinity_window):
+                budget -= 1
+                if flow_entry[2].jobs[0][2] == self._last_family:
+                    if best is None or (guild_entry[0], flow_entry[0]) < (best[0][0], best[1][0]):
+                        best = (guild_entry, flow_entry)
+                if budget <= 0:
+                    break
+            if budget <= 0:
+                break
+        if best is None:
+            return None
+
+        # Tombstone both entries; they are dropped when they reach the top of their heap
+        guild_entry, flow_entry = best
+        self._dead.add(guild_entry[1])
+        self._dead.add(flow_entry[1])
+        return guild_entry[2], flow_entry[2]
+
+    async def get(self):
+        while self._size == 0:
+            await self._not_empty.wait()
+        return self.get_nowait()
+
+    def task_done(self):
+        if self._unfinished <= 0:
+            raise ValueError('task_done() called too many times')
+        self._unfinished -= 1
+        if self._unfinished == 0:
+            self._all_done.set()
+
+    async def join(self):
+        await self._all_done.wait()
@@ -0,0 +1,162 @@
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from .bindings import MANIFEST_FILE, BindingError, PatchPlan, compile_plan, manifest_entry
+
+logger = logging.getLogger(__name__)
+
+DATASET_DIRS = [
+    os.path.join('Main', 'Datasets'),
+    os.path.join('Main', 'DataSets')
+]
+
+
+class WorkflowInstance(dict):
+    """
+    Copy-on-write view of a workflow. Node dicts are shared with the base workflow
+    until a node is looked up by key, at which point that node and its inputs are
+    copied, so `workflow['69']['inputs']['prompt'] = ...` only ever touches this
+    instance. Nodes reached by iterating (values(), items()) are the shared ones and
+    must be treated as read-only. `template` names the template it came from, if any.
+    """
+
+    def __init__(self, base: Dict[str, Any], template: Optional[str] = None):
+        super().__init__(base)
+        self._owned = set()
+        self.template = template if template is not None else getattr(base, 'template', None)
+
+    def __getitem__(self, node_id):
+        node = super().__getitem__(node_id)
+        if node_id not in self._owned and isinstance(node, dict):
+            node = dict(node)
+            if isinstance(node.get('inputs'), dict):
+                node['inputs'] = dict(node['inputs'])
+            super().__setitem__(node_id, node)
+            self._owned.add(node_id)
+        return node
+
+    def __setitem__(self, node_id, node):
+        super().__setitem__(node_id, node)
+        self._owned.add(node_id)
+
+    def get(self, node_id, default=None):
+        return self[node_id] if node_id in self else default
+
+    def copy(self) -> 'WorkflowInstance':
+        return WorkflowInstance(self, self.template)
+
+
+def _resolve_template(filename: str) -> str:
+    for directory in DATASET_DIRS:
+        path = os.path.join(directory, filename)
+        if os.path.exists(path):
+            return path
+    if os.path.exists(filename):
+        return filename
+    raise FileNotFoundError(f"Workflow template not found: {filename}")
+
+
+def _parse(path: str) -> Dict[str, Any]:
+    with open(path, 'rb') as f:
+        raw = f.read()
+    try:
+        text = raw.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        logger.warning(f"UTF-8 decode failed for {path}, trying ISO-8859-1")
+        text = raw.decode('iso-8859-1')
+    try:
+        workflow = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Invalid JSON format in {path}: {str(e)}")
+    if not isinstance(workflow, dict):
+        raise ValueError(f"Workflow {path} must be a dictionary")
+    return workflow
+
+
+class TemplateCache:
+    """
+    Parsed workflow templates from Main/Datasets, each read from disk once and
+    re-read when its modification time or size changes
+    """
+
+    def __init__(self):
+        self._templates: Dict[str, Tuple[Tuple[int, int], Dict[str, Any]]] = {}
+        self._plans: Dict[str, Tuple[Dict[str, Any], Dict[str, Any], PatchPlan]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, filename: str) -> Dict[str, Any]:
+        """The shared parsed template; never modify it, use instance() instead"""
+        path = _resolve_template(filename)
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._templates.get(path)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+
+        workflow = _parse(path)
+        with self._lock:
+            self._templates[path] = (version, workflow)
+        logger.debug(f"Parsed workflow template {path} ({len(workflow)} nodes)")
+        return workflow
+
+    def instance(self, filename: str) -> WorkflowInstance:
+        """A copy-on-write workflow to fill in for one job"""
+        return WorkflowInstance(self.get(filename), os.path.basename(filename))
+
+    def plan(self, filename: str) -> PatchPlan:
+        """
+        The template's patch plan from the binding manifest, compiled and checked
+        against the template once and again whenever either file changes
+        """
+        workflow = self.get(filename)
+        manifest = self.get(MANIFEST_FILE)
+        name = os.path.basename(filename)
+        with self._lock:
+            cached = self._plans.get(name)
+            if cached is not None and cached[0] is workflow and cached[1] is manifest:
+                return cached[2]
+
+        family, parameters = manifest_entry(manifest, name)
+        plan = compile_plan(family, workflow, parameters, name)
+        with self._lock:
+            self._plans[name] = (workflow, manifest, plan)
+        logger.debug(f"Compiled {len(plan.bindings)} bindings for {name}")
+        return plan
+
+    def plan_for(self, workflow: Dict[str, Any], family: Optional[str] = None) -> PatchPlan:
+        """
+        Patch plan for a workflow: from the template it was loaded from, otherwise
+        from the first manifest entry (or the named family) that the workflow satisfies
+        """
+        template = getattr(workflow, 'template', None)
+        if template is not None:
+            plan = self.plan(template)
+            if family is not None and plan.family != family:
+                raise BindingError(f"{template} is a {plan.family} workflow, not {family}")
+            return plan
+        manifest = self.get(MANIFEST_FILE)
+        for name, entry in manifest.items():
+            if family is not None and name != family:
+                continue
+            try:
+                return compile_plan(name, workflow, entry['parameters'])
+            except BindingError:
+                continue
+        raise BindingError("Workflow does not match any binding manifest entry")
+
+
+templates = TemplateCache()
+
+
+def load_template(filename: str) -> WorkflowInstance:
+    """Copy-on-write instance of a workflow template from the shared cache"""
+    return templates.instance(filename)
+
+
+def plan_for(workflow: Dict[str, Any], family: Optional[str] = None) -> PatchPlan:
+    """Patch plan for a workflow instance from the shared cache"""
+    return templates.plan_for(workflow, family)
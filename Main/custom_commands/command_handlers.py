@@ -11,16 +11,18 @@ import uuid
 import json
 import os
 import re
-from Main.utils import load_json, generate_random_seed, save_json
+from Main.comfy_engine.templates import load_template, plan_for
+from Main.utils import load_json, generate_random_seed
 from Main.database import (
     is_user_banned, ban_user, get_banned_words, add_user_warning, 
     get_user_warnings, remove_user_warnings, get_all_warnings, add_banned_word, 
-    remove_banned_word, unban_user, get_ban_info, get_all_banned_users
+    remove_banned_word, unban_user, get_ban_info, get_all_banned_users, set_queue_weight
 )
 from .banned_utils import check_banned
+from .queue_utils import check_queue_capacity
 from .views import CreativityModal, LoRAView, LoraInfoView, ReduxPromptModal, PulidModal
 from .image_processing import process_image_request
-from config import ENABLE_PROMPT_ENHANCEMENT, AI_PROVIDER, fluxversion
+from config import ENABLE_PROMPT_ENHANCEMENT, AI_PROVIDER, fluxversion, BOT_MANAGER_ROLE_ID
 from ..LMstudio_bot.ai_providers import AIProviderFactory
 from .workflow_utils import update_workflow
 from .models import RequestItem
@@ -67,7 +69,7 @@ async def on_app_command_error(interaction: discord.Interaction, error: app_comm
 def has_admin_or_bot_manager_role():
     async def predicate(interaction: discord.Interaction):
         is_admin = interaction.user.guild_permissions.administrator
-        has_role = any(role.id == 1055096424235516936 for role in interaction.user.roles)
+        has_role = any(role.id == BOT_MANAGER_ROLE_ID for role in interaction.user.roles)
         if is_admin or has_role:
             return True
         await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
@@ -99,9 +101,7 @@ async def setup_commands(bot: commands.Bot):
     @check_channel()
     async def lorainfo(interaction: discord.Interaction):
         try:
-            loras_data = load_json('lora.json')
-            available_loras = loras_data.get('available_loras', [])
-            view = LoraInfoView(available_loras)
+            view = LoraInfoView(bot.lora_registry.entries)
             await interaction.response.send_message(
                 content=view.get_page_content(),
                 view=view,
@@ -131,10 +131,13 @@ async def setup_commands(bot: commands.Bot):
             logger.info(f"Comfy command invoked by {interaction.user.id}")
             
             # Check for banned words first, before any other processing
-            is_banned, message = check_banned(str(interaction.user.id), prompt)
+            is_banned, message = await check_banned(str(interaction.user.id), prompt)
             if message:  # If there's a message, either a warning or ban
                 await interaction.response.send_message(message, ephemeral=True)
                 return  # Don't continue with image generation if banned word is detected
+
+            if not await check_queue_capacity(interaction):
+                return
             
             # Show creativity modal or process directly based on prompt enhancement setting
             if ENABLE_PROMPT_ENHANCEMENT:
@@ -168,6 +171,9 @@ async def setup_commands(bot: commands.Bot):
 
             logger.debug(f"Received reduxprompt command with resolution: {resolution}, strength: {strength}")
 
+            if not await check_queue_capacity(interaction):
+                return
+
             # Show the modal for prompt input first
             modal = ReduxPromptModal(bot, resolution, strength)
             await interaction.response.send_modal(modal)
@@ -231,7 +237,7 @@ async def setup_commands(bot: commands.Bot):
             await interaction.response.defer(ephemeral=True)
             
             word = word.lower()
-            add_banned_word(word)
+            await add_banned_word.aio(word)
             await interaction.followup.send(f"Added '{word}' to the banned words list.", ephemeral=True)
         except Exception as e:
             logger.error(f"Error in add_banned_word command: {str(e)}")
@@ -244,13 +250,13 @@ async def setup_commands(bot: commands.Bot):
     @app_commands.checks.has_permissions(administrator=True)
     async def remove_banned_word_command(interaction: discord.Interaction, word: str):
         word = word.lower()
-        remove_banned_word(word)
+        await remove_banned_word.aio(word)
         await interaction.response.send_message(f"Removed '{word}' from the banned words list.", ephemeral=True)
 
     @bot.tree.command(name="list_banned_words", description="List all banned words")
     @app_commands.checks.has_permissions(administrator=True)
     async def list_banned_words(interaction: discord.Interaction):
-        banned_words = get_banned_words()
+        banned_words = await get_banned_words.aio()
         if banned_words:
             await interaction.response.send_message(f"Banned words: {', '.join(banned_words)}", ephemeral=True)
         else:
@@ -259,7 +265,7 @@ async def setup_commands(bot: commands.Bot):
     @bot.tree.command(name="ban_user", description="Ban a user from using the comfy command")
     @app_commands.checks.has_permissions(administrator=True)
     async def ban_user_command(interaction: discord.Interaction, user: discord.User, reason: str):
-        ban_user(str(user.id), reason)
+        await ban_user.aio(str(user.id), reason)
         await interaction.response.send_message(f"Banned {user.name} from using the comfy command. Reason: {reason}", ephemeral=True)
 
     @bot.tree.command(name="unban_user", description="Unban a user from using the comfy command")
@@ -269,7 +275,7 @@ async def setup_commands(bot: commands.Bot):
             # Defer the response first
             await interaction.response.defer(ephemeral=True)
             
-            if unban_user(str(user.id)):
+            if await unban_user.aio(str(user.id)):
                 await interaction.followup.send(f"Unbanned {user.name} from using the comfy command.", ephemeral=True)
             else:
                 await interaction.followup.send(f"{user.name} is not banned.", ephemeral=True)
@@ -284,7 +290,7 @@ async def setup_commands(bot: commands.Bot):
     @app_commands.checks.has_permissions(administrator=True)
     async def whybanned(interaction: discord.Interaction, user: discord.User):
         try:
-            ban_info = get_ban_info(str(user.id))
+            ban_info = await get_ban_info.aio(str(user.id))
             if ban_info:
                 await interaction.response.send_message(
                     f"{user.name} was banned on {ban_info['banned_at']} for the following reason: {ban_info['reason']}", 
@@ -303,7 +309,7 @@ async def setup_commands(bot: commands.Bot):
     @app_commands.checks.has_permissions(administrator=True)
     async def list_banned_users(interaction: discord.Interaction):
         try:
-            banned_users = get_all_banned_users()
+            banned_users = await get_all_banned_users.aio()
             if not banned_users:
                 await interaction.response.send_message("No users are currently banned.", ephemeral=True)
                 return
@@ -342,7 +348,7 @@ async def setup_commands(bot: commands.Bot):
             await interaction.response.defer(ephemeral=True)
             
             # Get current warnings
-            current_warnings = get_user_warnings(str(user.id))
+            current_warnings = await get_user_warnings.aio(str(user.id))
             
             if current_warnings == 0:
                 await interaction.followup.send(
@@ -352,7 +358,7 @@ async def setup_commands(bot: commands.Bot):
                 return
                 
             # Remove all warnings
-            success, message = remove_user_warnings(str(user.id))
+            success, message = await remove_user_warnings.aio(str(user.id))
             
             if success:
                 await interaction.followup.send(
@@ -389,7 +395,7 @@ async def setup_commands(bot: commands.Bot):
             # Defer the response first since we might need time to process
             await interaction.response.defer(ephemeral=True)
             
-            success, result = get_all_warnings()
+            success, result = await get_all_warnings.aio()
             
             if not success:
                 await interaction.followup.send(result, ephemeral=True)
@@ -518,6 +524,32 @@ async def setup_commands(bot: commands.Bot):
             logger.error(f"Error in sync_commands: {str(e)}", exc_info=True)
             await interaction.followup.send(f"An error occurred: {str(e)}")
 
+    @bot.tree.command(name="queue_weight", description="Set a user's or this server's share of the generation queue")
+    @has_admin_or_bot_manager_role()
+    @app_commands.describe(
+        weight="Relative share of the queue (default is 1.0)",
+        user="User to set the weight for; leave empty to set this server's weight"
+    )
+    async def queue_weight(interaction: discord.Interaction, weight: app_commands.Range[float, 0.1, 10.0],
+                           user: Optional[discord.Member] = None):
+        try:
+            if user is not None:
+                await set_queue_weight.aio('user', str(user.id), weight)
+                bot.subprocess_queue.set_user_weight(str(user.id), weight)
+                target = user.mention
+            elif interaction.guild_id:
+                await set_queue_weight.aio('guild', str(interaction.guild_id), weight)
+                bot.subprocess_queue.set_guild_weight(str(interaction.guild_id), weight)
+                target = "this server"
+            else:
+                await interaction.response.send_message("Specify a user when using this command outside a server.", ephemeral=True)
+                return
+
+            await interaction.response.send_message(f"Queue weight for {target} set to {weight}.", ephemeral=True)
+        except Exception as e:
+            logger.error(f"Error in queue_weight command: {str(e)}", exc_info=True)
+            await interaction.response.send_message(f"An error occurred: {str(e)}", ephemeral=True)
+
     @bot.tree.command(name="pulid", description="Generate an image using PuLID workflow with a reference image")
     @check_channel()
     @app_commands.describe(
@@ -531,6 +563,9 @@ async def setup_commands(bot: commands.Bot):
         try:
             logger.debug(f"Received pulid command with resolution: {resolution}")
 
+            if not await check_queue_capacity(interaction):
+                return
+
             # Show the modal for prompt input
             modal = PulidModal(bot, resolution)
             await interaction.response.send_modal(modal)
@@ -550,11 +585,14 @@ async def setup_commands(bot: commands.Bot):
     async def video(interaction: discord.Interaction, prompt: str):
         try:
             # Check for banned words first
-            is_banned, message = check_banned(str(interaction.user.id), prompt)
+            is_banned, message = await check_banned(str(interaction.user.id), prompt)
             if message:
                 await interaction.response.send_message(message, ephemeral=True)
                 return
 
+            if not await check_queue_capacity(interaction):
+                return
+
             # Send initial response
             await interaction.response.defer()
             original_message = await interaction.followup.send(
@@ -569,17 +607,14 @@ async def setup_commands(bot: commands.Bot):
             workflow_filename = f'Video_{request_uuid}.json'
 
             # Load and modify the video workflow
-            workflow = load_json('Video.json')
+            workflow = load_template('Video.json')
             
             # Generate random seed
             seed = generate_random_seed()
             
             # Update workflow nodes
-            workflow['3']['inputs']['seed'] = seed  # Update seed
-            workflow['44']['inputs']['text'] = prompt  # Update prompt
+            plan_for(workflow).apply(workflow, seed=seed, prompt=prompt)
             
-            # Save the modified workflow
-            save_json(workflow_filename, workflow)
 
             # Create request item - matching the existing structure
             request_item = RequestItem(
@@ -593,11 +628,12 @@ async def setup_commands(bot: commands.Bot):
                 loras=[],  # Empty list as videos don't use LoRAs
                 upscale_factor=1,  # Default value
                 workflow_filename=workflow_filename,
+                workflow=workflow,
                 seed=seed
             )
 
             # Add to processing queue
-            await interaction.client.subprocess_queue.put(request_item)
+            await interaction.client.enqueue_request(request_item)
 
         except Exception as e:
             logger.error(f"Error in video command: {str(e)}")
@@ -654,7 +690,7 @@ async def setup_commands(bot: commands.Bot):
                 await interaction.response.defer(ephemeral=True)
                 
                 # Check for banned words first
-                is_banned, message = check_banned(str(interaction.user.id), self.prompt)
+                is_banned, message = await check_banned(str(interaction.user.id), self.prompt)
                 if message:  # If there's a warning or ban message
                     await interaction.followup.send(message, ephemeral=True)
                     if is_banned:  # If the user is banned, stop processing
@@ -662,15 +698,10 @@ async def setup_commands(bot: commands.Bot):
 
                 # Clean prompt of any existing LoRA trigger words and timestamps
                 base_prompt = re.sub(r'\s*\(Timestamp:.*?\)', '', self.prompt)
-                lora_config = load_json('lora.json')
+                registry = interaction.client.lora_registry
                 
                 # Remove existing LoRA trigger words from base prompt
-                for lora in lora_config['available_loras']:
-                    if lora.get('prompt'):
-                        base_prompt = base_prompt.replace(lora['prompt'], '').strip()
-                
-                # Clean up multiple commas and whitespace
-                base_prompt = re.sub(r'\s*,\s*,\s*', ', ', base_prompt).strip(' ,')
+                base_prompt = registry.strip_triggers(base_prompt)
                 
                 if ENABLE_PROMPT_ENHANCEMENT and interaction.client.ai_provider:
                     # Send "Please wait" message before enhancement
@@ -720,7 +751,7 @@ async def setup_commands(bot: commands.Bot):
                         logger.info("Prompt enhancement disabled, using original prompt")
 
                 # Check enhanced prompt for banned words
-                is_banned, message = check_banned(str(interaction.user.id), enhanced_prompt)
+                is_banned, message = await check_banned(str(interaction.user.id), enhanced_prompt)
                 if message:  # If there's a warning or ban message
                     await interaction.followup.send(message, ephemeral=True)
                     if is_banned:  # If the user is banned, stop processing
@@ -765,14 +796,7 @@ async def setup_commands(bot: commands.Bot):
                     pass
                 
                 # Get LoRA trigger words for currently selected LoRAs
-                additional_prompts = []
-                for lora_file in selected_loras:
-                    lora_info = next(
-                        (l for l in lora_config['available_loras'] if l['file'] == lora_file),
-                        None
-                    )
-                    if lora_info and lora_info.get('add_prompt') and lora_info['add_prompt'].strip():
-                        additional_prompts.append(lora_info['add_prompt'].strip())
+                additional_prompts = registry.triggers_for(selected_loras)
                 
                 # Construct final prompt with new trigger words
                 full_prompt = enhanced_prompt
@@ -787,7 +811,7 @@ async def setup_commands(bot: commands.Bot):
                 # Use the seed from instance variable, or generate new one if None
                 current_seed = self.seed if self.seed is not None else generate_random_seed()
                 
-                workflow = load_json(f'{fluxversion}')
+                workflow = load_template(f'{fluxversion}')
                 request_uuid = str(uuid.uuid4())
                 
                 workflow = update_workflow(
@@ -800,7 +824,6 @@ async def setup_commands(bot: commands.Bot):
                 )
 
                 workflow_filename = f'{fluxversion}_{request_uuid}.json'
-                save_json(workflow_filename, workflow)
 
                 original_message = await interaction.followup.send(
                     "🔄 Starting generation process...",
@@ -818,9 +841,10 @@ async def setup_commands(bot: commands.Bot):
                     loras=selected_loras,
                     upscale_factor=self.upscale_factor,
                     workflow_filename=workflow_filename,
+                    workflow=workflow,
                     seed=current_seed
                 )
-                await interaction.client.subprocess_queue.put(request_item)
+                await interaction.client.enqueue_request(request_item)
                 
             except ValueError:
                 await interaction.followup.send(
@@ -1,6 +1,6 @@
 from Main.database import (
     init_db, add_to_history, get_user_history,
-    get_image_info, get_all_image_info,
+    get_image_info, get_all_image_info, get_workflow,
     update_image_info, delete_image_info,
     ban_user, unban_user, get_ban_info,
     is_user_banned, load_lora_info
@@ -12,6 +12,7 @@ __all__ = [
     'get_user_history',
     'get_image_info',
     'get_all_image_info',
+    'get_workflow',
     'update_image_info',
     'delete_image_info',
     'ban_user',
@@ -0,0 +1,176 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import discord
+
+logger = logging.getLogger(__name__)
+
+MAX_ENTRIES = 4096
+
+
+class _TTLMap:
+    """Small LRU map whose entries expire after ttl seconds"""
+
+    def __init__(self, ttl: float, max_entries: int = MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[object, Tuple[float, object]]" = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def pop(self, key):
+        self._entries.pop(key, None)
+
+    def pop_where(self, predicate):
+        """Drop every entry for which predicate(key, value) is true"""
+        stale = [key for key, (_, value) in self._entries.items() if predicate(key, value)]
+        for key in stale:
+            del self._entries[key]
+
+
+class DiscordCache:
+    """
+    TTL cache of the Discord objects the callback path needs: channels, PartialMessage
+    handles for progress messages and the embed colour / display name of requesting
+    members. Entries are filled from the interaction when a request is created and
+    dropped on the matching gateway events, so progress edits and deliveries do not
+    have to fetch anything over REST in the common case.
+    """
+
+    def __init__(self, bot, ttl: float = 600):
+        self.bot = bot
+        self._channels = _TTLMap(ttl)
+        self._messages = _TTLMap(ttl)
+        self._members = _TTLMap(ttl)
+
+    def register_listeners(self):
+        self.bot.add_listener(self._on_channel_delete, 'on_guild_channel_delete')
+        self.bot.add_listener(self._on_channel_update, 'on_guild_channel_update')
+        self.bot.add_listener(self._on_channel_delete, 'on_thread_delete')
+        self.bot.add_listener(self._on_raw_message_delete, 'on_raw_message_delete')
+        self.bot.add_listener(self._on_raw_bulk_message_delete, 'on_raw_bulk_message_delete')
+        self.bot.add_listener(self._on_member_update, 'on_member_update')
+        self.bot.add_listener(self._on_member_remove, 'on_member_remove')
+        self.bot.add_listener(self._on_role_change, 'on_guild_role_update')
+        self.bot.add_listener(self._on_role_change, 'on_guild_role_delete')
+
+    # Population
+
+    def remember_interaction(self, interaction: discord.Interaction):
+        """Cache the channel and member of an interaction that may become a request"""
+        if interaction.channel is not None:
+            self._channels.set(interaction.channel.id, interaction.channel)
+        if isinstance(interaction.user, discord.Member):
+            self.remember_member(interaction.user)
+
+    def remember_member(self, member: discord.Member):
+        self._members.set((member.guild.id, member.id), (member_color(member), member.display_name))
+
+    def remember_message(self, channel_id: int, message_id: int) -> Optional[discord.PartialMessage]:
+        """Cache a PartialMessage handle for a request's progress message"""
+        channel = self._channels.get(channel_id) or self.bot.get_channel(channel_id)
+        if channel is None or not hasattr(channel, 'get_partial_message'):
+            return None
+        self._channels.set(channel_id, channel)
+        message = channel.get_partial_message(message_id)
+        self._messages.set(message_id, message)
+        return message
+
+    # Lookups
+
+    async def channel(self, channel_id: int):
+        """Return a channel, fetching it over REST only on a cache miss"""
+        channel = self._channels.get(channel_id) or self.bot.get_channel(channel_id)
+        if channel is None:
+            channel = await self.bot.fetch_channel(channel_id)
+        self._channels.set(channel_id, channel)
+        return channel
+
+    async def message(self, channel_id: int, message_id: int) -> discord.PartialMessage:
+        """Return an editable handle for a message without fetching it"""
+        message = self._messages.get(message_id)
+        if message is not None:
+            return message
+        channel = await self.channel(channel_id)
+        message = channel.get_partial_message(message_id)
+        self._messages.set(message_id, message)
+        return message
+
+    async def member_style(self, guild: Optional[discord.Guild], user_id: int) -> Tuple[discord.Color, Optional[str]]:
+        """
+        Return (embed colour, display name) for a member. Falls back to fetch_member
+        on a miss, and to blurple with no name if the member cannot be found.
+        """
+        if guild is None:
+            return discord.Color.blurple(), None
+        style = self._members.get((guild.id, user_id))
+        if style is not None:
+            return style
+
+        member = guild.get_member(user_id)
+        if member is None:
+            try:
+                member = await guild.fetch_member(user_id)
+            except (discord.NotFound, discord.HTTPException):
+                return discord.Color.blurple(), None
+        self.remember_member(member)
+        return member_color(member), member.display_name
+
+    # Invalidation
+
+    def forget_message(self, message_id: int):
+        self._messages.pop(message_id)
+
+    def forget_channel(self, channel_id: int):
+        self._channels.pop(channel_id)
+
+    async def _on_channel_delete(self, channel):
+        self.forget_channel(channel.id)
+        self._messages.pop_where(lambda _, message: message.channel.id == channel.id)
+
+    async def _on_channel_update(self, before, after):
+        self._channels.set(after.id, after)
+
+    async def _on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        self.forget_message(payload.message_id)
+
+    async def _on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
+        for message_id in payload.message_ids:
+            self.forget_message(message_id)
+
+    async def _on_member_update(self, before: discord.Member, after: discord.Member):
+        self.remember_member(after)
+
+    async def _on_member_remove(self, member: discord.Member):
+        self._members.pop((member.guild.id, member.id))
+
+    async def _on_role_change(self, *args):
+        # A role's colour or position changed; recompute its guild's colours lazily
+        guild_id = args[0].guild.id
+        self._members.pop_where(lambda key, _: key[0] == guild_id)
+
+
+def member_color(member: Optional[discord.Member]) -> discord.Color:
+    """Colour of the member's highest coloured role, or blurple"""
+    if member is not None:
+        for role in reversed(member.roles):
+            if role.color.value != 0:
+                return role.color
+    return discord.Color.blurple()
@@ -7,8 +7,10 @@ from typing import Optional, List, Any, Dict
 from discord import Interaction
 
 # Local application imports
-from Main.utils import load_json, save_json, generate_random_seed
+from Main.comfy_engine.templates import load_template
+from Main.utils import generate_random_seed
 from .workflow_utils import update_workflow
+from .queue_utils import check_queue_capacity
 from config import fluxversion
 
 logger = logging.getLogger(__name__)
@@ -16,6 +18,10 @@ logger = logging.getLogger(__name__)
 async def process_image_request(interaction: discord.Interaction, prompt: str, resolution: str, upscale_factor: int = 1, seed: Optional[int] = None, workflow: Optional[Dict] = None, workflow_filename: Optional[str] = None):
     """Process a standard image generation request without prompt enhancement."""
     try:
+        # Reject before spending time on LoRA selection and workflow writes
+        if not await check_queue_capacity(interaction):
+            return
+
         # Only defer if we haven't responded yet (i.e., no warning message was sent)
         if not interaction.response.is_done():
             await interaction.response.defer(ephemeral=False)
@@ -47,15 +53,7 @@ async def process_image_request(interaction: discord.Interaction, prompt: str, r
                 pass
             
             # Get LoRA trigger words for currently selected LoRAs
-            lora_config = load_json('lora.json')
-            additional_prompts = []
-            for lora_file in selected_loras:
-                lora_info = next(
-                    (l for l in lora_config['available_loras'] if l['file'] == lora_file),
-                    None
-                )
-                if lora_info and lora_info.get('add_prompt') and lora_info['add_prompt'].strip():
-                    additional_prompts.append(lora_info['add_prompt'].strip())
+            additional_prompts = interaction.client.lora_registry.triggers_for(selected_loras)
             
             # Construct final prompt with new trigger words
             full_prompt = prompt
@@ -70,7 +68,7 @@ async def process_image_request(interaction: discord.Interaction, prompt: str, r
             # Use provided seed or generate new one
             current_seed = seed if seed is not None else generate_random_seed()
             
-            workflow = load_json(fluxversion)
+            workflow = load_template(fluxversion)
             request_uuid = str(uuid.uuid4())
             
             workflow = update_workflow(
@@ -83,12 +81,10 @@ async def process_image_request(interaction: discord.Interaction, prompt: str, r
             )
 
             workflow_filename = f'flux3_{request_uuid}.json'
-            save_json(workflow_filename, workflow)
         else:
             # Use the provided workflow and filename
             if workflow_filename is None:
                 workflow_filename = f'flux3_{str(uuid.uuid4())}.json'
-            save_json(workflow_filename, workflow)
             current_seed = seed
             full_prompt = prompt
             
@@ -121,10 +117,11 @@ async def process_image_request(interaction: discord.Interaction, prompt: str, r
             loras=selected_loras,
             upscale_factor=upscale_factor,
             workflow_filename=workflow_filename,
+            workflow=workflow,
             seed=current_seed,
             is_pulid=workflow_filename and workflow_filename.lower().startswith('pulid') 
         )
-        await interaction.client.subprocess_queue.put(request_item)
+        await interaction.client.enqueue_request(request_item)
         
     except Exception as e:
         logger.error(f"Error in process_image_request: {str(e)}", exc_info=True)
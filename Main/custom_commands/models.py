@@ -1,5 +1,5 @@
-from dataclasses import dataclass
-from typing import List, Optional, Union
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Union
 import logging
 import os
 
@@ -15,13 +15,15 @@ class BaseRequestItem:
     original_message_id: str
     resolution: str
     workflow_filename: str
+    # The prepared workflow, carried in memory through the queue; workflow_filename is then only a label
+    workflow: Optional[Dict[str, Any]] = field(default=None, kw_only=True, repr=False)
 
     def __post_init__(self):
         # Convert all string fields to strings and handle None values
-        for field in self.__dataclass_fields__:
-            if field not in ['upscale_factor', 'loras', 'seed', 'strength1', 'strength2', 'image1', 'image2']:
-                value = getattr(self, field)
-                setattr(self, field, str(value) if value is not None else '')
+        for name in self.__dataclass_fields__:
+            if name not in ['upscale_factor', 'loras', 'seed', 'strength1', 'strength2', 'image1', 'image2', 'workflow']:
+                value = getattr(self, name)
+                setattr(self, name, str(value) if value is not None else '')
 
 @dataclass
 class RequestItem(BaseRequestItem):
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import discord
+
+logger = logging.getLogger(__name__)
+
+# Statuses that end a request's progress and jump ahead of routine updates
+TERMINAL_STATUSES = ('error', 'complete')
+CLOSED_MESSAGES_KEPT = 1024
+
+
+class _ChannelEdits:
+    """Pending progress edits for one channel, drained by a single task"""
+
+    def __init__(self):
+        self.latest: Dict[int, str] = {}
+        # Ordered sets of message ids waiting for an edit
+        self.terminal: "OrderedDict[int, None]" = OrderedDict()
+        self.routine: "OrderedDict[int, None]" = OrderedDict()
+        self.task: Optional[asyncio.Task] = None
+        self.next_edit_at = 0.0
+        self.in_flight: Optional[int] = None
+        self.in_flight_done: Optional[asyncio.Event] = None
+
+
+class ProgressEditor:
+    """
+    Coalesces progress-message edits. Only the latest content of each message is
+    kept; superseded updates are dropped. Each channel is edited at most once per
+    interval to stay inside Discord's per-channel rate limit, with terminal
+    updates (errors, completion) sent before routine progress.
+    """
+
+    def __init__(self, bot, interval: float = 1.0):
+        self.bot = bot
+        self.interval = interval
+        self._channels: Dict[int, _ChannelEdits] = {}
+        self._closed: "OrderedDict[int, None]" = OrderedDict()
+
+    def submit(self, channel_id: int, message_id: int, content: str, terminal: bool = False):
+        if message_id in self._closed:
+            return
+
+        state = self._channels.get(channel_id)
+        if state is None:
+            state = self._channels[channel_id] = _ChannelEdits()
+
+        state.latest[message_id] = content
+        if terminal:
+            state.routine.pop(message_id, None)
+            state.terminal[message_id] = None
+        elif message_id not in state.terminal:
+            # Keep the message's place in line; only its content changes
+            state.routine.setdefault(message_id, None)
+
+        if state.task is None or state.task.done():
+            state.task = asyncio.create_task(self._drain(channel_id, state))
+
+    async def close(self, channel_id: int, message_id: int):
+        """
+        Stop editing a message whose final content is about to be posted.
+        Drops its pending update and waits for an edit already in flight.
+        """
+        self._closed[message_id] = None
+        if len(self._closed) > CLOSED_MESSAGES_KEPT:
+            self._closed.popitem(last=False)
+
+        state = self._channels.get(channel_id)
+        if state is None:
+            return
+        state.latest.pop(message_id, None)
+        state.terminal.pop(message_id, None)
+        state.routine.pop(message_id, None)
+        if state.in_flight == message_id and state.in_flight_done is not None:
+            await state.in_flight_done.wait()
+
+    async def _drain(self, channel_id: int, state: _ChannelEdits):
+        loop = asyncio.get_running_loop()
+        while state.terminal or state.routine:
+            delay = state.next_edit_at - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            # Terminal updates that arrived while waiting still go first
+            pending = state.terminal or state.routine
+            if not pending:
+                continue
+            message_id, _ = pending.popitem(last=False)
+            content = state.latest.pop(message_id, None)
+            if content is None:
+                continue
+
+            state.in_flight = message_id
+            state.in_flight_done = asyncio.Event()
+            try:
+                await self._edit(channel_id, message_id, content)
+            except discord.errors.NotFound:
+                logger.warning(f"Message {message_id} not found")
+                self._closed[message_id] = None
+                self.bot.discord_cache.forget_message(message_id)
+            except discord.errors.Forbidden:
+                logger.warning("Bot lacks permission to edit message")
+            except Exception as e:
+                logger.error(f"Error updating progress message: {str(e)}")
+            finally:
+                state.in_flight = None
+                state.in_flight_done.set()
+                state.next_edit_at = loop.time() + self.interval
+
+    async def _edit(self, channel_id: int, message_id: int, content: str):
+        message = await self.bot.discord_cache.message(channel_id, message_id)
+        await message.edit(content=content)
+        logger.debug(f"Updated progress message: {content}")
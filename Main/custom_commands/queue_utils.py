@@ -0,0 +1,31 @@
+import logging
+import discord
+
+logger = logging.getLogger(__name__)
+
+def guild_key(interaction: discord.Interaction) -> str:
+    """Guild id used for queue accounting; empty for DMs"""
+    return str(interaction.guild_id) if interaction.guild_id else ''
+
+async def check_queue_capacity(interaction: discord.Interaction) -> bool:
+    """
+    Reject the interaction with an ephemeral retry-after message if the queue
+    cannot take another job from this user. Returns True if the request may proceed.
+    Every request passes through here first, so its channel and member are cached now
+    for the progress and delivery callbacks.
+    """
+    interaction.client.discord_cache.remember_interaction(interaction)
+    rejection = interaction.client.admission.check(str(interaction.user.id), guild_key(interaction))
+    if rejection is None:
+        return True
+
+    logger.info(f"Rejected request from {interaction.user.id}: {rejection.reason}")
+    message = f"⏳ {rejection}"
+    try:
+        if interaction.response.is_done():
+            await interaction.followup.send(message, ephemeral=True)
+        else:
+            await interaction.response.send_message(message, ephemeral=True)
+    except discord.HTTPException as e:
+        logger.error(f"Error sending queue rejection: {str(e)}")
+    return False
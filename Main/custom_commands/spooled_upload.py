@@ -0,0 +1,95 @@
+import asyncio
+import io
+import logging
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 256 * 1024
+
+
+class UploadTooLarge(ValueError):
+    """An uploaded file exceeded the configured size ceiling"""
+
+
+class _SpoolReader(io.RawIOBase):
+    """
+    Read-only io.IOBase view of a SpooledTemporaryFile, which discord.File requires;
+    the spool itself only became an io.IOBase in Python 3.11
+    """
+
+    def __init__(self, spool):
+        super().__init__()
+        self._spool = spool
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self._spool.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return self._spool.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._spool.tell()
+
+
+class SpooledUpload:
+    """
+    Binary upload held in a SpooledTemporaryFile: in memory up to max_memory bytes,
+    then in a temporary file on disk, refusing anything over max_size. The rollover
+    to disk and every write after it run in a worker thread. `file` is a real binary
+    file object, so it can be handed to discord.File directly. close() releases the
+    memory or deletes the file.
+    """
+
+    def __init__(self, max_memory: int, max_size: int):
+        self.max_memory = max_memory
+        self.max_size = max_size
+        self.size = 0
+        self._on_disk = False
+        # Rolled over explicitly in write(), never by the spool itself
+        self._spool = tempfile.SpooledTemporaryFile(max_size=0, prefix='upload_')
+
+    @property
+    def on_disk(self) -> bool:
+        return self._on_disk
+
+    @property
+    def file(self) -> io.RawIOBase:
+        return _SpoolReader(self._spool)
+
+    def _needs_disk(self, chunk: bytes) -> bool:
+        return self._on_disk or self.size + len(chunk) > self.max_memory
+
+    async def read_from(self, part):
+        """Copy a multipart body part into the spool chunk by chunk"""
+        while True:
+            chunk = await part.read_chunk(CHUNK_SIZE)
+            if not chunk:
+                break
+            if self._needs_disk(chunk):
+                # This write rolls the spool over to disk, or appends to it there
+                await asyncio.to_thread(self.write, chunk)
+            else:
+                self.write(chunk)
+        self._spool.seek(0)
+
+    def write(self, chunk: bytes):
+        if self.max_size and self.size + len(chunk) > self.max_size:
+            raise UploadTooLarge(f"Upload exceeds the {self.max_size // (1024 * 1024)} MB limit")
+        if self._needs_disk(chunk) and not self._on_disk:
+            self._spool.rollover()
+            self._on_disk = True
+            logger.debug(f"Spooled upload to disk after {self.size} bytes")
+        self._spool.write(chunk)
+        self.size += len(chunk)
+
+    def close(self):
+        self._spool.close()
@@ -7,10 +7,12 @@ import asyncio
 from discord import app_commands, SelectOption
 from discord.ui import View, Select, Button, Modal, TextInput
 from typing import List, Optional, Dict, Any
-from Main.utils import load_json, save_json, generate_random_seed
+from Main.comfy_engine.templates import load_template, plan_for
+from Main.utils import generate_random_seed
 from .workflow_utils import update_workflow, update_pulid_workflow, update_reduxprompt_workflow
 from .models import RequestItem, ReduxPromptRequestItem, ReduxRequestItem
 from .banned_utils import check_banned
+from .queue_utils import check_queue_capacity
 from .image_processing import process_image_request
 from config import PULIDWORKFLOW, fluxversion
 
@@ -464,29 +466,14 @@ class OptionsView(View):
             logger.debug(f"Final LoRA selections at confirmation: {self.all_selected_loras}")
             
             # Process the prompt with LoRA trigger words
-            lora_config = load_json('lora.json')
+            registry = self.bot.lora_registry
             base_prompt = re.sub(r'\s*\(Timestamp:.*?\)', '', self.original_prompt)
             
             # First remove ALL existing trigger words from the base prompt
-            for lora in lora_config['available_loras']:
-                if lora.get('add_prompt'):
-                    trigger_word = lora['add_prompt'].strip()
-                    base_prompt = re.sub(fr',?\s*{re.escape(trigger_word)},?\s*', '', base_prompt, flags=re.IGNORECASE)
-            
-            # Clean up any duplicate commas and whitespace
-            base_prompt = re.sub(r'\s*,\s*,\s*', ', ', base_prompt).strip(' ,')
+            base_prompt = registry.strip_triggers(base_prompt)
             
             # Add trigger words from currently selected LoRAs
-            additional_prompts = []
-            for lora_file in self.all_selected_loras:
-                lora_info = next(
-                    (l for l in lora_config['available_loras'] if l['file'] == lora_file),
-                    None
-                )
-                if lora_info and lora_info.get('add_prompt'):
-                    trigger_word = lora_info['add_prompt'].strip()
-                    if trigger_word:
-                        additional_prompts.append(trigger_word)
+            additional_prompts = registry.triggers_for(self.all_selected_loras)
             
             # Combine base prompt with new trigger words
             updated_prompt = base_prompt
@@ -567,23 +554,17 @@ class PromptModal(Modal, title="Edit Prompt"):
 
     async def on_submit(self, interaction: discord.Interaction):
         try:
-            lora_config = load_json('lora.json')
+            if not await check_queue_capacity(interaction):
+                return
+
+            registry = interaction.client.lora_registry
             base_prompt = re.sub(r'\s*\(Timestamp:.*?\)', '', self.prompt.value)
             
             # Clean base prompt of any existing LoRA trigger words
-            for lora in lora_config['available_loras']:
-                if lora.get('prompt'):
-                    base_prompt = base_prompt.replace(lora['prompt'], '').strip()
-            
-            # Clean up multiple commas and whitespace
-            base_prompt = re.sub(r'\s*,\s*,\s*', ', ', base_prompt).strip(' ,')
+            base_prompt = registry.strip_triggers(base_prompt)
             
             # Get LoRA trigger words
-            additional_prompts = []
-            for lora in self.loras:
-                lora_info = next((l for l in lora_config['available_loras'] if l['file'] == lora), None)
-                if lora_info and lora_info.get('prompt') and lora_info['prompt'].strip():
-                    additional_prompts.append(lora_info['prompt'].strip())
+            additional_prompts = registry.triggers_for(self.loras)
             
             # Join trigger words with commas and append to prompt
             trigger_words = ", ".join(additional_prompts) if additional_prompts else ""
@@ -594,7 +575,7 @@ class PromptModal(Modal, title="Edit Prompt"):
             except ValueError:
                 seed = None
 
-            workflow = load_json(fluxversion)
+            workflow = load_template(fluxversion)
             request_uuid = str(uuid.uuid4())
             
             workflow = update_workflow(workflow, 
@@ -605,7 +586,6 @@ class PromptModal(Modal, title="Edit Prompt"):
                                   seed)
 
             workflow_filename = f'flux3_{request_uuid}.json'
-            save_json(workflow_filename, workflow)
 
             new_message = await interaction.response.send_message("Generating new image with updated options...")
             message = await interaction.original_response()
@@ -621,9 +601,10 @@ class PromptModal(Modal, title="Edit Prompt"):
                 loras=self.loras,
                 upscale_factor=self.upscale_factor,
                 workflow_filename=workflow_filename,
+                workflow=workflow,
                 seed=seed
             )
-            await interaction.client.subprocess_queue.put(request_item)
+            await interaction.client.enqueue_request(request_item)
             
         except Exception as e:
             logger.error(f"Error in modal submit: {e}", exc_info=True)
@@ -656,6 +637,9 @@ class ReduxModal(Modal, title='Redux Image Generator'):
 
     async def on_submit(self, interaction: discord.Interaction):
         try:
+            if not await check_queue_capacity(interaction):
+                return
+
             # Validate strength inputs
             try:
                 strength1 = float(self.strength1.value)
@@ -715,8 +699,7 @@ class ReduxModal(Modal, title='Redux Image Generator'):
 
                 # Create request item
                 workflow_filename = f'redux_{str(uuid.uuid4())}.json'
-                workflow = load_json('Redux.json')
-                save_json(workflow_filename, workflow)
+                workflow = load_template('Redux.json')
 
                 request_item = ReduxRequestItem(
                     id=str(interaction.id),
@@ -728,13 +711,14 @@ class ReduxModal(Modal, title='Redux Image Generator'):
                     strength1=strength1,
                     strength2=strength2,
                     workflow_filename=workflow_filename,
+                    workflow=workflow,
                     image1=image1_data,
                     image2=image2_data,
                     image1_filename=image1_filename,
                     image2_filename=image2_filename
                 )
 
-                await self.bot.subprocess_queue.put(request_item)
+                await self.bot.enqueue_request(request_item)
 
             except asyncio.TimeoutError:
                 await interaction.followup.send(
@@ -800,12 +784,15 @@ class ReduxPromptModal(Modal, title='Redux Prompt'):
                     return
 
             # Check for banned words in the prompt
-            is_banned, message = check_banned(str(interaction.user.id), self.prompt.value)
+            is_banned, message = await check_banned(str(interaction.user.id), self.prompt.value)
             if message:  # If there's a warning or ban message
                 await interaction.response.send_message(message, ephemeral=True)
                 if is_banned:  # If the user is banned, stop processing
                     return
 
+            if not await check_queue_capacity(interaction):
+                return
+
             # Create a unique request ID
             request_id = str(uuid.uuid4())
 
@@ -851,7 +838,7 @@ class ReduxPromptModal(Modal, title='Redux Prompt'):
 
                 # Load and update the workflow
                 try:
-                    base_workflow = load_json('Reduxprompt.json')
+                    base_workflow = load_template('Reduxprompt.json')
                     workflow = update_reduxprompt_workflow(
                         workflow=base_workflow,
                         image_path=image_path,
@@ -861,9 +848,8 @@ class ReduxPromptModal(Modal, title='Redux Prompt'):
                         resolution=self.resolution
                     )
 
-                    # Save the modified workflow
+                    # Label the request; the workflow itself is carried in memory
                     workflow_filename = f'reduxprompt_{request_id}.json'
-                    save_json(workflow_filename, workflow)
 
                     # Create processing message
                     processing_msg = await interaction.followup.send(
@@ -884,11 +870,12 @@ class ReduxPromptModal(Modal, title='Redux Prompt'):
                         image_path=image_path,
                         image_filename=attachment.filename,
                         workflow_filename=workflow_filename,
+                        workflow=workflow,
                         seed=seed if seed is not None else None
                     )
 
                     # Add to bot's subprocess queue for processing
-                    await self.bot.subprocess_queue.put(request_item)
+                    await self.bot.enqueue_request(request_item)
                     logger.debug(f"Added request {request_id} to queue for processing")
 
                     # Send confirmation message
@@ -1007,23 +994,14 @@ class ReduxProcessingView(View):
     async def process_images(self, interaction: discord.Interaction):
         try:
             # Load and modify the Redux workflow
-            workflow = load_json('Redux.json')
-            
-            # Update resolution
-            if '49' in workflow:
-                workflow['49']['inputs']['ratio_selected'] = self.resolution
-            
-            # Update strength values for the switching conditioning nodes
-            if '68' in workflow:  # First switch conditioning node
-                if '53' in workflow:
-                    workflow['53']['inputs']['conditioning_to_strength'] = self.strength1
-            if '67' in workflow:  # Second switch conditioning node
-                if '44' in workflow:
-                    workflow['44']['inputs']['conditioning_to_strength'] = self.strength2
+            workflow = load_template('Redux.json')
+            plan = plan_for(workflow)
+
+            # Update resolution and the strengths of the switching conditioning nodes
+            plan.apply(workflow, resolution=self.resolution, strength1=self.strength1, strength2=self.strength2)
             
             # Generate workflow filename with request ID
             workflow_filename = f'redux_{self.request_id}.json'
-            save_json(workflow_filename, workflow)
 
             # Save images in the temp directory
             temp_dir = os.path.join('Main', 'temp')
@@ -1039,13 +1017,7 @@ class ReduxProcessingView(View):
                 f.write(self.image2)
 
             # Update workflow with image paths
-            if '40' in workflow:
-                workflow['40']['inputs']['image'] = self.image1_filename
-            if '46' in workflow:
-                workflow['46']['inputs']['image'] = self.image2_filename
-            
-            # Save updated workflow
-            save_json(workflow_filename, workflow)
+            plan.apply(workflow, image1=self.image1_filename, image2=self.image2_filename)
 
             # Convert to absolute paths and use forward slashes for logging
             image1_path = os.path.abspath(image1_path).replace('\\', '/')
@@ -1066,13 +1038,14 @@ class ReduxProcessingView(View):
                 strength1=self.strength1,
                 strength2=self.strength2,
                 workflow_filename=workflow_filename,
+                workflow=workflow,
                 image1=self.image1,
                 image2=self.image2,
                 image1_filename=self.image1_filename,
                 image2_filename=self.image2_filename
             )
 
-            await interaction.client.subprocess_queue.put(request_item)
+            await interaction.client.enqueue_request(request_item)
 
             # Disable all buttons after processing starts
             for child in self.children:
@@ -1090,9 +1063,6 @@ class ReduxProcessingView(View):
                     if os.path.exists(image2_path):
                         os.remove(image2_path)
                         logger.debug(f"Cleaned up {image2_path}")
-                    if os.path.exists(workflow_filename):
-                        os.remove(workflow_filename)
-                        logger.debug(f"Cleaned up {workflow_filename}")
                 except Exception as e:
                     logger.error(f"Error cleaning up temporary files: {str(e)}")
 
@@ -1134,9 +1104,12 @@ class ImageControlView(View):
     @discord.ui.button(label="Regenerate", style=discord.ButtonStyle.primary, custom_id="regenerate_button", emoji="♻️")
     async def regenerate(self, interaction: discord.Interaction, button: Button):
         try:
+            if not await check_queue_capacity(interaction):
+                return
+
             await interaction.response.defer(ephemeral=False)
             
-            workflow = load_json(fluxversion)
+            workflow = load_template(fluxversion)
             request_uuid = str(uuid.uuid4())
             new_seed = generate_random_seed()
             
@@ -1148,7 +1121,6 @@ class ImageControlView(View):
                                     new_seed)
 
             workflow_filename = f'flux3_{request_uuid}.json'
-            save_json(workflow_filename, workflow)
 
             new_message = await interaction.followup.send("Regenerating image...")
 
@@ -1163,9 +1135,10 @@ class ImageControlView(View):
                 loras=self.original_loras,
                 upscale_factor=self.original_upscale_factor,
                 workflow_filename=workflow_filename,
+                workflow=workflow,
                 seed=new_seed
             )
-            await interaction.client.subprocess_queue.put(request_item)
+            await interaction.client.enqueue_request(request_item)
 
         except Exception as e:
             logger.error(f"Error in regenerate button: {str(e)}", exc_info=True)
@@ -1222,23 +1195,17 @@ class PromptModal(Modal, title="Edit Prompt"):
 
     async def on_submit(self, interaction: discord.Interaction):
         try:
-            lora_config = load_json('lora.json')
+            if not await check_queue_capacity(interaction):
+                return
+
+            registry = interaction.client.lora_registry
             base_prompt = re.sub(r'\s*\(Timestamp:.*?\)', '', self.prompt.value)
             
             # Clean base prompt of any existing LoRA trigger words
-            for lora in lora_config['available_loras']:
-                if lora.get('prompt'):
-                    base_prompt = base_prompt.replace(lora['prompt'], '').strip()
-            
-            # Clean up multiple commas and whitespace
-            base_prompt = re.sub(r'\s*,\s*,\s*', ', ', base_prompt).strip(' ,')
+            base_prompt = registry.strip_triggers(base_prompt)
             
             # Get LoRA trigger words
-            additional_prompts = []
-            for lora in self.loras:
-                lora_info = next((l for l in lora_config['available_loras'] if l['file'] == lora), None)
-                if lora_info and lora_info.get('prompt') and lora_info['prompt'].strip():
-                    additional_prompts.append(lora_info['prompt'].strip())
+            additional_prompts = registry.triggers_for(self.loras)
             
             # Join trigger words with commas and append to prompt
             trigger_words = ", ".join(additional_prompts) if additional_prompts else ""
@@ -1249,7 +1216,7 @@ class PromptModal(Modal, title="Edit Prompt"):
             except ValueError:
                 seed = None
 
-            workflow = load_json(fluxversion)
+            workflow = load_template(fluxversion)
             request_uuid = str(uuid.uuid4())
             
             workflow = update_workflow(workflow, 
@@ -1260,7 +1227,6 @@ class PromptModal(Modal, title="Edit Prompt"):
                                   seed)
 
             workflow_filename = f'flux3_{request_uuid}.json'
-            save_json(workflow_filename, workflow)
 
             new_message = await interaction.response.send_message("Generating new image with updated options...")
             message = await interaction.original_response()
@@ -1276,9 +1242,10 @@ class PromptModal(Modal, title="Edit Prompt"):
                 loras=self.loras,
                 upscale_factor=self.upscale_factor,
                 workflow_filename=workflow_filename,
+                workflow=workflow,
                 seed=seed
             )
-            await interaction.client.subprocess_queue.put(request_item)
+            await interaction.client.enqueue_request(request_item)
             
         except Exception as e:
             logger.error(f"Error in modal submit: {e}", exc_info=True)
@@ -1601,7 +1568,7 @@ class PulidModal(discord.ui.Modal, title='PuLID Image Generation'):
                 seed = generate_random_seed()
 
             # Check for banned words in the prompt
-            is_banned, message = check_banned(str(interaction.user.id), self.prompt.value)
+            is_banned, message = await check_banned(str(interaction.user.id), self.prompt.value)
             if message:  # If there's a warning or ban message
                 await interaction.response.send_message(message, ephemeral=True)
                 if is_banned:  # If the user is banned, stop processing
@@ -1674,8 +1641,7 @@ class PulidModal(discord.ui.Modal, title='PuLID Image Generation'):
                     logger.error(f"Error deleting LoRA selection message: {str(e)}")
 
                 # Load and update the workflow using environment variable
-                workflow_path = os.path.join('Main', 'Datasets', PULIDWORKFLOW)
-                workflow = load_json(workflow_path)
+                workflow = load_template(PULIDWORKFLOW)
                 workflow = update_pulid_workflow(
                     workflow,
                     image_url=image_path,  # Convert to forward slashes
@@ -1685,9 +1651,8 @@ class PulidModal(discord.ui.Modal, title='PuLID Image Generation'):
                     seed=seed
                 )
 
-                # Save the modified workflow
+                # Label the request; the workflow itself is passed in memory
                 workflow_filename = f'pulid_{request_id}.json'
-                save_json(workflow_filename, workflow)
 
                 # Process the request
                 await process_image_request(
@@ -3,21 +3,28 @@ from aiohttp import web
 import logging
 import json
 import io
-from Main.database import add_to_history
 from Main.utils import load_json
 from .models import RequestItem, ReduxRequestItem, ReduxPromptRequestItem
-from typing import Dict, Any
-import asyncio
+from typing import Dict, Any, Optional
 from .message_constants import STATUS_MESSAGES
+from .progress_editor import TERMINAL_STATUSES
+from .spooled_upload import SpooledUpload, UploadTooLarge
 from .views import ImageControlView, ReduxImageView, PuLIDImageView
-from config import fluxversion
+from Main.comfy_engine import OutputRef, open_output
+from config import fluxversion, COMFYUI_OUTPUT_DIR, UPLOAD_SPOOL_MB, UPLOAD_MAX_MB
 
 logger = logging.getLogger(__name__)
 
+UPLOAD_SPOOL_BYTES = int(UPLOAD_SPOOL_MB * 1024 * 1024)
+UPLOAD_MAX_BYTES = int(UPLOAD_MAX_MB * 1024 * 1024)
+
 async def handle_generated_image(request):
+    request_data = {}
     try:
-        request_data = {}
-        
+        # Reject oversized uploads before reading any of the body
+        if UPLOAD_MAX_BYTES and request.content_length and request.content_length > UPLOAD_MAX_BYTES:
+            return web.Response(status=413, text="Upload too large")
+
         # Process the multipart form data
         reader = await request.multipart()
         
@@ -27,164 +34,187 @@ async def handle_generated_image(request):
                 break
                 
             if part.name in ['video_data', 'image_data']:
-                # Handle binary data (video or image)
-                request_data[part.name] = await part.read()
+                # Stream binary data (video or image) into memory or a temporary file
+                upload = request_data[part.name] = SpooledUpload(UPLOAD_SPOOL_BYTES, UPLOAD_MAX_BYTES)
+                await upload.read_from(part)
             else:
                 # Handle text data
                 request_data[part.name] = await part.text()
 
-        # Convert string 'True'/'False' to boolean
-        is_video = request_data.get('is_video', 'False').lower() == 'true'
-        
-        # Get the channel where we need to send the response
-        channel_id = int(request_data['channel_id'])
-        channel = request.app['bot'].get_channel(channel_id)
-        
-        if not channel:
-            logger.error(f"Could not find channel with ID {channel_id}")
+        if not await deliver_generated_image(request.app['bot'], request_data):
             return web.Response(status=404, text="Channel not found")
 
-        # Prepare the file to send
-        if is_video:
-            file = discord.File(io.BytesIO(request_data['video_data']), filename='output.mp4')
-        else:
-            file = discord.File(io.BytesIO(request_data['image_data']), filename='output.png')
-
-        # Handle seed value - convert to int only if it's not None or 'None'
-        seed_value = request_data.get('seed')
-        if seed_value and seed_value.lower() != 'none':
-            try:
-                seed_value = int(seed_value)
-            except ValueError:
-                seed_value = None
-        else:
-            seed_value = None
-
-        # Create the appropriate view based on content type
-        if is_video:
-            view = ReduxImageView()  # ReduxImageView only has a delete button
-        else:
-            view = ImageControlView(
-                request.app['bot'],
-                original_prompt=request_data['prompt'],
-                image_filename='output.png',
-                original_resolution=request_data['resolution'],
-                original_loras=json.loads(request_data['loras']),
-                original_upscale_factor=int(request_data['upscale_factor']),
-                original_seed=seed_value
-            )
-
-        # Create embed for the prompt
-        try:
-            # Try to get member through fetch_member for more reliable role info
-            user = await channel.guild.fetch_member(int(request_data['user_id'])) if channel.guild else None
-            
-            # Get the highest colored role
-            colored_role = None
-            if user:
-                for role in reversed(user.roles):
-                    if role.color.value != 0:
-                        colored_role = role
-                        break
-            
-            embed_color = colored_role.color if colored_role else discord.Color.blurple()
-            
-        except (discord.NotFound, discord.HTTPException):
-            # Fallback to blurple if we can't get the user or their roles
-            embed_color = discord.Color.blurple()
-            
-        embed = discord.Embed(color=embed_color)
-        embed.description = f"🎨 {request_data['prompt']}\n\n" \
-                          f"📏 Resolution: {request_data['resolution']}\n" \
-                          f"🔍 Upscale: {request_data['upscale_factor']}x\n" \
-                          f"🎲 Seed: {seed_value}\n" \
-                          f"📚 LoRAs: {', '.join(json.loads(request_data['loras'])) if json.loads(request_data['loras']) else 'None'}"
-        embed.set_author(name=f"Image generated for {user.display_name if user else 'Unknown User'}")
-
-        # Get the original progress message and update it
-        try:
-            progress_message = await channel.fetch_message(int(request_data['original_message_id']))
-            await progress_message.edit(content=None, embed=embed, attachments=[], view=view)
-            await progress_message.add_files(file)
-        except (discord.NotFound, discord.HTTPException) as e:
-            # If we can't find the original message or there's an error editing, send as new message
-            logger.error(f"Could not edit original message, sending new one: {str(e)}")
-            await channel.send(file=file, embed=embed, view=view)
-
         return web.Response(text="Success")
         
+    except UploadTooLarge as e:
+        logger.warning(f"Rejected generated image upload: {str(e)}")
+        return web.Response(status=413, text=str(e))
     except Exception as e:
         logger.error(f"Error in handle_generated_image: {str(e)}", exc_info=True)
         return web.Response(status=500, text=f"Internal server error: {str(e)}")
+    finally:
+        for value in request_data.values():
+            if isinstance(value, SpooledUpload):
+                value.close()
 
-async def update_progress(request):
+async def deliver_generated_image(bot, request_data: Dict[str, Any], ref: Optional[OutputRef] = None) -> bool:
+    """
+    Post a finished image or video to Discord, replacing the progress message.
+    request_data holds the /send_image form fields plus image_data or video_data
+    (bytes or a SpooledUpload). In-process jobs may pass an OutputRef instead, whose
+    file is streamed from disk or ComfyUI into the upload; references are never
+    taken from the callback form, which anyone who can reach the server may post.
+    Returns False if the channel could not be found.
+    """
+    if ref is not None:
+        cache_dir = bot.engine.cache.directory if bot.engine.cache else None
+        async with open_output(ref, bot.engine.pool.client_for, COMFYUI_OUTPUT_DIR, cache_dir) as path:
+            return await _post_result(bot, request_data, path)
+
+    data = request_data.get('video_data') or request_data.get('image_data')
+    if isinstance(data, SpooledUpload):
+        return await _post_result(bot, request_data, data.file)
+    return await _post_result(bot, request_data, io.BytesIO(data))
+
+async def _post_result(bot, request_data: Dict[str, Any], fp) -> bool:
+    """Send the result held in fp, a path or binary file object"""
+    # Convert string 'True'/'False' to boolean
+    is_video = request_data.get('is_video', 'False').lower() == 'true'
+    
+    # Get the channel where we need to send the response
+    channel_id = int(request_data['channel_id'])
     try:
-        data = await request.json()
-        request_id = data.get('request_id')
-        progress_data = data.get('progress_data', {})
-        
-        if not request_id:
-            return web.Response(text="Missing request_id", status=400)
-            
-        if request_id not in request.app['bot'].pending_requests:
-            return web.Response(text="Unknown request_id", status=404)
-            
-        request_item = request.app['bot'].pending_requests[request_id]
-        await update_progress_message(request.app['bot'], request_item, progress_data)
+        channel = await bot.discord_cache.channel(channel_id)
+    except (discord.NotFound, discord.Forbidden):
+        channel = None
+    
+    if not channel:
+        logger.error(f"Could not find channel with ID {channel_id}")
+        return False
+
+    # Prepare the file to send. discord.File closes a file it opened from a path
+    # once a send fails, so a retry needs a new one, read from the same start
+    filename = 'output.mp4' if is_video else 'output.png'
+    start = None if isinstance(fp, str) else fp.tell()
+
+    def make_file() -> discord.File:
+        if start is not None:
+            fp.seek(start)
+        return discord.File(fp, filename=filename)
+
+    file = make_file()
+
+    # Handle seed value - convert to int only if it's not None or 'None'
+    seed_value = request_data.get('seed')
+    if seed_value and seed_value.lower() != 'none':
+        try:
+            seed_value = int(seed_value)
+        except ValueError:
+            seed_value = None
+    else:
+        seed_value = None
+
+    # Create the appropriate view based on content type
+    if is_video:
+        view = ReduxImageView()  # ReduxImageView only has a delete button
+    else:
+        view = ImageControlView(
+            bot,
+            original_prompt=request_data['prompt'],
+            image_filename='output.png',
+            original_resolution=request_data['resolution'],
+            original_loras=json.loads(request_data['loras']),
+            original_upscale_factor=int(request_data['upscale_factor']),
+            original_seed=seed_value
+        )
+
+    # Create embed for the prompt, coloured by the user's highest coloured role
+    embed_color, display_name = await bot.discord_cache.member_style(
+        getattr(channel, 'guild', None), int(request_data['user_id'])
+    )
         
-        return web.Response(text="Progress updated")
-    except Exception as e:
-        logger.error(f"Error in update_progress: {str(e)}", exc_info=True)
-        return web.Response(text="Internal server error", status=500)
+    embed = discord.Embed(color=embed_color)
+    embed.description = f"🎨 {request_data['prompt']}\n\n" \
+                      f"📏 Resolution: {request_data['resolution']}\n" \
+                      f"🔍 Upscale: {request_data['upscale_factor']}x\n" \
+                      f"🎲 Seed: {seed_value}\n" \
+                      f"📚 LoRAs: {', '.join(json.loads(request_data['loras'])) if json.loads(request_data['loras']) else 'None'}"
+    embed.set_author(name=f"Image generated for {display_name or 'Unknown User'}")
+
+    # Make sure no queued progress edit lands on top of the result
+    message_id = int(request_data['original_message_id'])
+    await bot.progress_editor.close(channel_id, message_id)
 
-async def update_progress_message(bot, request_item, progress_data: Dict[str, Any]):
+    # Replace the progress message with the result in a single edit
     try:
-        channel = await bot.fetch_channel(int(request_item.channel_id))
-        message = await channel.fetch_message(int(request_item.original_message_id))
-        
-        status = progress_data.get('status', '')
-        progress_message = progress_data.get('message', 'Processing...')
-        progress = progress_data.get('progress', 0)
-
-        # Get the status info from our mapping
-        status_info = STATUS_MESSAGES.get(status, {
-            'message': progress_message,
-            'emoji': '⚙️'  # Default emoji for unknown status
-        })
-
-        # Format message based on status
-        if status == 'generating':
-            formatted_message = f"{status_info['emoji']} {status_info['message']} {progress}%"
-        elif status == 'error':
-            formatted_message = f"{status_info['emoji']} {status_info['message']} {progress_message}"
-        else:
-            formatted_message = f"{status_info['emoji']} {status_info['message']}"
-
-        await message.edit(content=formatted_message)
-        logger.debug(f"Updated progress message: {formatted_message}")
-        
-    except discord.errors.NotFound:
-        logger.warning(f"Message {request_item.original_message_id} not found")
-    except discord.errors.Forbidden:
-        logger.warning("Bot lacks permission to edit message")
-    except Exception as e:
-        logger.error(f"Error updating progress message: {str(e)}")
+        progress_message = await bot.discord_cache.message(channel_id, message_id)
+        await progress_message.edit(content=None, embed=embed, attachments=[file], view=view)
+    except (discord.NotFound, discord.HTTPException) as e:
+        # If we can't find the original message or there's an error editing, send as new message
+        logger.error(f"Could not edit original message, sending new one: {str(e)}")
+        bot.discord_cache.forget_message(message_id)
+        await channel.send(file=make_file(), embed=embed, view=view)
 
-async def check_timeout(bot, request_id: str, timeout: int = 300):
+    return True
+
+async def apply_progress_update(bot, request_id: str, progress_data: Dict[str, Any]) -> bool:
     """
-    Monitor request for timeout
+    Queue an edit of a pending request's progress message on the bot's ProgressEditor.
+    Returns False for unknown requests.
     """
-    try:
-        await asyncio.sleep(timeout)
-        if request_id in bot.pending_requests:
-            request_item = bot.pending_requests[request_id]
-            try:
-                channel = await bot.fetch_channel(int(request_item.channel_id))
-                message = await channel.fetch_message(int(request_item.original_message_id))
-                await message.edit(content="⚠️ Generation timed out after 5 minutes")
-            except Exception as e:
-                logger.error(f"Error handling timeout: {str(e)}")
-            finally:
-                del bot.pending_requests[request_id]
-    except Exception as e:
-        logger.error(f"Error in timeout checker: {str(e)}")
\ No newline at end of file
+    request_item = bot.pending_requests.get(request_id)
+    if request_item is None:
+        return False
+    
+    status = progress_data.get('status', '')
+    progress_message = progress_data.get('message', 'Processing...')
+    progress = progress_data.get('progress', 0)
+
+    status_info = STATUS_MESSAGES.get(status, {
+        'message': progress_message,
+        'emoji': '⚙️'
+    })
+
+    if status == 'generating' and progress == 100:
+        status = 'upscaling'
+        status_info = STATUS_MESSAGES['upscaling']
+        formatted_message = f"{status_info['emoji']} {status_info['message']}"
+    elif status == 'generating':
+        formatted_message = f"{status_info['emoji']} {status_info['message']} {progress}%"
+    elif status == 'error':
+        formatted_message = f"{status_info['emoji']} {status_info['message']} {progress_message}"
+        # Only remove on error
+        bot.pending_requests.pop(request_id, None)
+    else:
+        formatted_message = f"{status_info['emoji']} {status_info['message']}"
+
+    bot.progress_editor.submit(
+        int(request_item.channel_id),
+        int(request_item.original_message_id),
+        formatted_message,
+        terminal=status in TERMINAL_STATUSES
+    )
+    return True
+
+class BotReporter:
+    """Delivers engine progress and results straight to Discord from inside the bot process"""
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    async def progress(self, job, progress_data: Dict[str, Any]):
+        await apply_progress_update(self.bot, job.request_id, progress_data)
+
+    async def deliver(self, job, result):
+        request_data = result.form_fields()
+        if result.ref is None:
+            request_data['video_data' if result.is_video else 'image_data'] = result.data
+        if not await deliver_generated_image(self.bot, request_data, result.ref):
+            raise RuntimeError(f"Channel {job.channel_id} not found")
+
+    async def record_history(self, job, result):
+        self.bot.history_writer.submit(result.history_record())
+
+    async def finished(self, job):
+        self.bot.pending_requests.pop(job.request_id, None)
+        self.bot.admission.release(job.original_message_id)
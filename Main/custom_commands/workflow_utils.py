@@ -1,6 +1,8 @@
 import logging
 import json
-from Main.utils import load_json, generate_random_seed
+from Main.utils import generate_random_seed
+from Main.comfy_engine import loras as lora_registry
+from Main.comfy_engine.templates import WorkflowInstance, plan_for
 import os
 import random
 from typing import List, Optional
@@ -35,88 +37,42 @@ def validate_workflow(workflow):
     logger.debug(f"Workflow validation passed: {len(workflow)} nodes checked")
     return True
 
-def update_workflow(workflow, prompt, resolution, loras, upscale_factor, seed):
-    """Updates the workflow with the provided parameters with enhanced validation"""
-    try:
-        # Validate workflow first
-        validate_workflow(workflow)
-        logger.debug("Initial workflow validation passed")
-
-        # Create a copy to avoid modifying the original
-        workflow = workflow.copy()
-
-        # Update prompt
-        if '69' in workflow:
-            workflow['69']['inputs']['prompt'] = prompt
-            logger.debug(f"Updated prompt: {prompt}")
-        else:
-            logger.warning("Node 69 (prompt node) not found in workflow")
-
-        # Update resolution
-        if '258' in workflow:
-            workflow['258']['inputs']['ratio_selected'] = resolution
-            logger.debug(f"Updated resolution: {resolution}")
-        else:
-            logger.warning("Node 258 (resolution node) not found in workflow")
-
-        # Update LoRAs
-        if '271' in workflow:
-            lora_loader = workflow['271']['inputs']
-            
-            # Load lora config
-            lora_config = load_json('lora.json')
-            lora_info = {lora['file']: lora for lora in lora_config['available_loras']}
-
-            # Clean existing LoRA entries
-            for key in list(lora_loader.keys()):
-                if key.startswith('lora_'):
-                    del lora_loader[key]
-
-            # Add new LoRA entries
-            for i, lora in enumerate(loras, start=1):
-                if lora in lora_info:
-                    lora_key = f'lora_{i}'
-                    # Get base strength from config
-                    base_strength = float(lora_info[lora].get('weight', 1.0))
-                    
-                    # If multiple LoRAs are selected, scale down to 0.5 unless already lower
-                    if len(loras) > 1:
-                        lora_strength = min(base_strength, 0.5)
-                    else:
-                        lora_strength = base_strength
-                        
-                    lora_loader[lora_key] = {
-                        'on': True,
-                        'lora': lora,
-                        'strength': lora_strength
-                    }
-                    logger.debug(f"Added LoRA {lora} with strength {lora_strength}")
-                else:
-                    logger.warning(f"LoRA {lora} not found in configuration")
-
-        # Update upscale factor
-        if '279' in workflow:
-            workflow['279']['inputs']['rescale_factor'] = upscale_factor
-            logger.debug(f"Updated upscale factor: {upscale_factor}")
+def _lora_stack(loras, registry):
+    """(file, strength) pairs for the LoRA loader, skipping LoRAs missing from lora.json"""
+    stack = []
+    for lora in loras:
+        if lora not in registry:
+            logger.warning(f"LoRA {lora} not found in configuration")
+            continue
+        # Get base strength from config
+        base_strength = registry.weight(lora)
+
+        # If multiple LoRAs are selected, scale down to 0.5 unless already lower
+        if len(loras) > 1:
+            lora_strength = min(base_strength, 0.5)
         else:
-            logger.warning("Node 279 (upscale node) not found in workflow")
-
-        # Update seed
-        if '198:2' in workflow:
-            workflow['198:2']['inputs']['noise_seed'] = seed
-            logger.debug(f"Updated seed: {seed}")
-        else:
-            logger.warning("Node 198:2 (seed node) not found in workflow")
-
-        # Validate the updated workflow
-        validate_workflow(workflow)
-        logger.debug("Final workflow validation passed")
-                       
-        # Keep original steps value from workflow template
-        if '198:1' in workflow and 'inputs' in workflow['198:1']:
-            original_steps = workflow['198:1']['inputs'].get('steps', 20)  # fallback to 20 if not found
-            logger.debug(f"Using steps value from workflow: {original_steps}")
+            lora_strength = base_strength
+        stack.append((lora, lora_strength))
+        logger.debug(f"Added LoRA {lora} with strength {lora_strength}")
+    return stack
 
+def update_workflow(workflow, prompt, resolution, loras, upscale_factor, seed):
+    """Updates the workflow with the provided parameters through its template's patch plan"""
+    try:
+        # Copy-on-write overlay so the cached template is never modified
+        workflow = WorkflowInstance(workflow)
+        plan = plan_for(workflow, 'flux')
+
+        plan.apply(
+            workflow,
+            prompt=prompt,
+            resolution=resolution,
+            loras=_lora_stack(loras, lora_registry.current()),
+            upscale_factor=upscale_factor,
+            seed=seed
+        )
+        logger.debug(f"Updated workflow: prompt, resolution {resolution}, {len(loras)} LoRAs, "
+                     f"upscale {upscale_factor}, seed {seed}")
         return workflow
 
     except Exception as e:
@@ -137,8 +93,9 @@ def update_reduxprompt_workflow(workflow, image_path, prompt, strength, seed=Non
         resolution: Optional resolution value for the image generation
     """
     try:
-        # Create a copy to avoid modifying the original
-        workflow = workflow.copy()
+        # Copy-on-write overlay so the cached template is never modified
+        workflow = WorkflowInstance(workflow)
+        plan = plan_for(workflow, 'reduxprompt')
 
         # Generate random seed if none provided
         if seed is None:
@@ -154,37 +111,17 @@ def update_reduxprompt_workflow(workflow, image_path, prompt, strength, seed=Non
         image_path = os.path.abspath(image_path).replace('\\', '/')
         logger.debug(f"Using image path: {image_path}")
 
-        # Update image path in node 40
-        if '40' in workflow:
-            workflow['40']['inputs']['image'] = image_path
-            logger.debug(f"Updated image path in node 40: {image_path}")
-        else:
-            raise ValueError("Node 40 (LoadImage node) not found in workflow")
-
-        # Update prompt in node 6 if it exists
-        if '6' in workflow:
-            workflow['6']['inputs']['text'] = prompt
-            logger.debug(f"Updated prompt in node 6: {prompt}")
-
-        # Update strength in node 54 if it exists (using string value directly)
-        if '54' in workflow:
-            workflow['54']['inputs']['image_strength'] = strength
-            logger.debug(f"Updated strength in node 54: {strength}")
-
-        # Update seed in RandomNoise node
-        if '25' in workflow:
-            workflow['25']['inputs']['noise_seed'] = seed
-            logger.debug(f"Updated seed in RandomNoise node: {seed}")
-
-        # Update resolution in node 62 if resolution is provided
-        if resolution and '62' in workflow:
-            workflow['62']['inputs']['ratio_selected'] = resolution
-            logger.debug(f"Updated resolution in node 62: {resolution}")
-        elif '62' in workflow:
-            logger.warning("Resolution not provided, using default in node 62")
-        else:
-            logger.warning("Node 62 (resolution node) not found in workflow")
-
+        if not resolution:
+            logger.warning("Resolution not provided, using template default")
+
+        plan.apply(
+            workflow,
+            image=image_path,
+            prompt=prompt,
+            strength=strength,
+            seed=seed,
+            resolution=resolution or None
+        )
         return workflow
 
     except Exception as e:
@@ -194,91 +131,33 @@ def update_reduxprompt_workflow(workflow, image_path, prompt, strength, seed=Non
 def update_pulid_workflow(workflow: dict, image_url: str, prompt: str, resolution: str, loras: List[str], seed: Optional[int] = None) -> dict:
     """Updates the PuLID workflow with the provided parameters."""
     try:
-        # Create a deep copy to avoid modifying original
-        workflow = json.loads(json.dumps(workflow))
+        # Copy-on-write overlay so the cached template is never modified
+        workflow = WorkflowInstance(workflow)
+        plan = plan_for(workflow, 'pulid')
         
         # Ensure image_url is an absolute path with forward slashes
         image_url = os.path.abspath(image_url).replace('\\', '/')
-        
-        # Update image URL in LoadImage node
-        if '54' in workflow:
-            workflow['54']['inputs']['image'] = image_url
-            logger.debug(f"Updated image URL in workflow: {image_url}")
-        else:
-            logger.warning("LoadImage node (54) not found in workflow")
-
-        # Update resolution in node 70 if it exists
-        if '70' in workflow:
-            workflow['70']['inputs']['ratio_selected'] = resolution
-            logger.debug(f"Updated resolution in node 70: {resolution}")
-        else:
-            logger.warning("Resolution node (70) not found in workflow")
 
-        # Load lora config and get trigger words
-        lora_config = load_json('lora.json')
-        lora_info = {lora['file']: lora for lora in lora_config['available_loras']}
+        registry = lora_registry.current()
 
         # Add LoRA trigger words to prompt
         modified_prompt = prompt
-        for lora in loras:
-            if lora in lora_info and lora_info[lora].get('add_prompt'):
-                trigger_words = lora_info[lora]['add_prompt']
-                if trigger_words and not trigger_words in modified_prompt:
-                    modified_prompt = f"{modified_prompt}, {trigger_words}"
-                    logger.debug(f"Added trigger words '{trigger_words}' for LoRA {lora}")
-
-        # Update prompt with trigger words
-        if '6' in workflow:
-            workflow['6']['inputs']['text'] = modified_prompt
-            logger.debug(f"Updated prompt in workflow with trigger words")
-        else:
-            logger.warning("CLIPTextEncode node (6) not found in workflow")
-
-        # Update LoRAs in node 73
-        if '73' in workflow:
-            lora_loader = workflow['73']['inputs']
-            
-            # Clean existing LoRA entries
-            for key in list(lora_loader.keys()):
-                if key.startswith('lora_'):
-                    del lora_loader[key]
-
-            # Add new LoRA entries
-            for i, lora in enumerate(loras, start=1):
-                if lora in lora_info:
-                    lora_key = f'lora_{i}'
-                    base_strength = float(lora_info[lora].get('weight', 1.0))
-                    
-                    # If multiple LoRAs are selected, scale down to 0.5 unless already lower
-                    if len(loras) > 1:
-                        lora_strength = min(base_strength, 0.5)
-                    else:
-                        lora_strength = base_strength
-                        
-                    lora_loader[lora_key] = {
-                        'on': True,
-                        'lora': lora,
-                        'strength': lora_strength
-                    }
-                    logger.debug(f"Added LoRA {lora} with strength {lora_strength}")
-            logger.debug(f"Updated LoRAs in workflow: {len(loras)} LoRAs configured")
-        else:
-            logger.warning("LoraLoader node (73) not found in workflow")
-
-        # Update seed
-        if seed is not None and '25' in workflow:
-            workflow['25']['inputs']['noise_seed'] = seed
-            logger.debug(f"Updated seed in workflow: {seed}")
-        else:
-            logger.warning("RandomNoise node (25) not found in workflow")
-
-        # Validate the final workflow
-        if not isinstance(workflow, dict):
-            raise ValueError("Workflow must remain a dictionary after updates")
-
-        logger.debug("Successfully updated workflow with all parameters")
+        for trigger_words in registry.triggers_for(loras):
+            if trigger_words not in modified_prompt:
+                modified_prompt = f"{modified_prompt}, {trigger_words}"
+                logger.debug(f"Added trigger words '{trigger_words}'")
+
+        plan.apply(
+            workflow,
+            image=image_url,
+            resolution=resolution,
+            prompt=modified_prompt,
+            loras=_lora_stack(loras, registry),
+            seed=seed
+        )
+        logger.debug(f"Updated PuLID workflow: {len(loras)} LoRAs configured")
         return workflow
 
     except Exception as e:
         logger.error(f"Error updating workflow: {str(e)}")
-        raise ValueError(f"Failed to update workflow: {str(e)}")
\ No newline at end of file
+        raise ValueError(f"Failed to update workflow: {str(e)}")
@@ -1,15 +1,48 @@
 import sqlite3
+import functools
 import json
 import logging
-import time
 import os
-import re
+import threading
+
+from Main.db import Database, transaction
+from Main.migrations import migrate
+from Main.workflow_store import load_workflow, store_workflow
+from Main.moderation import (
+    normalize_text, banned_word_matcher, banned_word_added, banned_word_removed,
+    BannedWordMatcher, install_banned_word_matcher,
+    ModerationState, install_moderation_state,
+    user_banned, user_unbanned, user_warned, user_warnings_removed, warning_counts_changed
+)
 
 logger = logging.getLogger(__name__)
 
 DB_NAME = 'image_history.db'
 BANNED_WORDS_FILE = os.path.join(os.path.dirname(__file__), 'banned.json')
 
+_db = None
+_db_lock = threading.Lock()
+
+def _database() -> Database:
+    """The shared connection to DB_NAME, opened on first use"""
+    global _db
+    with _db_lock:
+        if _db is None or _db.path != DB_NAME:
+            _db = Database(DB_NAME)
+        return _db
+
+def close_db():
+    """Close the shared connection, e.g. on shutdown"""
+    global _db
+    with _db_lock:
+        if _db is not None:
+            _db.close()
+            _db = None
+
+def _after_commit(callback, *args):
+    """Update in-memory state mirrored from the database once this transaction commits"""
+    _database().after_commit(functools.partial(callback, *args))
+
 def load_banned_words_from_json():
     try:
         with open(BANNED_WORDS_FILE, 'r') as f:
@@ -27,8 +60,8 @@ def save_banned_words_to_json(words):
     except Exception as e:
         logger.error(f"Error saving banned words to JSON: {e}")
 
-def init_db():
-    conn = sqlite3.connect(DB_NAME)
+@transaction(_database)
+def init_db(conn):
     c = conn.cursor()
     # Existing tables remain the same
     c.execute('''CREATE TABLE IF NOT EXISTS image_history
@@ -59,60 +92,89 @@ def init_db():
                   word TEXT,
                   warned_at DATETIME DEFAULT CURRENT_TIMESTAMP)''')
     
-    conn.commit()
-    
+    # Fair-share weights set by admins for the generation queue
+    c.execute('''CREATE TABLE IF NOT EXISTS queue_weights
+                 (scope TEXT,
+                  target_id TEXT,
+                  weight REAL,
+                  updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                  PRIMARY KEY (scope, target_id))''')
+
+    # Upgrade existing databases in place: indexes and later schema changes
+    migrate(conn)
+
     # Load banned words from JSON and sync with database
     banned_words = load_banned_words_from_json()
     for word in banned_words:
         c.execute("INSERT OR IGNORE INTO banned_words (word) VALUES (?)", (word,))
-    conn.commit()
-    conn.close()
 
-def add_to_history(user_id, prompt, workflow, image_filename, resolution, loras, upscale_factor):
+@transaction(_database)
+def add_to_history(conn, user_id, prompt, workflow, image_filename, resolution, loras, upscale_factor, request_id=None):
+    """Record a finished image; a second record for the same request_id is ignored"""
     if image_filename.startswith('ComfyUI'):
         logger.debug(f"Skipping temporary file: {image_filename}")
-        return
+        return False
+
+    # Ensure loras is a list of up to 25 items
+    loras_list = loras[:25] if isinstance(loras, list) else [loras]
+    loras_json = json.dumps(loras_list)
+
+    # Shared template stored once by hash, plus the compressed per-job values
+    workflow_hash, workflow_delta = store_workflow(conn, workflow)
 
-    conn = sqlite3.connect(DB_NAME)
     c = conn.cursor()
-    
     c.execute("""
-        SELECT id FROM image_history 
-        WHERE user_id = ? AND prompt = ? AND 
-        datetime(timestamp, 'unixepoch') = datetime(?, 'unixepoch')
-    """, (user_id, prompt, int(time.time())))
-    
-    existing_entry = c.fetchone()
-    
-    if existing_entry:
-        logger.debug(f"Skipping duplicate entry for user_id={user_id}, prompt={prompt}")
-    else:
-        # Ensure loras is a list of up to 25 items
-        loras_list = loras[:25] if isinstance(loras, list) else [loras]
-        loras_json = json.dumps(loras_list)
-        
-        c.execute("INSERT INTO image_history (user_id, prompt, workflow, image_filename, resolution, loras, upscale_factor) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                  (user_id, prompt, json.dumps(workflow), image_filename, resolution, loras_json, upscale_factor))
-        conn.commit()
-        logger.debug(f"Added to history: user_id={user_id}, prompt={prompt}, image_filename={image_filename}, resolution={resolution}, loras={loras_json}, upscale_factor={upscale_factor}")
-    
-    conn.close()
+        INSERT INTO image_history
+            (user_id, prompt, image_filename, resolution, loras, upscale_factor, request_id,
+             workflow_hash, workflow_delta)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT DO NOTHING
+    """, (user_id, prompt, image_filename, resolution, loras_json, upscale_factor, request_id,
+          workflow_hash, workflow_delta))
+
+    if c.rowcount == 0:
+        logger.debug(f"Skipping duplicate entry for request_id={request_id}")
+        return False
+    logger.debug(f"Added to history: user_id={user_id}, prompt={prompt}, image_filename={image_filename}, resolution={resolution}, loras={loras_json}, upscale_factor={upscale_factor}")
+    return True
+
+@transaction(_database)
+def add_history_batch(conn, records):
+    """Write several add_to_history records in one transaction; returns how many were new"""
+    written = 0
+    for record in records:
+        try:
+            written += add_to_history(**record)
+        except (sqlite3.IntegrityError, TypeError, ValueError) as e:
+            # Only this record's statement is undone; the rest of the batch still commits
+            logger.error(f"Dropping invalid history record {record.get('request_id')}: {str(e)}")
+    return written
+
+# image_history columns as returned to callers, with the workflow rehydrated as JSON
+HISTORY_COLUMNS = ("id, user_id, prompt, workflow, image_filename, resolution, timestamp, "
+                   "loras, upscale_factor, request_id, workflow_hash, workflow_delta")
+
+def _history_rows(conn, rows):
+    """Replace each row's stored workflow reference with the full workflow JSON"""
+    result = []
+    for row in rows:
+        workflow = load_workflow(conn, row[3], row[10], row[11])
+        result.append(row[:3] + (json.dumps(workflow) if workflow is not None else None,) + row[4:10])
+    return result
 
-def get_user_history(user_id, limit=10):
-    conn = sqlite3.connect(DB_NAME)
+@transaction(_database)
+def get_user_history(conn, user_id, limit=10):
     c = conn.cursor()
-    c.execute("SELECT * FROM image_history WHERE user_id = ? ORDER BY timestamp DESC LIMIT ?", (user_id, limit))
-    history = c.fetchall()
-    conn.close()
+    c.execute(f"SELECT {HISTORY_COLUMNS} FROM image_history WHERE user_id = ? ORDER BY timestamp DESC LIMIT ?", (user_id, limit))
+    history = _history_rows(conn, c.fetchall())
     logger.debug(f"Retrieved history for user_id={user_id}: {len(history)} entries")
     return history
 
-def get_image_info(image_filename):
-    conn = sqlite3.connect(DB_NAME)
+@transaction(_database)
+def get_image_info(conn, image_filename):
     c = conn.cursor()
     c.execute("SELECT * FROM image_history WHERE image_filename = ?", (image_filename,))
     info = c.fetchone()
-    conn.close()
     if info:
         loras = json.loads(info[7])
         logger.debug(f"Image info found for {image_filename}: {info}")
@@ -126,12 +188,22 @@ def get_image_info(image_filename):
         logger.warning(f"No image info found for {image_filename}")
     return None
 
-def get_all_image_info():
-    conn = sqlite3.connect(DB_NAME)
+@transaction(_database)
+def get_workflow(conn, image_filename):
+    """The full workflow an image was generated with, or None"""
+    row = conn.execute(
+        "SELECT workflow, workflow_hash, workflow_delta FROM image_history WHERE image_filename = ? "
+        "ORDER BY id DESC LIMIT 1",
+        (image_filename,)
+    ).fetchone()
+    return load_workflow(conn, *row) if row else None
+
+@transaction(_database)
+def get_all_image_info(conn):
     c = conn.cursor()
     try:
-        c.execute("SELECT * FROM image_history")
-        info = c.fetchall()
+        c.execute(f"SELECT {HISTORY_COLUMNS} FROM image_history")
+        info = _history_rows(conn, c.fetchall())
         logger.debug(f"Retrieved {len(info)} image entries")
     except sqlite3.OperationalError as e:
         if "no such table" in str(e):
@@ -139,12 +211,10 @@ def get_all_image_info():
             info = []
         else:
             raise
-    finally:
-        conn.close()
     return info
 
-def update_image_info(image_filename, new_prompt=None, new_resolution=None, new_loras=None, new_upscale_factor=None):
-    conn = sqlite3.connect(DB_NAME)
+@transaction(_database)
+def update_image_info(conn, image_filename, new_prompt=None, new_resolution=None, new_loras=None, new_upscale_factor=None):
     c = conn.cursor()
     
     update_fields = []
@@ -172,65 +242,63 @@ def update_image_info(image_filename, new_prompt=None, new_resolution=None, new_
         update_values.append(image_filename)
         
         c.execute(update_query, tuple(update_values))
-        conn.commit()
         
         logger.debug(f"Updated image info for {image_filename}: prompt={new_prompt}, resolution={new_resolution}, loras={new_loras}, upscale_factor={new_upscale_factor}")
     else:
         logger.debug(f"No updates provided for {image_filename}")
-    
-    conn.close()
 
-def get_banned_words():
-    conn = sqlite3.connect(DB_NAME)
+@transaction(_database)
+def get_banned_words(conn):
     c = conn.cursor()
     c.execute("SELECT word FROM banned_words")
     words = [row[0] for row in c.fetchall()]
-    conn.close()
     return words
 
-def add_banned_word(word: str):
+@transaction(_database)
+def load_banned_word_matcher(conn):
+    """Build the shared banned word matcher from the banned_words table"""
+    return install_banned_word_matcher(BannedWordMatcher(get_banned_words()))
+
+@transaction(_database)
+def add_banned_word(conn, word: str):
     """Add a new banned word to both database and JSON file"""
     # Normalize the word before storing
     normalized_word = normalize_text(word)
     
-    conn = sqlite3.connect(DB_NAME)
     c = conn.cursor()
     c.execute("INSERT OR IGNORE INTO banned_words (word) VALUES (?)", (normalized_word,))
-    conn.commit()
-    conn.close()
+    _after_commit(banned_word_added, normalized_word)
     
     # Update JSON file
     current_words = get_banned_words()
     save_banned_words_to_json(current_words)
     logger.debug(f"Added banned word and updated JSON: {word}")
 
-def remove_banned_word(word: str):
+@transaction(_database)
+def remove_banned_word(conn, word: str):
     """Remove a banned word from both database and JSON file"""
     # Normalize the word before removing
     normalized_word = normalize_text(word)
     
-    conn = sqlite3.connect(DB_NAME)
     c = conn.cursor()
     c.execute("DELETE FROM banned_words WHERE word = ?", (normalized_word,))
-    conn.commit()
-    conn.close()
+    _after_commit(banned_word_removed, normalized_word)
     
     # Update JSON file
     current_words = get_banned_words()
     save_banned_words_to_json(current_words)
     logger.debug(f"Removed banned word and updated JSON: {word}")
 
-def add_user_warning(user_id: str, prompt: str, word: str):
-    conn = sqlite3.connect(DB_NAME)
+@transaction(_database)
+def add_user_warning(conn, user_id: str, prompt: str, word: str):
     c = conn.cursor()
     c.execute("INSERT INTO user_warnings (user_id, prompt, word) VALUES (?, ?, ?)",
               (user_id, prompt, word))
-    conn.commit()
-    conn.close()
+    _after_commit(user_warned, user_id)
 
-def remove_user_warnings(user_id: str):
+@transaction(_database)
+def remove_user_warnings(conn, user_id: str):
     """Remove all warnings for a specific user"""
-    conn = sqlite3.connect(DB_NAME)
     c = conn.cursor()
     
     try:
@@ -239,29 +307,25 @@ def remove_user_warnings(user_id: str):
         warning_count = c.fetchone()[0]
         
         if warning_count == 0:
-            conn.close()
             return False, "User has no warnings to remove"
             
         # Delete all warnings for the user
         c.execute("DELETE FROM user_warnings WHERE user_id = ?", (user_id,))
-        conn.commit()
-        conn.close()
+        _after_commit(user_warnings_removed, user_id)
         return True, f"Removed {warning_count} warning(s)"
     except Exception as e:
-        conn.close()
         return False, f"Error removing warnings: {str(e)}"
 
-def get_user_warnings(user_id: str):
-    conn = sqlite3.connect(DB_NAME)
+@transaction(_database)
+def get_user_warnings(conn, user_id: str):
     c = conn.cursor()
     c.execute("SELECT COUNT(*) FROM user_warnings WHERE user_id = ?", (user_id,))
     warning_count = c.fetchone()[0]
-    conn.close()
     return warning_count
 
-def get_all_warnings():
+@transaction(_database)
+def get_all_warnings(conn):
     """Get all warnings from the database, grouped by user"""
-    conn = sqlite3.connect(DB_NAME)
     c = conn.cursor()
     
     try:
@@ -274,7 +338,6 @@ def get_all_warnings():
         warnings = c.fetchall()
         
         if not warnings:
-            conn.close()
             return False, "No warnings found in the database"
         
         # Group warnings by user
@@ -285,19 +348,15 @@ def get_all_warnings():
                 warning_dict[user_id] = []
             warning_dict[user_id].append((prompt, word, warned_at))
         
-        conn.close()
         return True, warning_dict
     except Exception as e:
-        conn.close()
         return False, f"Error retrieving warnings: {str(e)}"
 
-def delete_image_info(image_filename):
-    conn = sqlite3.connect(DB_NAME)
+@transaction(_database)
+def delete_image_info(conn, image_filename):
     c = conn.cursor()
     c.execute("DELETE FROM image_history WHERE image_filename = ?", (image_filename,))
     deleted_count = c.rowcount
-    conn.commit()
-    conn.close()
     
     if deleted_count > 0:
         logger.debug(f"Deleted image info for {image_filename}")
@@ -306,33 +365,30 @@ def delete_image_info(image_filename):
     
     return deleted_count > 0
 
-def ban_user(user_id, reason):
-    conn = sqlite3.connect(DB_NAME)
+@transaction(_database)
+def ban_user(conn, user_id, reason):
     c = conn.cursor()
     c.execute("INSERT OR REPLACE INTO banned_users (user_id, reason) VALUES (?, ?)", (user_id, reason))
-    conn.commit()
-    conn.close()
+    _after_commit(user_banned, user_id)
     logger.info(f"Banned user {user_id} for reason: {reason}")
 
-def unban_user(user_id):
-    conn = sqlite3.connect(DB_NAME)
+@transaction(_database)
+def unban_user(conn, user_id):
     c = conn.cursor()
     c.execute("DELETE FROM banned_users WHERE user_id = ?", (user_id,))
     deleted = c.rowcount > 0
-    conn.commit()
-    conn.close()
+    _after_commit(user_unbanned, user_id)
     if deleted:
         logger.info(f"Unbanned user {user_id}")
     else:
         logger.warning(f"Attempted to unban non-banned user {user_id}")
     return deleted
 
-def get_ban_info(user_id):
-    conn = sqlite3.connect(DB_NAME)
+@transaction(_database)
+def get_ban_info(conn, user_id):
     c = conn.cursor()
     c.execute("SELECT reason, banned_at FROM banned_users WHERE user_id = ?", (user_id,))
     info = c.fetchone()
-    conn.close()
     if info:
         logger.debug(f"Retrieved ban info for user {user_id}")
         return {"reason": info[0], "banned_at": info[1]}
@@ -340,26 +396,139 @@ def get_ban_info(user_id):
         logger.debug(f"No ban info found for user {user_id}")
         return None
 
-def is_user_banned(user_id):
-    conn = sqlite3.connect(DB_NAME)
+@transaction(_database)
+def is_user_banned(conn, user_id):
     c = conn.cursor()
     c.execute("SELECT 1 FROM banned_users WHERE user_id = ?", (user_id,))
     is_banned = c.fetchone() is not None
-    conn.close()
     return is_banned
 
-def get_all_banned_users():
+@transaction(_database)
+def get_all_banned_users(conn):
     """
     Get all banned users from the database with their ban information.
     Returns a list of dictionaries containing user_id, reason, and banned_at.
     """
-    conn = sqlite3.connect(DB_NAME)
     c = conn.cursor()
     c.execute("SELECT user_id, reason, banned_at FROM banned_users ORDER BY banned_at DESC")
     banned_users = [{"user_id": row[0], "reason": row[1], "banned_at": row[2]} for row in c.fetchall()]
-    conn.close()
     return banned_users
 
+@transaction(_database)
+def load_moderation_state(conn):
+    """Load banned users and warning counts into the shared moderation state"""
+    c = conn.cursor()
+    c.execute("SELECT user_id FROM banned_users")
+    banned = [row[0] for row in c.fetchall()]
+    c.execute("SELECT user_id, COUNT(*) FROM user_warnings GROUP BY user_id")
+    warnings = dict(c.fetchall())
+    return install_moderation_state(ModerationState(banned, warnings))
+
+@transaction(_database)
+def set_queue_weight(conn, scope: str, target_id: str, weight: float):
+    """Store a fair-share weight for a 'user' or 'guild'"""
+    c = conn.cursor()
+    c.execute("INSERT OR REPLACE INTO queue_weights (scope, target_id, weight) VALUES (?, ?, ?)",
+              (scope, target_id, weight))
+    logger.info(f"Set {scope} queue weight for {target_id} to {weight}")
+
+@transaction(_database)
+def get_queue_weights(conn):
+    """Return (user_weights, guild_weights) dictionaries keyed by id"""
+    c = conn.cursor()
+    c.execute("SELECT scope, target_id, weight FROM queue_weights")
+    weights = {'user': {}, 'guild': {}}
+    for scope, target_id, weight in c.fetchall():
+        if scope in weights:
+            weights[scope][target_id] = weight
+    return weights['user'], weights['guild']
+
+# Tables with a retention period and the column holding each row's age
+RETENTION_COLUMNS = {'image_history': 'timestamp', 'user_warnings': 'warned_at'}
+
+@transaction(_database)
+def get_expired_rows(conn, table: str, days: float, limit: int):
+    """The oldest rows of a retention table older than the given number of days, as dictionaries"""
+    column = RETENTION_COLUMNS[table]
+    if table == 'image_history':
+        columns = HISTORY_COLUMNS
+    else:
+        columns = "id, user_id, prompt, word, warned_at"
+    c = conn.cursor()
+    c.execute(
+        f"SELECT {columns} FROM {table} WHERE {column} < datetime('now', ?) ORDER BY {column}, id LIMIT ?",
+        (f'-{float(days)} days', limit)
+    )
+    names = [description[0] for description in c.description]
+    rows = [dict(zip(names, row)) for row in c.fetchall()]
+    if table == 'image_history':
+        for row in rows:
+            row['workflow'] = load_workflow(conn, row['workflow'], row.pop('workflow_hash'), row.pop('workflow_delta'))
+            row['loras'] = json.loads(row['loras']) if row['loras'] else []
+    return rows
+
+@transaction(_database)
+def delete_expired_rows(conn, table: str, ids):
+    """Delete rows of a retention table by id; returns how many were removed"""
+    if table not in RETENTION_COLUMNS:
+        raise ValueError(f"No retention for table {table}")
+    ids = list(ids)
+    if not ids:
+        return 0
+    placeholders = ','.join('?' * len(ids))
+    c = conn.cursor()
+    if table == 'user_warnings':
+        c.execute(f"SELECT DISTINCT user_id FROM user_warnings WHERE id IN ({placeholders})", ids)
+        users = [row[0] for row in c.fetchall()]
+    c.execute(f"DELETE FROM {table} WHERE id IN ({placeholders})", ids)
+    deleted = c.rowcount
+    if table == 'user_warnings' and users:
+        # Expired warnings no longer count towards a ban
+        user_placeholders = ','.join('?' * len(users))
+        c.execute(f"SELECT user_id, COUNT(*) FROM user_warnings WHERE user_id IN ({user_placeholders}) GROUP BY user_id", users)
+        counts = dict.fromkeys(users, 0)
+        counts.update(c.fetchall())
+        _after_commit(warning_counts_changed, counts)
+    logger.debug(f"Deleted {deleted} expired rows from {table}")
+    return deleted
+
+@transaction(_database)
+def prune_workflow_templates(conn):
+    """Delete stored workflow templates no history row refers to; returns how many"""
+    c = conn.cursor()
+    c.execute("""
+        DELETE FROM workflow_templates
+        WHERE NOT EXISTS (SELECT 1 FROM image_history WHERE workflow_hash = workflow_templates.hash)
+    """)
+    return c.rowcount
+
+@transaction(_database)
+def incremental_vacuum_enabled(conn):
+    return conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+@transaction(_database)
+def enable_incremental_vacuum(conn):
+    """
+    Switch an existing database to auto_vacuum=INCREMENTAL. This takes one full
+    VACUUM, during which every other query waits, so it only runs on request.
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return False
+    if conn.in_transaction:
+        conn.commit()
+    logger.info("Converting database to incremental vacuum (one-time full VACUUM)")
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+    return True
+
+@transaction(_database)
+def incremental_vacuum(conn, pages: int):
+    """Return up to the given number of free pages to the OS; returns how many were freed"""
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    if free:
+        conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+    return free - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
 # Function to load LoRA information from lora.json
 def load_lora_info():
     try:
@@ -373,38 +542,10 @@ def load_lora_info():
 # You can call this function to get the LoRA information when needed
 lora_info = load_lora_info()
 
-def normalize_text(text: str) -> str:
-    """
-    Normalize text by removing special characters and converting to lowercase.
-    This helps detect obfuscated words like 'Ch!ld' or 'C.h.i.l.d'
-    """
-    # Convert to lowercase
-    text = text.lower()
-    # Remove all non-alphanumeric characters
-    text = re.sub(r'[^a-z0-9\s]', '', text)
-    # Remove extra spaces
-    text = ' '.join(text.split())
-    return text
-
 def contains_banned_word(text: str) -> tuple[bool, list[str]]:
     """
     Check if text contains any banned words, accounting for obfuscation attempts.
     Returns a tuple of (bool, list of matched words)
     """
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT word FROM banned_words")
-    banned_words = [row[0] for row in c.fetchall()]
-    conn.close()
-
-    # Normalize the input text
-    normalized_text = normalize_text(text)
-    found_words = []
-
-    # Check each word in the normalized text against normalized banned words
-    for banned_word in banned_words:
-        normalized_banned = normalize_text(banned_word)
-        if normalized_banned in normalized_text:
-            found_words.append(banned_word)
-
+    found_words = banned_word_matcher().find_all(text)
     return bool(found_words), found_words
@@ -0,0 +1,137 @@
+import asyncio
+import functools
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+BUSY_TIMEOUT = 10.0      # seconds SQLite waits on another process's lock before giving up
+LOCKED_RETRIES = 5       # extra attempts when a transaction still fails with "database is locked"
+STATEMENT_CACHE = 256    # prepared statements kept per connection
+
+
+def _is_locked(error: sqlite3.OperationalError) -> bool:
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+class Database:
+    """
+    One long-lived SQLite connection in WAL mode, owned by a dedicated thread.
+    Every query runs on that thread, either blocking the calling thread (run) or
+    awaited from the event loop without blocking it (run_async). WAL lets readers
+    carry on while another process writes, and the busy timeout plus a short retry
+    rides out lock contention between the bot and worker processes.
+    """
+
+    def __init__(self, path: str, busy_timeout: float = BUSY_TIMEOUT):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite')
+        self._local = threading.local()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(
+                self.path, timeout=self.busy_timeout,
+                check_same_thread=False, cached_statements=STATEMENT_CACHE
+            )
+            conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout * 1000)}")
+            # Takes effect for a new database; existing ones are converted by enable_incremental_vacuum
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            mode = conn.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+            if str(mode).lower() != 'wal':
+                logger.warning(f"SQLite journal mode is {mode}, not WAL, for {self.path}")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute("PRAGMA foreign_keys = ON")
+            self._conn = conn
+            logger.debug(f"Opened SQLite connection to {self.path}")
+        return self._conn
+
+    def after_commit(self, callback: Callable[[], None]):
+        """
+        Run callback on the database thread once the current transaction has
+        committed. It is dropped if the transaction rolls back or is retried, so
+        in-memory state mirrored from the database only changes with the data.
+        """
+        if not getattr(self._local, 'active', False):
+            raise RuntimeError("after_commit called outside a transaction")
+        self._local.pending.append(callback)
+
+    def _invoke(self, fn: Callable, args, kwargs) -> Any:
+        """Run fn(conn, ...) as one transaction on the database thread"""
+        self._local.active = True
+        try:
+            for attempt in range(LOCKED_RETRIES + 1):
+                conn = self._connection()
+                self._local.pending = []
+                try:
+                    result = fn(conn, *args, **kwargs)
+                    conn.commit()
+                    callbacks, self._local.pending = self._local.pending, []
+                    for callback in callbacks:
+                        try:
+                            callback()
+                        except Exception as e:
+                            logger.error(f"After-commit callback failed: {str(e)}", exc_info=True)
+                    return result
+                except sqlite3.OperationalError as e:
+                    conn.rollback()
+                    if not _is_locked(e) or attempt == LOCKED_RETRIES:
+                        raise
+                    delay = 0.05 * (2 ** attempt)
+                    logger.warning(f"SQLite busy ({e}), retrying in {delay:.2f}s")
+                    time.sleep(delay)
+                except BaseException:
+                    conn.rollback()
+                    raise
+        finally:
+            self._local.active = False
+            self._local.pending = []
+
+    def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run fn(conn, *args) on the database thread and wait for the result"""
+        if getattr(self._local, 'active', False):
+            # Already inside a transaction on the database thread
+            return fn(self._connection(), *args, **kwargs)
+        return self._executor.submit(self._invoke, fn, args, kwargs).result()
+
+    async def run_async(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run fn(conn, *args) on the database thread without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(self._invoke, fn, args, kwargs)
+        )
+
+    def close(self):
+        """Close the connection and stop the database thread"""
+        def _close():
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        self._executor.submit(_close).result()
+        self._executor.shutdown(wait=True)
+
+
+def transaction(database_getter: Callable[[], Database]):
+    """
+    Decorator for functions taking a connection as their first argument. Calling
+    the function runs it on the database thread; `await fn.aio(...)` does the same
+    from async code without blocking the event loop.
+    """
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def sync(*args, **kwargs):
+            return database_getter().run(fn, *args, **kwargs)
+
+        async def aio(*args, **kwargs):
+            return await database_getter().run_async(fn, *args, **kwargs)
+
+        sync.aio = aio
+        return sync
+    return decorator
@@ -0,0 +1,90 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+from Main.database import add_history_batch
+
+logger = logging.getLogger(__name__)
+
+HISTORY_FIELDS = ('user_id', 'prompt', 'workflow', 'image_filename', 'resolution', 'loras', 'upscale_factor')
+
+
+class HistoryWriter:
+    """
+    The single writer for image_history. Records submitted by in-process jobs and
+    by comfygen workers (through the /history callback) are queued and written in
+    one transaction per batch: as soon as batch_size records are waiting, or
+    flush_interval seconds after the first one of a batch arrived. One commit per
+    batch instead of per job keeps writers from contending for the database lock.
+    """
+
+    def __init__(self, batch_size: int = 50, flush_interval: float = 0.02):
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._full: Optional[asyncio.Event] = None
+        self._closing = False
+
+    def submit(self, record: Dict[str, Any]):
+        """Queue one add_to_history record; never blocks"""
+        if self._closing:
+            raise RuntimeError("History writer is closed")
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._full = asyncio.Event()
+        self._queue.put_nowait(record)
+        if self._queue.qsize() >= self.batch_size:
+            self._full.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Write every record still queued, then stop"""
+        self._closing = True
+        if self._full is not None:
+            self._full.set()
+        if self._task is not None and not self._task.done():
+            await self._task
+        # Records left behind by a writer that died
+        if self._queue is not None and not self._queue.empty():
+            await self._write(self._take(self._queue.qsize()))
+
+    def _take(self, limit: int) -> List[Dict[str, Any]]:
+        batch = []
+        while len(batch) < limit and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self):
+        while not self._queue.empty():
+            # Give the batch flush_interval to fill unless it is already full
+            if self._queue.qsize() < self.batch_size and not self._closing:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            if not self._closing:
+                self._full.clear()
+            await self._write(self._take(self.batch_size))
+
+    async def _write(self, batch: List[Dict[str, Any]]):
+        if not batch:
+            return
+        try:
+            written = await add_history_batch.aio(batch)
+            logger.debug(f"Wrote {written} of {len(batch)} history records")
+        except Exception as e:
+            logger.error(f"Failed to write {len(batch)} history records: {str(e)}", exc_info=True)
+
+
+def history_record(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Validate a history record received as JSON and keep only the known fields"""
+    missing = [name for name in HISTORY_FIELDS if name not in data]
+    if missing:
+        raise ValueError(f"Missing history fields: {', '.join(missing)}")
+    if not isinstance(data['workflow'], dict):
+        raise ValueError("workflow must be an object")
+    record = {name: data[name] for name in HISTORY_FIELDS}
+    record['request_id'] = data.get('request_id')
+    return record
@@ -13,6 +13,9 @@ from typing import Optional, Dict, List
 from pathlib import Path
 from threading import Lock, Timer
 
+from Main.comfy_engine import loras as lora_registry
+from Main.comfy_engine.loras import LoraRegistry
+
 logger = logging.getLogger(__name__)
 
 class DebounceTimer:
@@ -131,8 +134,9 @@ class LoraFileHandler(FileSystemEventHandler):
                         return False
                     
             self.last_valid_config = new_config
-            self.bot.lora_options = new_config.get('available_loras', [])
-            logger.info(f"Reloaded LoRA config with {len(self.bot.lora_options)} entries")
+            # Build the new registry fully before swapping it in for every reader at once
+            registry = lora_registry.install(LoraRegistry.from_config(new_config))
+            logger.info(f"Reloaded LoRA config with {len(registry)} entries")
             return True
 
         except Exception as e:
@@ -0,0 +1,123 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Mapping, Optional
+
+from Main.database import (
+    get_expired_rows, delete_expired_rows, prune_workflow_templates,
+    enable_incremental_vacuum, incremental_vacuum, incremental_vacuum_enabled
+)
+
+logger = logging.getLogger(__name__)
+
+BATCH_PAUSE = 0.05    # seconds between delete batches so other writers get the lock
+VACUUM_PAGES = 1000   # pages returned to the OS per incremental vacuum step
+
+
+def append_archive(path: str, rows: List[Dict[str, Any]]):
+    """Append rows as JSON lines to a gzip file; each call adds one gzip member"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with gzip.open(path, 'at', encoding='utf-8') as f:
+        for row in rows:
+            f.write(json.dumps(row, default=str) + '\n')
+
+
+class HistoryMaintenance:
+    """
+    Background retention for the database. Rows older than each table's retention
+    period are archived to compressed JSONL files and deleted a small batch per
+    transaction, workflow templates left unused are dropped, and the freed pages
+    are returned to the OS with incremental vacuum rather than a full VACUUM.
+    """
+
+    def __init__(self, retention_days: Mapping[str, float], archive_dir: str = '',
+                 interval: float = 86400, batch_size: int = 500, convert_auto_vacuum: bool = False):
+        self.retention_days = {table: days for table, days in retention_days.items() if days > 0}
+        self.archive_dir = archive_dir
+        self.interval = interval
+        self.batch_size = max(1, batch_size)
+        self.convert_auto_vacuum = convert_auto_vacuum
+        self._incremental: Optional[bool] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _check_vacuum(self) -> bool:
+        if self.convert_auto_vacuum:
+            try:
+                await enable_incremental_vacuum.aio()
+            except Exception as e:
+                logger.error(f"Could not enable incremental vacuum: {str(e)}")
+        enabled = await incremental_vacuum_enabled.aio()
+        if not enabled:
+            logger.warning("Incremental vacuum is inactive on this database: space freed by deleted rows is "
+                           "reused but not returned to the OS. Start once with CONVERT_AUTO_VACUUM=true to "
+                           "convert it; this runs a full VACUUM that blocks the database until it finishes.")
+        return enabled
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Database maintenance failed: {str(e)}", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> Dict[str, int]:
+        """Expire every table with a retention period, then reclaim the space"""
+        expired = {}
+        for table, days in self.retention_days.items():
+            expired[table] = await self._expire(table, days)
+        if expired.get('image_history'):
+            pruned = await prune_workflow_templates.aio()
+            logger.debug(f"Pruned {pruned} unused workflow templates")
+        if self._incremental is None:
+            self._incremental = await self._check_vacuum()
+        freed = await self._vacuum() if self._incremental else 0
+        if any(expired.values()) or freed:
+            logger.info(f"Database maintenance: expired {expired}, freed {freed} pages")
+        return expired
+
+    def _archive_path(self, table: str) -> str:
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')
+        return os.path.join(self.archive_dir, f"{table}-{stamp}.jsonl.gz")
+
+    async def _expire(self, table: str, days: float) -> int:
+        path = self._archive_path(table) if self.archive_dir else None
+        total = 0
+        while True:
+            rows = await get_expired_rows.aio(table, days, self.batch_size)
+            if not rows:
+                break
+            # Archived before the delete commits: a failure can only archive a row twice
+            if path:
+                await asyncio.to_thread(append_archive, path, rows)
+            total += await delete_expired_rows.aio(table, [row['id'] for row in rows])
+            await asyncio.sleep(BATCH_PAUSE)
+        return total
+
+    async def _vacuum(self) -> int:
+        freed = 0
+        while True:
+            step = await incremental_vacuum.aio(VACUUM_PAGES)
+            if step <= 0:
+                break
+            freed += step
+            await asyncio.sleep(BATCH_PAUSE)
+        return freed
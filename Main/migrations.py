@@ -0,0 +1,82 @@
+import logging
+import sqlite3
+from typing import Callable, List, Tuple
+
+from Main.workflow_store import compact_history
+
+logger = logging.getLogger(__name__)
+
+Migration = Tuple[int, str, Callable[[sqlite3.Connection], None]]
+
+
+def _add_lookup_indexes(conn: sqlite3.Connection):
+    # get_user_history: WHERE user_id = ? ORDER BY timestamp DESC
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_image_history_user_time ON image_history (user_id, timestamp)")
+    # get_image_info, update_image_info, delete_image_info
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_image_history_filename ON image_history (image_filename)")
+    # get_user_warnings counts, get_all_warnings ordering, remove_user_warnings
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_user_warnings_user_time ON user_warnings (user_id, warned_at)")
+
+
+def _add_request_id(conn: sqlite3.Connection):
+    # Appended last: readers of image_history rows index columns by position.
+    # Existing rows keep NULL, which never conflicts under the unique index.
+    conn.execute("ALTER TABLE image_history ADD COLUMN request_id TEXT")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_image_history_request ON image_history (request_id)")
+
+
+def _compress_workflows(conn: sqlite3.Connection):
+    conn.execute('''CREATE TABLE IF NOT EXISTS workflow_templates
+                    (hash TEXT PRIMARY KEY,
+                     data BLOB NOT NULL)''')
+    conn.execute("ALTER TABLE image_history ADD COLUMN workflow_hash TEXT")
+    conn.execute("ALTER TABLE image_history ADD COLUMN workflow_delta BLOB")
+    compact_history(conn)
+
+
+def _add_retention_indexes(conn: sqlite3.Connection):
+    # Retention picks the oldest rows of each table in batches
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_image_history_time ON image_history (timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_user_warnings_time ON user_warnings (warned_at)")
+    # Finding workflow templates no history row refers to any more
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_image_history_workflow ON image_history (workflow_hash)")
+
+
+# (version, description, upgrade) in ascending version order. Append new steps;
+# never edit or renumber one that has shipped.
+MIGRATIONS: List[Migration] = [
+    (1, 'indexes for history and warning lookups', _add_lookup_indexes),
+    (2, 'unique request id on image history', _add_request_id),
+    (3, 'compressed, deduplicated workflow storage', _compress_workflows),
+    (4, 'indexes for history retention', _add_retention_indexes),
+]
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """
+    Bring the schema up to the latest version recorded in PRAGMA user_version.
+    Each step runs in its own transaction together with the version bump, so an
+    interrupted upgrade resumes from the last completed step on the next start.
+    """
+    current = schema_version(conn)
+    for version, description, upgrade in MIGRATIONS:
+        if version <= current:
+            continue
+        if conn.in_transaction:
+            conn.commit()
+        logger.info(f"Migrating database to version {version}: {description}")
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            upgrade(conn)
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.error(f"Database migration {version} failed", exc_info=True)
+            raise
+        current = version
+    return current
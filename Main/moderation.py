@@ -0,0 +1,301 @@
+import logging
+import re
+import threading
+from typing import Dict, FrozenSet, Iterable, List, Mapping, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Common character substitutions used to dodge the filter, e.g. 'ch1ld' or 'n@ked'
+LEET_MAP = str.maketrans({
+    '0': 'o', '1': 'i', '3': 'e', '4': 'a', '5': 's', '7': 't', '8': 'b', '9': 'g',
+    '@': 'a', '$': 's', '!': 'i', '|': 'l', '+': 't', '€': 'e'
+})
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize text by removing special characters and converting to lowercase.
+    This helps detect obfuscated words like 'Ch!ld' or 'C.h.i.l.d'
+    """
+    # Convert to lowercase
+    text = text.lower()
+    # Remove all non-alphanumeric characters
+    text = re.sub(r'[^a-z0-9\s]', '', text)
+    # Remove extra spaces
+    text = ' '.join(text.split())
+    return text
+
+
+def deleet(text: str) -> str:
+    """Lowercase, undo leetspeak substitutions, then normalize"""
+    return normalize_text(text.lower().translate(LEET_MAP))
+
+
+class _TrieNode:
+    """
+    Immutable trie node. Edits copy only the path to the changed word and share
+    every other subtree, and each node caches its regex fragment, so after adding
+    or removing a word only the nodes on that path are rendered again.
+    """
+    __slots__ = ('children', 'terminal', '_fragment')
+
+    def __init__(self, children: Optional[Dict[str, '_TrieNode']] = None, terminal: bool = False):
+        self.children: Dict[str, _TrieNode] = children or {}
+        self.terminal = terminal
+        self._fragment: Optional[str] = None
+
+    def insert(self, word: str) -> '_TrieNode':
+        if not word:
+            return self if self.terminal else _TrieNode(self.children, True)
+        child = self.children.get(word[0]) or _EMPTY
+        children = dict(self.children)
+        children[word[0]] = child.insert(word[1:])
+        return _TrieNode(children, self.terminal)
+
+    def remove(self, word: str) -> '_TrieNode':
+        if not word:
+            return _TrieNode(self.children) if self.terminal else self
+        child = self.children.get(word[0])
+        if child is None:
+            return self
+        child = child.remove(word[1:])
+        children = dict(self.children)
+        if child.terminal or child.children:
+            children[word[0]] = child
+        else:
+            del children[word[0]]
+        return _TrieNode(children, self.terminal)
+
+    @property
+    def fragment(self) -> str:
+        """
+        Regex alternation for the words below this node, factored by common prefix
+        so the regex engine follows the trie instead of trying every word at every position
+        """
+        if self._fragment is None:
+            branches = [re.escape(char) + child.fragment for char, child in sorted(self.children.items())]
+            if not branches:
+                self._fragment = ''
+            else:
+                body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+                self._fragment = f'(?:{body})?' if self.terminal else body
+        return self._fragment
+
+
+_EMPTY = _TrieNode()
+
+
+def _forms(word: str) -> Set[str]:
+    """The texts a normalized banned word is matched as"""
+    return {word, deleet(word)}
+
+
+class BannedWordMatcher:
+    """
+    Immutable matcher for the banned word list. Each prompt is checked as typed,
+    with punctuation stripped and with leetspeak undone, against one precompiled
+    pattern per form, so a check costs one regex scan per form however long the
+    list is. Adding or removing a word returns a new matcher that shares the
+    unchanged part of the trie and compiles the pattern once.
+    """
+
+    def __init__(self, words: Iterable[str] = ()):
+        trie = _EMPTY
+        owners: Dict[str, FrozenSet[str]] = {}
+        for word in {w for w in (normalize_text(word) for word in words) if w}:
+            for form in _forms(word):
+                owners[form] = owners.get(form, frozenset()) | {word}
+                trie = trie.insert(form)
+        self._set(owners, trie)
+
+    def _set(self, owners: Dict[str, FrozenSet[str]], trie: _TrieNode):
+        # matched text -> banned words it stands for; the first alphabetically is reported
+        self._owners = owners
+        self._trie = trie
+        self.words = frozenset().union(*owners.values())
+        self._pattern = re.compile(r'\b' + trie.fragment + r'\b') if owners else None
+
+    def _derive(self, owners: Dict[str, FrozenSet[str]], trie: _TrieNode) -> 'BannedWordMatcher':
+        matcher = BannedWordMatcher.__new__(BannedWordMatcher)
+        matcher._set(owners, trie)
+        return matcher
+
+    def with_word(self, word: str) -> 'BannedWordMatcher':
+        word = normalize_text(word)
+        if not word or word in self.words:
+            return self
+        owners, trie = dict(self._owners), self._trie
+        for form in _forms(word):
+            if form not in owners:
+                trie = trie.insert(form)
+            owners[form] = owners.get(form, frozenset()) | {word}
+        return self._derive(owners, trie)
+
+    def without_word(self, word: str) -> 'BannedWordMatcher':
+        word = normalize_text(word)
+        if word not in self.words:
+            return self
+        owners, trie = dict(self._owners), self._trie
+        for form in _forms(word):
+            remaining = owners[form] - {word}
+            if remaining:
+                owners[form] = remaining
+            else:
+                del owners[form]
+                trie = trie.remove(form)
+        return self._derive(owners, trie)
+
+    def _word(self, form: str) -> str:
+        return min(self._owners[form])
+
+    def _variants(self, text: str) -> List[str]:
+        lowered = text.lower()
+        variants = [lowered]
+        for variant in (normalize_text(lowered), deleet(lowered)):
+            if variant not in variants:
+                variants.append(variant)
+        return variants
+
+    def find(self, text: str) -> Optional[str]:
+        """The first banned word found in any form of the text, or None"""
+        if self._pattern is None:
+            return None
+        for variant in self._variants(text):
+            match = self._pattern.search(variant)
+            if match:
+                return self._word(match.group(0))
+        return None
+
+    def find_all(self, text: str) -> List[str]:
+        """Every banned word found in any form of the text, in order of appearance"""
+        if self._pattern is None:
+            return []
+        found = []
+        for variant in self._variants(text):
+            for match in self._pattern.finditer(variant):
+                word = self._word(match.group(0))
+                if word not in found:
+                    found.append(word)
+        return found
+
+
+_matcher: Optional[BannedWordMatcher] = None
+_lock = threading.Lock()
+
+
+def banned_word_matcher() -> BannedWordMatcher:
+    """
+    The shared matcher. The bot loads it at startup with load_banned_word_matcher;
+    other callers build it from the banned_words table on first use.
+    """
+    matcher = _matcher
+    if matcher is None:
+        from Main.database import load_banned_word_matcher
+        matcher = load_banned_word_matcher()
+    return matcher
+
+
+def install_banned_word_matcher(matcher: BannedWordMatcher) -> BannedWordMatcher:
+    """Keep the first loaded matcher; called on the database thread like install_moderation_state"""
+    global _matcher
+    with _lock:
+        if _matcher is None:
+            _matcher = matcher
+            logger.debug(f"Built banned word matcher with {len(matcher.words)} words")
+        return _matcher
+
+
+def banned_word_added(word: str):
+    """Add a word to the shared matcher after it was stored"""
+    global _matcher
+    with _lock:
+        if _matcher is not None:
+            _matcher = _matcher.with_word(word)
+
+
+def banned_word_removed(word: str):
+    """Drop a word from the shared matcher after it was deleted"""
+    global _matcher
+    with _lock:
+        if _matcher is not None:
+            _matcher = _matcher.without_word(word)
+
+
+class ModerationState:
+    """
+    Banned user ids and per-user warning counts, mirrored from the banned_users
+    and user_warnings tables so ban and strike checks need no database round
+    trip. The database functions that change those tables update it once their
+    write has committed.
+    """
+
+    def __init__(self, banned: Iterable[str] = (), warnings: Optional[Mapping[str, int]] = None):
+        self.banned = set(banned)
+        self.warnings: Dict[str, int] = dict(warnings or {})
+
+    def is_banned(self, user_id: str) -> bool:
+        return user_id in self.banned
+
+    def warning_count(self, user_id: str) -> int:
+        return self.warnings.get(user_id, 0)
+
+
+_state: Optional[ModerationState] = None
+
+
+def moderation_state() -> ModerationState:
+    """The shared ban and warning state, loaded from the database on first use"""
+    state = _state
+    if state is None:
+        from Main.database import load_moderation_state
+        state = load_moderation_state()
+    return state
+
+
+def install_moderation_state(state: ModerationState) -> ModerationState:
+    """
+    Keep the first loaded state. Called on the database thread, so no write can
+    land between reading the tables and installing the snapshot.
+    """
+    global _state
+    with _lock:
+        if _state is None:
+            _state = state
+            logger.debug(f"Loaded moderation state: {len(state.banned)} banned users, "
+                         f"{len(state.warnings)} users with warnings")
+        return _state
+
+
+def user_banned(user_id: str):
+    with _lock:
+        if _state is not None:
+            _state.banned.add(user_id)
+
+
+def user_unbanned(user_id: str):
+    with _lock:
+        if _state is not None:
+            _state.banned.discard(user_id)
+
+
+def user_warned(user_id: str):
+    with _lock:
+        if _state is not None:
+            _state.warnings[user_id] = _state.warnings.get(user_id, 0) + 1
+
+
+def user_warnings_removed(user_id: str):
+    with _lock:
+        if _state is not None:
+            _state.warnings.pop(user_id, None)
+
+
+def warning_counts_changed(counts: Mapping[str, int]):
+    """Set the warning counts of users whose warnings expired"""
+    with _lock:
+        if _state is not None:
+            for user_id, count in counts.items():
+                if count:
+                    _state.warnings[user_id] = count
+                else:
+                    _state.warnings.pop(user_id, None)
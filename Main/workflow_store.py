@@ -0,0 +1,149 @@
+import copy
+import hashlib
+import json
+import logging
+import sqlite3
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Inputs that change from one job to the next; everything else in a workflow is
+# the same for every job run from the same template
+VOLATILE_INPUTS = frozenset({
+    'prompt', 'text', 'seed', 'noise_seed', 'ratio_selected', 'rescale_factor',
+    'image', 'image_strength', 'conditioning_to_strength'
+})
+LORA_PREFIX = 'lora_'
+COMPRESSION_LEVEL = 6
+TEMPLATE_CACHE_SIZE = 64
+
+_templates: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+
+
+def _is_volatile(name: str) -> bool:
+    return name in VOLATILE_INPUTS or name.startswith(LORA_PREFIX)
+
+
+def _canonical(data: Any) -> bytes:
+    return json.dumps(data, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def _pack(data: Any) -> bytes:
+    return zlib.compress(_canonical(data), COMPRESSION_LEVEL)
+
+
+def _unpack(blob: bytes) -> Any:
+    return json.loads(zlib.decompress(blob).decode('utf-8'))
+
+
+def split_workflow(workflow: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+    """
+    Split a workflow into its template (volatile inputs removed) and the delta of
+    per-job values ({node_id: {input: value}}) that turns it back into the workflow
+    """
+    template = {}
+    delta = {}
+    for node_id, node in workflow.items():
+        if not isinstance(node, dict) or not isinstance(node.get('inputs'), dict):
+            template[node_id] = copy.deepcopy(node)
+            continue
+        inputs = {}
+        for name, value in node['inputs'].items():
+            if _is_volatile(name):
+                delta.setdefault(node_id, {})[name] = value
+            else:
+                inputs[name] = value
+        template[node_id] = copy.deepcopy(dict(node, inputs=inputs))
+    return template, delta
+
+
+def join_workflow(template: Dict[str, Any], delta: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    workflow = copy.deepcopy(template)
+    for node_id, values in delta.items():
+        node = workflow.get(node_id)
+        if isinstance(node, dict) and isinstance(node.get('inputs'), dict):
+            node['inputs'].update(values)
+    return workflow
+
+
+def store_workflow(conn: sqlite3.Connection, workflow: Dict[str, Any]) -> Tuple[str, bytes]:
+    """
+    Save the workflow's template once under its content hash and return
+    (template hash, compressed delta) to store with the history row
+    """
+    template, delta = split_workflow(workflow)
+    text = _canonical(template)
+    template_hash = hashlib.sha256(text).hexdigest()
+    # A primary key probe when the template is already stored
+    conn.execute(
+        "INSERT OR IGNORE INTO workflow_templates (hash, data) VALUES (?, ?)",
+        (template_hash, zlib.compress(text, COMPRESSION_LEVEL))
+    )
+    return template_hash, _pack(delta)
+
+
+def _remember(template_hash: str, template: Dict[str, Any]):
+    _templates[template_hash] = template
+    _templates.move_to_end(template_hash)
+    while len(_templates) > TEMPLATE_CACHE_SIZE:
+        _templates.popitem(last=False)
+
+
+def _template(conn: sqlite3.Connection, template_hash: str) -> Optional[Dict[str, Any]]:
+    template = _templates.get(template_hash)
+    if template is None:
+        row = conn.execute("SELECT data FROM workflow_templates WHERE hash = ?", (template_hash,)).fetchone()
+        if row is None:
+            return None
+        template = _unpack(row[0])
+        _remember(template_hash, template)
+    return template
+
+
+def load_workflow(conn: sqlite3.Connection, legacy_json: Optional[str],
+                  template_hash: Optional[str], delta_blob: Optional[bytes]) -> Optional[Dict[str, Any]]:
+    """Rebuild a history row's workflow from its template and delta, or its legacy JSON column"""
+    if template_hash:
+        template = _template(conn, template_hash)
+        if template is None:
+            logger.error(f"Workflow template {template_hash} is missing")
+            return None
+        return join_workflow(template, _unpack(delta_blob) if delta_blob else {})
+    if legacy_json:
+        try:
+            return json.loads(legacy_json)
+        except (TypeError, ValueError):
+            logger.warning("Unreadable workflow JSON in history row")
+    return None
+
+
+def compact_history(conn: sqlite3.Connection, batch_size: int = 500) -> int:
+    """Move legacy JSON workflows in image_history to template + delta storage"""
+    compacted = 0
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, workflow FROM image_history WHERE id > ? AND workflow IS NOT NULL "
+            "AND workflow_hash IS NULL ORDER BY id LIMIT ?",
+            (last_id, batch_size)
+        ).fetchall()
+        if not rows:
+            break
+        for row_id, workflow_json in rows:
+            last_id = row_id
+            try:
+                workflow = json.loads(workflow_json)
+            except (TypeError, ValueError):
+                continue
+            if not isinstance(workflow, dict):
+                continue
+            template_hash, delta_blob = store_workflow(conn, workflow)
+            conn.execute(
+                "UPDATE image_history SET workflow = NULL, workflow_hash = ?, workflow_delta = ? WHERE id = ?",
+                (template_hash, delta_blob, row_id)
+            )
+            compacted += 1
+    logger.info(f"Compacted {compacted} stored workflows")
+    return compacted
@@ -1,9 +1,7 @@
 import discord
 from discord.ext import commands as discord_commands
 import asyncio
-import subprocess
 import os
-import platform
 import uuid
 from typing import Dict, Optional, Any
 
@@ -23,14 +21,45 @@ from config import (
     ENABLE_PROMPT_ENHANCEMENT,  
     AI_PROVIDER,               
     LMSTUDIO_HOST,
-    LMSTUDIO_PORT             
+    LMSTUDIO_PORT,
+    COMFYUI_BACKENDS,
+    COMFY_WORKERS,
+    OUTPUT_FETCH_CONCURRENCY,
+    WEBSOCKET_OUTPUTS,
+    MAX_QUEUE_LENGTH,
+    MAX_JOBS_PER_GUILD,
+    MAX_JOBS_PER_USER,
+    MODEL_AFFINITY_WINDOW,
+    OUTPUT_CACHE_DIR,
+    OUTPUT_CACHE_MAX_MB,
+    OUTPUT_DELIVERY_MODE,
+    PROGRESS_EDIT_INTERVAL,
+    DISCORD_CACHE_TTL,
+    HISTORY_BATCH_SIZE,
+    HISTORY_FLUSH_MS,
+    HISTORY_RETENTION_DAYS,
+    WARNING_RETENTION_DAYS,
+    ARCHIVE_DIR,
+    MAINTENANCE_INTERVAL_HOURS,
+    MAINTENANCE_BATCH_SIZE,
+    CONVERT_AUTO_VACUUM
 )
 from Main.custom_commands import (
     RequestItem, ReduxRequestItem, ReduxPromptRequestItem,
     ImageControlView, setup_commands
 )
-from Main.database import init_db, get_all_image_info
-from Main.custom_commands.web_handlers import handle_generated_image
+from Main.database import init_db, get_queue_weights, load_banned_word_matcher, load_moderation_state, close_db
+from Main.history_writer import HistoryWriter
+from Main.maintenance import HistoryMaintenance
+from Main.custom_commands.web_handlers import handle_generated_image, BotReporter
+from Main.custom_commands.queue_utils import check_queue_capacity
+from Main.custom_commands.progress_editor import ProgressEditor
+from Main.custom_commands.discord_cache import DiscordCache
+from Main.comfy_engine import (
+    ComfyEngine, AdmissionController, AdmissionRejected, FairScheduler, LoraRegistry, OutputCache,
+    job_from_request_item, discard_request_files, request_model_family
+)
+from Main.comfy_engine import loras as lora_registry
 from Main.utils import load_json
 from web_server import start_web_server
 from Main.lora_monitor import setup_lora_monitor, cleanup_lora_monitor
@@ -71,129 +100,99 @@ discord_logger.setLevel(logging.INFO)
 class MyBot(discord_commands.Bot):
     def __init__(self):
         super().__init__(command_prefix=COMMAND_PREFIX, intents=intents)
-        self.subprocess_queue = asyncio.Queue()
+        self.subprocess_queue = FairScheduler(affinity_window=MODEL_AFFINITY_WINDOW)
         self.pending_requests = {}
+        self.discord_cache = DiscordCache(self, ttl=DISCORD_CACHE_TTL)
+        self.discord_cache.register_listeners()
+        self.progress_editor = ProgressEditor(self, interval=PROGRESS_EDIT_INTERVAL)
+        self.history_writer = HistoryWriter(batch_size=HISTORY_BATCH_SIZE, flush_interval=HISTORY_FLUSH_MS / 1000)
+        self.maintenance = HistoryMaintenance(
+            {'image_history': HISTORY_RETENTION_DAYS, 'user_warnings': WARNING_RETENTION_DAYS},
+            archive_dir=ARCHIVE_DIR,
+            interval=MAINTENANCE_INTERVAL_HOURS * 3600,
+            batch_size=MAINTENANCE_BATCH_SIZE,
+            convert_auto_vacuum=CONVERT_AUTO_VACUUM
+        )
         self.ai_provider = None
         self.allowed_channels = set(CHANNEL_IDS)
         self.resolution_options = []
-        self.lora_options = []
         self.tree.on_error = self.on_tree_error
+        output_cache = OutputCache(OUTPUT_CACHE_DIR, OUTPUT_CACHE_MAX_MB * 1024 * 1024) if OUTPUT_CACHE_MAX_MB > 0 else None
+        self.engine = ComfyEngine(
+            COMFYUI_BACKENDS, BotReporter(self),
+            workers=COMFY_WORKERS, cache=output_cache, delivery=OUTPUT_DELIVERY_MODE,
+            fetch_concurrency=OUTPUT_FETCH_CONCURRENCY, websocket_outputs=WEBSOCKET_OUTPUTS
+        )
+        self.admission = AdmissionController(
+            max_queue=MAX_QUEUE_LENGTH,
+            max_per_guild=MAX_JOBS_PER_GUILD,
+            max_per_user=MAX_JOBS_PER_USER,
+            workers=COMFY_WORKERS
+        )
         setup_lora_monitor(self)
 
-    def get_python_command(self):
-        """Get the appropriate Python command based on the platform"""
-        if platform.system() == "Windows":
-            return "python"
-        return "python3"
-
-    async def process_redux_request(self, request_id: str, request_item) -> None:
-        """Process a redux image generation request."""
+    @property
+    def lora_registry(self) -> LoraRegistry:
+        """The current LoRA registry, swapped in whole by the lora.json monitor"""
+        return lora_registry.current()
+
+    @property
+    def lora_options(self):
+        return self.lora_registry.entries
+
+    def guild_key_for_channel(self, channel_id) -> str:
+        """Guild id used for queue accounting; empty for DMs or unknown channels"""
+        channel = self.get_channel(int(channel_id))
+        guild = getattr(channel, 'guild', None)
+        return str(guild.id) if guild else ''
+
+    async def enqueue_request(self, request_item) -> bool:
+        """
+        Admit a request into the generation queue. If admission control rejects it,
+        the request's progress message is replaced with the retry-after notice.
+        """
+        guild_id = self.guild_key_for_channel(request_item.channel_id)
+        self.discord_cache.remember_message(int(request_item.channel_id), int(request_item.original_message_id))
         try:
-            # Create temp directory with absolute path
-            temp_dir = os.path.abspath(os.path.join('Main', 'DataSets', 'temp'))
-            os.makedirs(temp_dir, exist_ok=True)
-            
-            # Use the filenames from the request item
-            image1_path = os.path.join(temp_dir, request_item.image1_filename)
-            image2_path = os.path.join(temp_dir, request_item.image2_filename)
-            
-            # Save images with request ID in filenames
-            with open(image1_path, 'wb') as f:
-                f.write(request_item.image1)
-            with open(image2_path, 'wb') as f:
-                f.write(request_item.image2)
-
-            # Convert to absolute paths and use forward slashes
-            image1_path = image1_path.replace('\\', '/')
-            image2_path = image2_path.replace('\\', '/')
-
-            logger.debug(f"Saved images at: {image1_path}, {image2_path}")
-
-            python_cmd = self.get_python_command()
-            
-            subprocess.Popen([
-                python_cmd,
-                'comfygen.py',
-                request_id,
-                request_item.user_id,
-                request_item.channel_id,
-                request_item.interaction_id,
-                request_item.original_message_id,
-                'redux',
-                request_item.resolution,
-                str(request_item.strength1),
-                str(request_item.strength2),
-                request_item.workflow_filename,
-                image1_path,
-                image2_path
-            ])
-            
-            logger.debug(f"Started redux processing for request {request_id}")
-            
-        except Exception as e:
-            logger.error(f"Error in process_redux_request: {e}", exc_info=True)
-            if request_id in self.pending_requests:
-                del self.pending_requests[request_id]
-            raise
-
-    async def process_subprocess_queue(self):
-        while True:
+            self.admission.admit(request_item.original_message_id, request_item.user_id, guild_id)
+        except AdmissionRejected as e:
+            logger.info(f"Rejected request from {request_item.user_id}: {e.reason}")
+            await asyncio.to_thread(discard_request_files, request_item)
             try:
-                request_item = await self.subprocess_queue.get()
-                request_id = str(uuid.uuid4())
-                self.pending_requests[request_id] = request_item
-
-                if isinstance(request_item, ReduxRequestItem):
-                    await self.process_redux_request(request_id, request_item)
-                elif isinstance(request_item, ReduxPromptRequestItem):
-                    # Image is already saved, use the path directly
-                    python_cmd = self.get_python_command()
-                    subprocess.Popen([
-                        python_cmd,
-                        'comfygen.py',
-                        request_id,
-                        request_item.user_id,
-                        request_item.channel_id,
-                        request_item.interaction_id,
-                        request_item.original_message_id,
-                        'reduxprompt',
-                        request_item.prompt,
-                        request_item.resolution,
-                        str(request_item.strength),
-                        request_item.workflow_filename,
-                        request_item.image_path  # Use the already saved image path
-                    ])
-                else:
-                    # Standard request processing
-                    python_cmd = self.get_python_command()
-                    subprocess.Popen([
-                        python_cmd,
-                        'comfygen.py',
-                        request_id,
-                        request_item.user_id,
-                        request_item.channel_id,
-                        request_item.interaction_id,
-                        request_item.original_message_id,
-                        'standard',  # Indicate this is a standard request
-                        request_item.prompt,
-                        request_item.resolution,
-                        json.dumps(request_item.loras),
-                        str(request_item.upscale_factor),
-                        request_item.workflow_filename,  # Pass the workflow filename
-                        str(request_item.seed) if request_item.seed is not None else "None",
-                        str(request_item.is_pulid).lower()  # Pass is_pulid flag
-                    ])
-
-                self.subprocess_queue.task_done()
-                
-            except Exception as e:
-                logger.error(f"Error in process_subprocess_queue: {e}")
+                message = await self.discord_cache.message(
+                    int(request_item.channel_id), int(request_item.original_message_id)
+                )
+                await message.edit(content=f"⏳ {e}")
+            except discord.HTTPException as edit_error:
+                logger.error(f"Error reporting queue rejection: {edit_error}")
+            return False
+
+        family = await asyncio.to_thread(request_model_family, request_item)
+        await self.subprocess_queue.put(request_item, request_item.user_id, guild_id, family=family)
+        return True
+
+    async def prepare_job(self, request_item):
+        """Register a queued request and turn it into a ComfyUI job"""
+        request_id = str(uuid.uuid4())
+        self.pending_requests[request_id] = request_item
+        self.admission.started(request_item.original_message_id)
+        try:
+            return await asyncio.to_thread(job_from_request_item, request_id, request_item)
+        except Exception:
+            del self.pending_requests[request_id]
+            self.admission.release(request_item.original_message_id)
+            raise
 
     async def setup_hook(self):
         """Setup hook that runs before the bot starts."""
         logger.info("=== Starting Bot Setup ===")
         logger.info("Initializing database...")
-        init_db()
+        await init_db.aio()
+        await load_banned_word_matcher.aio()
+        await load_moderation_state.aio()
+        user_weights, guild_weights = await get_queue_weights.aio()
+        self.subprocess_queue.set_weights(user_weights, guild_weights)
+        self.maintenance.start()
         
         logger.info("Setting up AI provider...")
         try:
@@ -222,8 +221,7 @@ class MyBot(discord_commands.Bot):
             self.resolution_options = list(ratios_data['ratios'].keys())
             logger.info(f"Loaded {len(self.resolution_options)} resolution options")
 
-            lora_data = load_json('lora.json')
-            self.lora_options = lora_data['available_loras']
+            lora_registry.load_registry()
             logger.info(f"Loaded {len(self.lora_options)} LoRA options")
             
             # Register redux command after options are loaded
@@ -250,6 +248,9 @@ class MyBot(discord_commands.Bot):
                         )
                         return
 
+                    if not await check_queue_capacity(interaction):
+                        return
+
                     # Show the modal for image upload and strength settings
                     modal = ReduxModal(self, resolution)
                     await interaction.response.send_modal(modal)
@@ -276,9 +277,9 @@ class MyBot(discord_commands.Bot):
         ImageControlView.register_view(self)
         logger.info("Views registered successfully")
         
-        # Start processing subprocess queue
-        logger.info("Starting subprocess queue...")
-        self.bg_task = self.loop.create_task(self.process_subprocess_queue())
+        # Start the ComfyUI workers consuming the request queue
+        logger.info("Starting ComfyUI engine...")
+        self.engine.start(self.subprocess_queue, self.prepare_job)
         
         logger.info("Starting web server...")
         await start_web_server(self)
@@ -303,7 +304,11 @@ class MyBot(discord_commands.Bot):
 
     async def close(self):
         cleanup_lora_monitor(self)
+        await self.engine.stop()
+        await self.maintenance.stop()
+        await self.history_writer.close()
         await super().close()
+        await asyncio.to_thread(close_db)
 
     async def on_ready(self):
         logger.info(f"=== Bot Ready: {self.user} ===")
@@ -332,8 +337,7 @@ class MyBot(discord_commands.Bot):
             ratios_data = load_json('ratios.json')
             self.resolution_options = list(ratios_data['ratios'].keys())
 
-            lora_data = load_json('lora.json')
-            self.lora_options = lora_data['available_loras']
+            lora_registry.load_registry()
             logger.info("Successfully reloaded options")
             
             # Reinitialize AI provider if enabled
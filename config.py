@@ -7,8 +7,52 @@ load_dotenv()
 # Server configurations
 BOT_SERVER = os.getenv('BOT_SERVER', 'localhost')
 server_address = os.getenv('server_address')
+# Comma separated ComfyUI servers as host or host:port; defaults to server_address
+COMFYUI_BACKENDS = [
+    backend.strip()
+    for backend in os.getenv('COMFYUI_BACKENDS', server_address or '').split(',')
+    if backend.strip()
+]
+# Number of jobs the bot runs against ComfyUI concurrently
+COMFY_WORKERS = int(os.getenv('COMFY_WORKERS', '4'))
+# Output files downloaded from ComfyUI at once
+OUTPUT_FETCH_CONCURRENCY = int(os.getenv('OUTPUT_FETCH_CONCURRENCY', '4'))
+# Receive images over the websocket via SaveImageWebsocket instead of /history and /view
+WEBSOCKET_OUTPUTS = os.getenv('WEBSOCKET_OUTPUTS', 'false').lower() == 'true'
+# Admission control: 0 disables a limit
+MAX_QUEUE_LENGTH = int(os.getenv('MAX_QUEUE_LENGTH', '50'))
+MAX_JOBS_PER_GUILD = int(os.getenv('MAX_JOBS_PER_GUILD', '20'))
+MAX_JOBS_PER_USER = int(os.getenv('MAX_JOBS_PER_USER', '3'))
+# How far (in jobs) a same-model job may jump the fair order to avoid a model swap; 0 disables
+MODEL_AFFINITY_WINDOW = float(os.getenv('MODEL_AFFINITY_WINDOW', '3'))
+# Cache of finished outputs keyed by workflow; off unless given a size in MB
+OUTPUT_CACHE_DIR = os.getenv('OUTPUT_CACHE_DIR', 'output_cache')
+OUTPUT_CACHE_MAX_MB = int(os.getenv('OUTPUT_CACHE_MAX_MB', '0'))
+# 'bytes' passes finished files to the bot in memory; 'reference' passes only their location
+OUTPUT_DELIVERY_MODE = os.getenv('OUTPUT_DELIVERY_MODE', 'bytes').lower()
+# ComfyUI output directory as mounted on the bot's machine, if it is shared
+COMFYUI_OUTPUT_DIR = os.getenv('COMFYUI_OUTPUT_DIR', '')
+# Results posted to the callback server: kept in memory up to UPLOAD_SPOOL_MB, then on disk; 0 MB max disables the limit
+UPLOAD_SPOOL_MB = float(os.getenv('UPLOAD_SPOOL_MB', '8'))
+UPLOAD_MAX_MB = float(os.getenv('UPLOAD_MAX_MB', '500'))
+# History records from all jobs are committed together: when this many are waiting or after this many milliseconds
+HISTORY_BATCH_SIZE = int(os.getenv('HISTORY_BATCH_SIZE', '50'))
+HISTORY_FLUSH_MS = float(os.getenv('HISTORY_FLUSH_MS', '20'))
+# Database retention: rows older than this many days are archived and deleted; 0 keeps them forever
+HISTORY_RETENTION_DAYS = float(os.getenv('HISTORY_RETENTION_DAYS', '0'))
+WARNING_RETENTION_DAYS = float(os.getenv('WARNING_RETENTION_DAYS', '0'))
+# Expired rows are written here as compressed JSONL before deletion; empty deletes without archiving
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'history_archive')
+MAINTENANCE_INTERVAL_HOURS = float(os.getenv('MAINTENANCE_INTERVAL_HOURS', '24'))
+MAINTENANCE_BATCH_SIZE = int(os.getenv('MAINTENANCE_BATCH_SIZE', '500'))
+# Convert an existing database to incremental vacuum at startup with one blocking full VACUUM
+CONVERT_AUTO_VACUUM = os.getenv('CONVERT_AUTO_VACUUM', 'false').lower() == 'true'
 
 # Discord configurations
+# Minimum seconds between progress-message edits in one channel
+PROGRESS_EDIT_INTERVAL = float(os.getenv('PROGRESS_EDIT_INTERVAL', '1.0'))
+# Seconds cached channels, progress messages and member colours stay valid
+DISCORD_CACHE_TTL = float(os.getenv('DISCORD_CACHE_TTL', '600'))
 DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
 COMMAND_PREFIX = os.getenv('COMMAND_PREFIX')
 CHANNEL_IDS = [int(id) for id in os.getenv('CHANNEL_IDS').split(',')]
@@ -37,6 +81,30 @@ intents.message_content = True
 __all__ = [
     'BOT_SERVER',
     'server_address',
+    'COMFYUI_BACKENDS',
+    'COMFY_WORKERS',
+    'OUTPUT_FETCH_CONCURRENCY',
+    'WEBSOCKET_OUTPUTS',
+    'MAX_QUEUE_LENGTH',
+    'MAX_JOBS_PER_GUILD',
+    'MAX_JOBS_PER_USER',
+    'MODEL_AFFINITY_WINDOW',
+    'OUTPUT_CACHE_DIR',
+    'OUTPUT_CACHE_MAX_MB',
+    'OUTPUT_DELIVERY_MODE',
+    'COMFYUI_OUTPUT_DIR',
+    'UPLOAD_SPOOL_MB',
+    'UPLOAD_MAX_MB',
+    'HISTORY_BATCH_SIZE',
+    'HISTORY_FLUSH_MS',
+    'HISTORY_RETENTION_DAYS',
+    'WARNING_RETENTION_DAYS',
+    'ARCHIVE_DIR',
+    'MAINTENANCE_INTERVAL_HOURS',
+    'MAINTENANCE_BATCH_SIZE',
+    'CONVERT_AUTO_VACUUM',
+    'PROGRESS_EDIT_INTERVAL',
+    'DISCORD_CACHE_TTL',
     'DISCORD_TOKEN',
     'COMMAND_PREFIX',
     'CHANNEL_IDS',
@@ -0,0 +1,26 @@
+import os
+
+import pytest
+
+# config.py requires these without defaults; set them before anything imports it
+for name, value in {
+    'CHANNEL_IDS': '1',
+    'ALLOWED_SERVERS': '1',
+    'BOT_MANAGER_ROLE_ID': '1',
+    'PULIDWORKFLOW': 'PulidFluxDev.json',
+}.items():
+    os.environ.setdefault(name, value)
+
+from Main import database, moderation  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A fresh database file and empty moderation state for each test"""
+    database.close_db()
+    monkeypatch.setattr(database, 'DB_NAME', str(tmp_path / 'image_history.db'))
+    monkeypatch.setattr(database, 'BANNED_WORDS_FILE', str(tmp_path / 'banned.json'))
+    monkeypatch.setattr(moderation, '_matcher', None)
+    monkeypatch.setattr(moderation, '_state', None)
+    yield tmp_path / 'image_history.db'
+    database.close_db()
@@ -0,0 +1,78 @@
+import pytest
+
+from Main.comfy_engine.admission import AdmissionController, AdmissionRejected, format_retry_after
+
+
+def test_queue_cap():
+    admission = AdmissionController(max_queue=2)
+    admission.admit(1, 'a', 'g')
+    admission.admit(2, 'b', 'g')
+    with pytest.raises(AdmissionRejected) as rejected:
+        admission.admit(3, 'c', 'g')
+    assert rejected.value.retry_after > 0
+
+    # Running jobs no longer count as waiting
+    admission.started(1)
+    admission.admit(3, 'c', 'g')
+    assert admission.waiting == 2
+    assert admission.in_flight == 3
+
+
+def test_user_cap_counts_waiting_and_running():
+    admission = AdmissionController(max_per_user=2)
+    admission.admit(1, 'a', 'g')
+    admission.admit(2, 'a', 'g')
+    admission.started(1)
+    assert admission.check('a', 'g') is not None
+    assert admission.check('b', 'g') is None
+
+    admission.release(1)
+    assert admission.check('a', 'g') is None
+
+
+def test_guild_cap_ignores_direct_messages():
+    admission = AdmissionController(max_per_guild=1)
+    admission.admit(1, 'a', 'g')
+    assert admission.check('b', 'g') is not None
+    assert admission.check('b', 'other') is None
+    admission.admit(2, 'b', '')
+    admission.admit(3, 'c', '')
+
+
+def test_release_of_waiting_job_frees_its_slot():
+    admission = AdmissionController(max_queue=1, max_per_user=1)
+    admission.admit(1, 'a', 'g')
+    admission.release(1)
+    assert admission.waiting == 0
+    assert admission.in_flight == 0
+    admission.admit(2, 'a', 'g')
+
+
+def test_release_and_admit_are_idempotent():
+    admission = AdmissionController(max_per_user=1)
+    admission.admit(1, 'a', 'g')
+    admission.admit(1, 'a', 'g')
+    admission.release(1)
+    admission.release(1)
+    assert admission.in_flight == 0
+    assert admission.check('a', 'g') is None
+
+
+def test_disabled_caps_admit_everything():
+    admission = AdmissionController()
+    for ticket in range(100):
+        admission.admit(ticket, 'a', 'g')
+    assert admission.waiting == 100
+
+
+def test_retry_after_uses_average_duration():
+    admission = AdmissionController(max_queue=1, workers=2)
+    admission.average_job_seconds = 60
+    admission.admit(1, 'a', 'g')
+    assert admission.check('b', 'g').retry_after == 30
+
+
+def test_format_retry_after():
+    assert format_retry_after(45) == '45 seconds'
+    assert format_retry_after(60) == '1 minute'
+    assert format_retry_after(61) == '2 minutes'
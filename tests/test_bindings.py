@@ -0,0 +1,85 @@
+import glob
+import json
+import os
+
+import pytest
+
+from Main.comfy_engine.bindings import BindingError, compile_plan, manifest_entry
+from Main.comfy_engine.templates import TemplateCache
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATASETS = os.path.join(ROOT, 'Main', 'Datasets')
+# Dataset files that are not workflow templates
+NOT_TEMPLATES = {'bindings.json', 'lora.json', 'ratios.json'}
+TEMPLATES = sorted(
+    os.path.basename(path) for path in glob.glob(os.path.join(DATASETS, '*.json'))
+    if os.path.basename(path) not in NOT_TEMPLATES
+)
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    return TemplateCache()
+
+
+def test_templates_are_bundled():
+    assert 'Redux.json' in TEMPLATES
+    assert len(TEMPLATES) > 10
+
+
+@pytest.mark.parametrize('name', TEMPLATES)
+def test_every_template_compiles(cache, name):
+    plan = cache.plan(name)
+    manifest = cache.get('bindings.json')
+    assert plan.family in manifest
+    assert set(plan.bindings) == set(manifest[plan.family]['parameters'])
+    assert cache.plan(name) is plan
+
+
+@pytest.mark.parametrize('name', TEMPLATES)
+def test_every_bound_parameter_can_be_set(cache, name):
+    plan = cache.plan(name)
+    template = cache.get(name)
+    snapshot = json.loads(json.dumps(template))
+    workflow = cache.instance(name)
+    values = {parameter: [('style.safetensors', 0.5)] if binding.type == 'lora_stack' else f'test-{parameter}'
+              for parameter, binding in plan.bindings.items()}
+    plan.apply(workflow, **values)
+
+    for parameter, binding in plan.bindings.items():
+        inputs = workflow[binding.node]['inputs']
+        if binding.type == 'lora_stack':
+            assert inputs['lora_1'] == {'on': True, 'lora': 'style.safetensors', 'strength': 0.5}
+            assert 'lora_2' not in inputs
+        else:
+            assert inputs[binding.input] == f'test-{parameter}'
+    assert template == snapshot
+
+
+def test_none_values_are_skipped(cache):
+    plan = cache.plan('Redux.json')
+    workflow = cache.instance('Redux.json')
+    binding = plan.bindings['seed']
+    before = workflow[binding.node]['inputs'][binding.input]
+    plan.apply(workflow, seed=None, unknown=1)
+    assert workflow[binding.node]['inputs'][binding.input] == before
+
+
+def test_plan_for_matches_by_template_or_shape(cache):
+    workflow = cache.instance('Redux.json')
+    assert cache.plan_for(workflow).family == 'redux'
+    with pytest.raises(BindingError):
+        cache.plan_for(workflow, 'flux')
+    # A workflow without a template name is matched by its shape
+    assert cache.plan_for(dict(cache.get('Redux.json')), 'redux').family == 'redux'
+
+
+def test_mismatched_template_is_rejected():
+    parameters = {'prompt': {'node': '6', 'input': 'text'}}
+    with pytest.raises(BindingError):
+        compile_plan('flux', {'6': {'inputs': {'other': 1}}}, parameters)
+    with pytest.raises(BindingError):
+        compile_plan('flux', {}, parameters)
+    with pytest.raises(BindingError):
+        manifest_entry({'flux': {'templates': ['flux*.json'], 'parameters': {}}}, 'Other.json')
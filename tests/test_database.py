@@ -0,0 +1,151 @@
+import json
+import sqlite3
+
+import pytest
+
+from Main import database, moderation
+from Main.db import transaction
+from Main.migrations import MIGRATIONS, migrate, schema_version
+
+
+WORKFLOW = {
+    '1': {'class_type': 'CLIPTextEncode', 'inputs': {'text': 'a red fox'}},
+    '2': {'class_type': 'KSampler', 'inputs': {'seed': 42, 'steps': 20}},
+}
+
+
+def _create_baseline(path):
+    """image_history as the bot created it before any migration"""
+    conn = sqlite3.connect(path)
+    conn.execute('''CREATE TABLE image_history
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     user_id TEXT,
+                     prompt TEXT,
+                     workflow JSON,
+                     image_filename TEXT,
+                     resolution TEXT,
+                     timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                     loras JSON,
+                     upscale_factor INTEGER)''')
+    conn.execute('''CREATE TABLE user_warnings
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     user_id TEXT,
+                     prompt TEXT,
+                     word TEXT,
+                     warned_at DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+    conn.execute(
+        "INSERT INTO image_history (user_id, prompt, workflow, image_filename, resolution, loras, upscale_factor) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        ('1', 'a red fox', json.dumps(WORKFLOW), 'fox.png', '1024x1024', '[]', 1)
+    )
+    conn.commit()
+    conn.close()
+
+
+def _indexes(path):
+    conn = sqlite3.connect(path)
+    try:
+        return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    finally:
+        conn.close()
+
+
+def test_migrate_upgrades_baseline_database(db):
+    _create_baseline(db)
+    database.init_db()
+
+    conn = sqlite3.connect(db)
+    assert schema_version(conn) == MIGRATIONS[-1][0]
+    # The old workflow column was moved into template and delta storage
+    assert conn.execute("SELECT workflow, workflow_hash FROM image_history").fetchone()[1] is not None
+    conn.close()
+
+    assert {
+        'idx_image_history_user_time', 'idx_image_history_filename', 'idx_user_warnings_user_time',
+        'idx_image_history_request', 'idx_image_history_time', 'idx_user_warnings_time',
+        'idx_image_history_workflow'
+    } <= _indexes(db)
+    assert database.get_workflow('fox.png') == WORKFLOW
+    assert json.loads(database.get_user_history('1')[0][3]) == WORKFLOW
+
+
+def test_migrate_is_a_no_op_when_current(db):
+    _create_baseline(db)
+    database.init_db()
+    database.close_db()
+    database.init_db()
+
+    conn = sqlite3.connect(db)
+    assert migrate(conn) == MIGRATIONS[-1][0]
+    assert conn.execute("SELECT COUNT(*) FROM image_history").fetchone()[0] == 1
+    conn.close()
+
+
+def test_new_history_round_trips_workflow(db):
+    database.init_db()
+    assert database.add_to_history('1', 'a red fox', WORKFLOW, 'fox.png', '1024x1024', ['lora'], 2)
+    assert database.get_workflow('fox.png') == WORKFLOW
+    assert database.get_image_info('fox.png') == {
+        'prompt': 'a red fox', 'resolution': '1024x1024', 'loras': ['lora'], 'upscale_factor': 2
+    }
+
+
+def test_duplicate_request_id_is_ignored(db):
+    database.init_db()
+    assert database.add_to_history('1', 'a red fox', WORKFLOW, 'fox.png', '1024x1024', [], 1, request_id='r1')
+    # A retried delivery of the same request
+    assert not database.add_to_history('1', 'a red fox', WORKFLOW, 'fox-2.png', '1024x1024', [], 1, request_id='r1')
+    assert len(database.get_all_image_info()) == 1
+
+    # Records without a request id never conflict
+    assert database.add_to_history('1', 'a red fox', WORKFLOW, 'fox-3.png', '1024x1024', [], 1)
+    assert database.add_to_history('1', 'a red fox', WORKFLOW, 'fox-4.png', '1024x1024', [], 1)
+    assert len(database.get_all_image_info()) == 3
+
+
+def test_history_batch_skips_duplicates(db):
+    database.init_db()
+    record = dict(user_id='1', prompt='a red fox', workflow=WORKFLOW, image_filename='fox.png',
+                  resolution='1024x1024', loras=[], upscale_factor=1, request_id='r1')
+    assert database.add_history_batch([record, dict(record, image_filename='fox-2.png')]) == 1
+    assert database.add_history_batch([record, dict(record, request_id='r2')]) == 1
+    assert len(database.get_all_image_info()) == 2
+
+
+def test_moderation_state_follows_committed_writes(db):
+    database.init_db()
+    state = database.load_moderation_state()
+    database.add_user_warning('1', 'prompt', 'word')
+    database.add_user_warning('1', 'prompt', 'word')
+    database.ban_user('2', 'reason')
+    assert state.warning_count('1') == 2
+    assert state.is_banned('2')
+
+    database.remove_user_warnings('1')
+    database.unban_user('2')
+    assert state.warning_count('1') == 0
+    assert not state.is_banned('2')
+
+
+def test_moderation_state_unchanged_by_rolled_back_write(db):
+    database.init_db()
+    state = database.load_moderation_state()
+
+    @transaction(database._database)
+    def warn_then_fail(conn):
+        database.add_user_warning('1', 'prompt', 'word')
+        raise ValueError('failed after the insert')
+
+    with pytest.raises(ValueError):
+        warn_then_fail()
+    assert state.warning_count('1') == 0
+    assert database.get_user_warnings('1') == 0
+
+
+def test_banned_word_matcher_follows_changes(db):
+    database.init_db()
+    database.load_banned_word_matcher()
+    database.add_banned_word('Gore')
+    assert moderation.banned_word_matcher().find('g0re') == 'gore'
+    database.remove_banned_word('gore')
+    assert moderation.banned_word_matcher().find('gore') is None
@@ -0,0 +1,127 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from Main import db as db_module
+from Main.db import Database, transaction
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = Database(str(tmp_path / 'test.db'))
+    database.run(lambda conn: conn.execute("CREATE TABLE items (name TEXT)"))
+    yield database
+    database.close()
+
+
+def count(conn):
+    return conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+
+
+def test_connection_uses_wal(database):
+    assert database.run(lambda conn: conn.execute("PRAGMA journal_mode").fetchone()[0]) == 'wal'
+
+
+def test_every_call_runs_on_one_thread(database):
+    threads = set()
+
+    def insert(conn, name):
+        threads.add(threading.get_ident())
+        conn.execute("INSERT INTO items VALUES (?)", (name,))
+
+    callers = [threading.Thread(target=database.run, args=(insert, str(i))) for i in range(8)]
+    for caller in callers:
+        caller.start()
+    for caller in callers:
+        caller.join()
+    assert len(threads) == 1
+    assert database.run(count) == 8
+
+
+def test_failed_transaction_rolls_back(database):
+    def insert_then_fail(conn):
+        conn.execute("INSERT INTO items VALUES ('a')")
+        raise ValueError('failed')
+
+    with pytest.raises(ValueError):
+        database.run(insert_then_fail)
+    assert database.run(count) == 0
+
+
+def test_nested_calls_share_the_transaction(database):
+    @transaction(lambda: database)
+    def insert(conn, name):
+        conn.execute("INSERT INTO items VALUES (?)", (name,))
+
+    @transaction(lambda: database)
+    def insert_two_then_fail(conn):
+        insert('a')
+        insert('b')
+        raise ValueError('failed')
+
+    with pytest.raises(ValueError):
+        insert_two_then_fail()
+    assert database.run(count) == 0
+
+    insert('c')
+    assert database.run(count) == 1
+
+
+def test_locked_transaction_is_retried_with_callbacks_dropped(database, monkeypatch):
+    monkeypatch.setattr(db_module, 'time', SimpleNamespace(sleep=lambda delay: None))
+    attempts = []
+    committed = []
+
+    def flaky(conn):
+        attempts.append(1)
+        conn.execute("INSERT INTO items VALUES ('a')")
+        database.after_commit(lambda: committed.append(len(attempts)))
+        if len(attempts) < 3:
+            raise sqlite3.OperationalError('database is locked')
+        return 'done'
+
+    assert database.run(flaky) == 'done'
+    assert len(attempts) == 3
+    assert committed == [3]
+    assert database.run(count) == 1
+
+
+def test_other_operational_errors_are_not_retried(database):
+    attempts = []
+
+    def broken(conn):
+        attempts.append(1)
+        conn.execute("SELECT * FROM missing")
+
+    with pytest.raises(sqlite3.OperationalError):
+        database.run(broken)
+    assert attempts == [1]
+
+
+def test_after_commit_outside_transaction_fails(database):
+    with pytest.raises(RuntimeError):
+        database.after_commit(lambda: None)
+
+
+async def test_aio_does_not_block_the_event_loop(database):
+    @transaction(lambda: database)
+    def slow(conn):
+        time.sleep(0.1)
+        return count(conn)
+
+    ticks = 0
+
+    async def tick():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.01)
+
+    ticker = asyncio.create_task(tick())
+    assert await slow.aio() == 0
+    ticker.cancel()
+    assert ticks >= 5
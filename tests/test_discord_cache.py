@@ -0,0 +1,116 @@
+from types import SimpleNamespace
+
+import pytest
+
+from Main.custom_commands import discord_cache
+from Main.custom_commands.discord_cache import DiscordCache, _TTLMap
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(discord_cache, 'time', SimpleNamespace(monotonic=clock))
+    return clock
+
+
+class FakeChannel:
+    def __init__(self, channel_id):
+        self.id = channel_id
+        self.handles = 0
+
+    def get_partial_message(self, message_id):
+        self.handles += 1
+        return SimpleNamespace(id=message_id, channel=self)
+
+
+class FakeBot:
+    """Has no channels in its gateway cache, so every miss is a REST fetch"""
+
+    def __init__(self):
+        self.fetches = []
+
+    def get_channel(self, channel_id):
+        return None
+
+    async def fetch_channel(self, channel_id):
+        self.fetches.append(channel_id)
+        return FakeChannel(channel_id)
+
+
+def test_ttl_map_expires_entries(clock):
+    entries = _TTLMap(ttl=10)
+    entries.set('a', 1)
+    clock.now += 9
+    assert entries.get('a') == 1
+    clock.now += 2
+    assert entries.get('a') is None
+
+
+def test_ttl_map_evicts_least_recently_used():
+    entries = _TTLMap(ttl=10, max_entries=2)
+    entries.set('a', 1)
+    entries.set('b', 2)
+    entries.get('a')
+    entries.set('c', 3)
+    assert entries.get('b') is None
+    assert entries.get('a') == 1
+
+
+async def test_channel_is_fetched_once_until_it_expires(clock):
+    bot = FakeBot()
+    cache = DiscordCache(bot, ttl=60)
+    first = await cache.channel(5)
+    assert await cache.channel(5) is first
+    assert bot.fetches == [5]
+
+    clock.now += 61
+    assert await cache.channel(5) is not first
+    assert bot.fetches == [5, 5]
+
+
+async def test_message_handles_are_cached_and_forgotten(clock):
+    bot = FakeBot()
+    cache = DiscordCache(bot, ttl=60)
+    message = await cache.message(5, 100)
+    assert await cache.message(5, 100) is message
+    assert message.channel.handles == 1
+
+    cache.forget_message(100)
+    assert await cache.message(5, 100) is not message
+    assert message.channel.handles == 2
+    # The channel itself stays cached
+    assert bot.fetches == [5]
+
+
+async def test_deleted_channel_drops_its_messages(clock):
+    bot = FakeBot()
+    cache = DiscordCache(bot, ttl=60)
+    message = await cache.message(5, 100)
+    other = await cache.message(6, 200)
+
+    await cache._on_channel_delete(SimpleNamespace(id=5))
+    assert await cache.message(6, 200) is other
+    assert await cache.message(5, 100) is not message
+    assert bot.fetches == [5, 6, 5]
+
+
+async def test_raw_message_delete_forgets_message(clock):
+    cache = DiscordCache(FakeBot(), ttl=60)
+    message = await cache.message(5, 100)
+    await cache._on_raw_message_delete(SimpleNamespace(message_id=100))
+    assert await cache.message(5, 100) is not message
+
+
+async def test_member_style_without_guild():
+    cache = DiscordCache(FakeBot())
+    color, name = await cache.member_style(None, 1)
+    assert name is None
+    assert color == discord_cache.discord.Color.blurple()
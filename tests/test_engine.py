@@ -0,0 +1,101 @@
+import asyncio
+
+from Main import database
+from Main.comfy_engine import ComfyEngine, GenerationJob
+from Main.comfy_engine.engine import websocket_output_name
+from Main.comfy_engine.router import OUTPUT_IMAGE
+
+PROMPT_ID = 'abcdef12-0000-0000-0000-000000000000'
+
+
+def make_job(workflow):
+    return GenerationJob(
+        request_id='r1', user_id='1', channel_id='2', interaction_id='3', original_message_id='4',
+        request_type='standard', workflow=workflow, prompt='a red fox', resolution='1024x1024'
+    )
+
+
+class RecordingReporter:
+    """Collects what the engine reports and writes history like the comfygen fallback"""
+
+    def __init__(self):
+        self.results = []
+
+    async def progress(self, job, progress_data):
+        pass
+
+    async def deliver(self, job, result):
+        self.results.append(result)
+
+    async def record_history(self, job, result):
+        await database.add_to_history.aio(**result.history_record())
+
+    async def finished(self, job):
+        pass
+
+
+def test_websocket_output_name_uses_save_node_prefix():
+    workflow = {
+        '9': {'class_type': 'SaveImage', 'inputs': {'filename_prefix': 'flux/Flux_gen'}},
+        '10': {'class_type': 'SaveImage', 'inputs': {'filename_prefix': 'ComfyUI'}},
+        '11': {'class_type': 'SaveImage', 'inputs': {'filename_prefix': ['12', 0]}},
+    }
+    assert websocket_output_name(workflow, '9', PROMPT_ID, 0, 'png') == 'Flux_gen_abcdef12_9_00000.png'
+    assert websocket_output_name(workflow, '10', PROMPT_ID, 1, 'jpeg') == 'FluxBot_abcdef12_10_00001.jpg'
+    assert websocket_output_name(workflow, '11', PROMPT_ID, 0, 'png') == 'FluxBot_abcdef12_11_00000.png'
+
+
+async def test_websocket_result_is_recorded_in_history(db):
+    database.init_db()
+    workflow = {
+        '1': {'class_type': 'CLIPTextEncode', 'inputs': {'text': 'a red fox'}},
+        '9': {'class_type': 'SaveImage', 'inputs': {'images': ['8', 0], 'filename_prefix': 'ComfyUI'}},
+    }
+    reporter = RecordingReporter()
+    engine = ComfyEngine(['localhost:8188'], reporter, websocket_outputs=True)
+
+    async def run_on_pool(job):
+        events = asyncio.Queue()
+        events.put_nowait({'type': OUTPUT_IMAGE, 'data': {'prompt_id': PROMPT_ID, 'node': '9',
+                                                          'format': 'png', 'image': b'png bytes'}})
+        events.put_nowait({'type': 'executing', 'data': {'prompt_id': PROMPT_ID, 'node': None}})
+        return await engine._follow_prompt(job, engine.pool.backends[0], PROMPT_ID, events)
+
+    engine._run_on_pool = run_on_pool
+    result = await engine.run_job(make_job(workflow))
+
+    assert result.data == b'png bytes'
+    assert reporter.results == [result]
+    history = database.get_all_image_info()
+    assert len(history) == 1
+    assert history[0][4] == result.filename
+    await engine.pool.stop()
+
+
+async def test_identical_jobs_share_one_generation_without_cache():
+    reporter = RecordingReporter()
+    engine = ComfyEngine(['localhost:8188'], reporter)
+    assert engine.cache is None
+    started = []
+    release = asyncio.Event()
+
+    async def run_on_pool(job):
+        started.append(job.request_id)
+        await release.wait()
+        return {'9': [(b'png bytes', 'Flux_gen_00001_.png')]}
+
+    engine._run_on_pool = run_on_pool
+    workflow = {'1': {'class_type': 'CLIPTextEncode', 'inputs': {'text': 'a red fox'}}}
+    first = asyncio.create_task(engine._generate(make_job(workflow), []))
+    second = asyncio.create_task(engine._generate(make_job(dict(workflow)), []))
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await first == await second == (b'png bytes', 'Flux_gen_00001_.png')
+    assert started == ['r1']
+    assert engine._inflight == {}
+
+    # Once the first generation finished, an identical job runs again
+    await engine._generate(make_job(workflow), [])
+    assert started == ['r1', 'r1']
+    await engine.pool.stop()
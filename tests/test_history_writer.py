@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+from Main import history_writer
+from Main.history_writer import HistoryWriter, history_record
+
+
+class FakeBatchWriter:
+    """Stands in for add_history_batch and records each batch it is given"""
+
+    def __init__(self):
+        self.batches = []
+
+    async def aio(self, records):
+        self.batches.append(list(records))
+        return len(records)
+
+
+@pytest.fixture
+def batches(monkeypatch):
+    fake = FakeBatchWriter()
+    monkeypatch.setattr(history_writer, 'add_history_batch', fake)
+    return fake.batches
+
+
+def record(i):
+    return {'request_id': str(i)}
+
+
+async def test_close_flushes_queued_records(batches):
+    writer = HistoryWriter(batch_size=50, flush_interval=60)
+    for i in range(3):
+        writer.submit(record(i))
+    await asyncio.sleep(0)
+    assert batches == []
+
+    await asyncio.wait_for(writer.close(), 1)
+    assert batches == [[record(0), record(1), record(2)]]
+
+
+async def test_full_batch_is_written_without_waiting(batches):
+    writer = HistoryWriter(batch_size=2, flush_interval=60)
+    for i in range(5):
+        writer.submit(record(i))
+    await asyncio.sleep(0.05)
+    assert batches == [[record(0), record(1)], [record(2), record(3)]]
+
+    await asyncio.wait_for(writer.close(), 1)
+    assert batches[-1] == [record(4)]
+
+
+async def test_partial_batch_is_written_after_flush_interval(batches):
+    writer = HistoryWriter(batch_size=50, flush_interval=0.01)
+    writer.submit(record(0))
+    writer.submit(record(1))
+    await asyncio.sleep(0.1)
+    assert batches == [[record(0), record(1)]]
+    await writer.close()
+
+
+async def test_submit_after_close_is_refused(batches):
+    writer = HistoryWriter()
+    await writer.close()
+    with pytest.raises(RuntimeError):
+        writer.submit(record(0))
+
+
+def test_history_record_validates_fields():
+    data = {
+        'user_id': '1', 'prompt': 'a red fox', 'workflow': {}, 'image_filename': 'fox.png',
+        'resolution': '1024x1024', 'loras': [], 'upscale_factor': 1, 'request_id': 'r1', 'extra': True
+    }
+    assert history_record(data) == {key: value for key, value in data.items() if key != 'extra'}
+    with pytest.raises(ValueError):
+        history_record({key: value for key, value in data.items() if key != 'prompt'})
+    with pytest.raises(ValueError):
+        history_record(dict(data, workflow='{}'))
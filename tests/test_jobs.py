@@ -0,0 +1,78 @@
+import json
+import os
+
+import pytest
+
+from Main.comfy_engine import jobs
+from Main.comfy_engine.engine import cleanup_job_files
+from Main.comfy_engine.jobs import build_standard_job, build_video_job, job_from_request_item
+from Main.comfy_engine.templates import TemplateCache, plan_for
+from Main.custom_commands.models import RequestItem
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FLUX_TEMPLATE = 'FluxDev24GB.json'
+
+
+@pytest.fixture
+def templates(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    return TemplateCache()
+
+
+@pytest.fixture
+def no_file_access(monkeypatch):
+    """Fail the test if a job builder reads a workflow file"""
+    def open_workflow(filename):
+        raise AssertionError(f"workflow file {filename} was read")
+    monkeypatch.setattr(jobs, 'open_workflow', open_workflow)
+
+
+def bound(workflow, parameter):
+    binding = plan_for(workflow).bindings[parameter]
+    return workflow[binding.node]['inputs'][binding.input]
+
+
+def test_in_memory_workflow_is_used_as_is(templates, no_file_access):
+    prepared = templates.instance(FLUX_TEMPLATE)
+    plan_for(prepared).apply(prepared, prompt='a red fox', resolution='1024x1024')
+    snapshot = json.loads(json.dumps(prepared))
+
+    job = build_standard_job('r1', '1', '2', '3', '4', 'a red fox', '1024x1024', [], 1,
+                             'flux_abc.json', seed=42, workflow=prepared)
+
+    assert not job.workflow_on_disk
+    assert job.seed == 42
+    assert bound(job.workflow, 'seed') == 42
+    assert bound(job.workflow, 'prompt') == 'a red fox'
+    # Setting the seed does not reach back into the queued request's workflow
+    assert json.loads(json.dumps(prepared)) == snapshot
+
+
+def test_request_item_carries_workflow_to_job(templates, no_file_access):
+    prepared = templates.instance(FLUX_TEMPLATE)
+    item = RequestItem(id='r1', user_id='1', channel_id='2', interaction_id='3', original_message_id='4',
+                       resolution='1024x1024', workflow_filename='flux_abc.json', prompt='a red fox',
+                       loras=[], upscale_factor=1, seed=7, workflow=prepared)
+    job = job_from_request_item('r1', item)
+    assert job.workflow_filename == 'flux_abc.json'
+    assert bound(job.workflow, 'seed') == 7
+
+
+def test_video_job_patches_in_memory_workflow(templates, no_file_access):
+    job = build_video_job('r1', '1', '2', '3', '4', 'a fox running', 'video_abc.json',
+                          workflow=templates.instance('Video.json'))
+    assert bound(job.workflow, 'prompt') == 'a fox running'
+    assert bound(job.workflow, 'seed') == job.seed
+
+
+def test_cleanup_leaves_datasets_alone_for_in_memory_jobs(templates, tmp_path, monkeypatch):
+    # A dataset file that happens to share the request's label must survive
+    dataset_dir = tmp_path / 'Main' / 'Datasets'
+    dataset_dir.mkdir(parents=True)
+    (dataset_dir / 'flux_abc.json').write_text('{}')
+    job = build_standard_job('r1', '1', '2', '3', '4', 'a red fox', '1024x1024', [], 1,
+                             'flux_abc.json', workflow=templates.instance(FLUX_TEMPLATE))
+
+    monkeypatch.chdir(tmp_path)
+    cleanup_job_files(job)
+    assert (dataset_dir / 'flux_abc.json').exists()
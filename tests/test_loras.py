@@ -0,0 +1,64 @@
+import pytest
+
+from Main.comfy_engine import loras
+from Main.comfy_engine.loras import LoraRegistry
+
+ENTRIES = [
+    {'name': 'Pixel Art', 'file': 'pixel.safetensors', 'weight': 0.8, 'add_prompt': 'pixel art'},
+    {'name': 'Pixel Art XL', 'file': 'pixel_xl.safetensors', 'weight': 'bad', 'add_prompt': 'pixel art style'},
+    {'name': 'Plain', 'file': 'plain.safetensors', 'add_prompt': ''},
+    {'name': 'No file'},
+]
+
+
+@pytest.fixture
+def shared_registry():
+    previous = loras.current()
+    yield
+    loras.install(previous)
+
+
+def test_index_by_file_and_name():
+    registry = LoraRegistry(ENTRIES)
+    assert len(registry) == 3
+    assert 'pixel.safetensors' in registry
+    assert registry.by_name['Plain']['file'] == 'plain.safetensors'
+    assert registry.weight('pixel.safetensors') == 0.8
+    assert registry.weight('pixel_xl.safetensors') == 1.0
+    assert registry.weight('missing.safetensors', 0.5) == 0.5
+    with pytest.raises(TypeError):
+        registry.by_file['plain.safetensors']['weight'] = 2
+
+
+def test_triggers_for_keeps_order_and_skips_loras_without_one():
+    registry = LoraRegistry(ENTRIES)
+    assert registry.triggers_for(['plain.safetensors', 'pixel_xl.safetensors', 'pixel.safetensors']) == [
+        'pixel art style', 'pixel art'
+    ]
+
+
+def test_strip_triggers():
+    registry = LoraRegistry(ENTRIES)
+    assert registry.strip_triggers('a castle, pixel art style, at night') == 'a castle, at night'
+    assert registry.strip_triggers('Pixel Art, a castle') == 'a castle'
+    assert registry.strip_triggers('a castle, pixel art') == 'a castle'
+    assert LoraRegistry().strip_triggers('a castle, , at night') == 'a castle, at night'
+
+
+def test_reload_swaps_registry_without_touching_the_old_one(shared_registry):
+    old = loras.install(LoraRegistry(ENTRIES))
+    held = loras.current()
+
+    loras.install(LoraRegistry([{'name': 'New', 'file': 'new.safetensors'}]))
+    assert 'new.safetensors' in loras.current()
+    assert 'pixel.safetensors' not in loras.current()
+    # A request that took the old registry keeps a consistent view
+    assert held is old
+    assert 'pixel.safetensors' in held
+
+
+def test_load_registry_reads_lora_json(shared_registry, monkeypatch):
+    monkeypatch.setattr(loras, 'load_json', lambda name: {'available_loras': ENTRIES})
+    registry = loras.load_registry()
+    assert loras.current() is registry
+    assert len(registry) == 3
@@ -0,0 +1,155 @@
+import gzip
+import json
+import logging
+import sqlite3
+
+import pytest
+
+from Main import database, maintenance
+from Main.maintenance import HistoryMaintenance
+
+WORKFLOW = {'6': {'class_type': 'CLIPTextEncode', 'inputs': {'text': 'a red fox'}}}
+
+
+@pytest.fixture(autouse=True)
+def no_pause(monkeypatch):
+    monkeypatch.setattr(maintenance, 'BATCH_PAUSE', 0)
+
+
+def add_history(count, age_days, prefix):
+    for i in range(count):
+        workflow = {'6': {'class_type': 'CLIPTextEncode', 'inputs': {'text': f'{prefix} {i}'}},
+                    '7': {'class_type': 'Note', 'inputs': {'notes': f'{prefix}-template ' + 'x' * 2000}}}
+        database.add_to_history('1', f'{prefix} {i} ' + 'y' * 2000, workflow, f'{prefix}_{i}.png', '1024x1024', [], 1)
+    database.close_db()
+    conn = sqlite3.connect(database.DB_NAME)
+    conn.execute("UPDATE image_history SET timestamp = datetime('now', ?) WHERE image_filename LIKE ?",
+                 (f'-{age_days} days', f'{prefix}_%'))
+    conn.commit()
+    conn.close()
+
+
+def rows(table='image_history'):
+    conn = sqlite3.connect(database.DB_NAME)
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    finally:
+        conn.close()
+
+
+class Recorder:
+    """Wraps a transaction function and logs each awaited call"""
+
+    def __init__(self, log, name, fn):
+        self.log, self.name, self.fn = log, name, fn
+
+    async def aio(self, *args):
+        self.log.append((self.name, rows()))
+        return await self.fn.aio(*args)
+
+
+async def test_expired_rows_are_archived_then_deleted_then_vacuumed(db, tmp_path, monkeypatch):
+    database.init_db()
+    add_history(40, age_days=40, prefix='old')
+    add_history(5, age_days=1, prefix='new')
+
+    log = []
+    append_archive = maintenance.append_archive
+
+    def archive(path, archived):
+        log.append(('archive', rows()))
+        append_archive(path, archived)
+
+    monkeypatch.setattr(maintenance, 'append_archive', archive)
+    monkeypatch.setattr(maintenance, 'delete_expired_rows', Recorder(log, 'delete', database.delete_expired_rows))
+    monkeypatch.setattr(maintenance, 'incremental_vacuum', Recorder(log, 'vacuum', database.incremental_vacuum))
+
+    assert rows('workflow_templates') == 2
+    archive_dir = tmp_path / 'archive'
+    job = HistoryMaintenance({'image_history': 30, 'user_warnings': 0}, str(archive_dir), batch_size=15)
+    assert await job.run_once() == {'image_history': 40}
+
+    steps = [step for step, _ in log]
+    assert steps[:6] == ['archive', 'delete'] * 3
+    # Vacuum steps run until one frees nothing, so more than one means pages were returned
+    assert steps[6:] == ['vacuum'] * len(steps[6:]) and len(steps[6:]) >= 2
+    # Each batch is archived while its rows still exist
+    assert [count for step, count in log if step == 'archive'] == [45, 30, 15]
+    assert rows() == 5
+    # Only the template of the expired rows was dropped
+    assert rows('workflow_templates') == 1
+
+    archives = list(archive_dir.iterdir())
+    assert len(archives) == 1
+    with gzip.open(archives[0], 'rt', encoding='utf-8') as f:
+        archived = [json.loads(line) for line in f]
+    assert len(archived) == 40
+    assert archived[0]['workflow']['6']['inputs']['text'] == 'old 0'
+
+    conn = sqlite3.connect(database.DB_NAME)
+    assert conn.execute("PRAGMA freelist_count").fetchone()[0] == 0
+    conn.close()
+
+
+async def test_expired_warnings_update_moderation_state(db):
+    database.init_db()
+    state = database.load_moderation_state()
+    database.add_user_warning('1', 'prompt', 'word')
+    database.add_user_warning('1', 'prompt', 'word')
+    conn = sqlite3.connect(database.DB_NAME)
+    conn.execute("UPDATE user_warnings SET warned_at = datetime('now', '-10 days') WHERE id = 1")
+    conn.commit()
+    conn.close()
+
+    await HistoryMaintenance({'user_warnings': 7}).run_once()
+    assert state.warning_count('1') == 1
+    assert database.get_user_warnings('1') == 1
+
+
+def legacy_database(path):
+    """A database created before incremental vacuum was turned on"""
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE image_history (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT, prompt TEXT, "
+                 "workflow JSON, image_filename TEXT, resolution TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, "
+                 "loras JSON, upscale_factor INTEGER)")
+    conn.commit()
+    conn.close()
+
+
+def auto_vacuum():
+    conn = sqlite3.connect(database.DB_NAME)
+    try:
+        return conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    finally:
+        conn.close()
+
+
+async def test_without_conversion_vacuum_is_skipped(db, monkeypatch, caplog):
+    legacy_database(database.DB_NAME)
+    database.init_db()
+    add_history(3, age_days=40, prefix='old')
+
+    def no_vacuum(*args):
+        raise AssertionError('vacuum must not run')
+
+    monkeypatch.setattr(maintenance, 'incremental_vacuum', no_vacuum)
+    job = HistoryMaintenance({'image_history': 30}, convert_auto_vacuum=False)
+    with caplog.at_level(logging.WARNING, logger=maintenance.__name__):
+        assert await job.run_once() == {'image_history': 3}
+    assert 'CONVERT_AUTO_VACUUM=true' in caplog.text
+    assert auto_vacuum() == 0
+    assert rows() == 0
+
+    # The check is made once per process, not on every run
+    caplog.clear()
+    await job.run_once()
+    assert 'CONVERT_AUTO_VACUUM' not in caplog.text
+
+
+async def test_conversion_enables_incremental_vacuum(db):
+    legacy_database(database.DB_NAME)
+    database.init_db()
+    assert auto_vacuum() == 0
+
+    await HistoryMaintenance({'image_history': 30}, convert_auto_vacuum=True).run_once()
+    assert auto_vacuum() == 2
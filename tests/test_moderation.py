@@ -0,0 +1,86 @@
+from Main.moderation import BannedWordMatcher, deleet, normalize_text
+
+
+def test_normalize_text():
+    assert normalize_text('C.h.i.l.d  Care') == 'child care'
+    assert deleet('ch1ld n@k3d') == 'child naked'
+
+
+def test_plain_word_matches():
+    matcher = BannedWordMatcher(['child', 'naked'])
+    assert matcher.find('a Child playing') == 'child'
+    assert matcher.find('a dog playing') is None
+
+
+def test_obfuscated_variants_match():
+    matcher = BannedWordMatcher(['child'])
+    assert matcher.find('a ch1ld playing') == 'child'
+    assert matcher.find('a c.h.i.l.d playing') == 'child'
+    assert matcher.find('a Ch!ld playing') == 'child'
+
+
+def test_words_inside_longer_words_do_not_match():
+    matcher = BannedWordMatcher(['ass', 'child'])
+    assert matcher.find('a classic brass instrument') is None
+    assert matcher.find('childhood memories') is None
+    assert matcher.find('an ass') == 'ass'
+
+
+def test_prefix_words_both_match():
+    matcher = BannedWordMatcher(['nude', 'nudes'])
+    assert matcher.find_all('nudes') == ['nudes']
+    assert matcher.find_all('nude and nudes') == ['nude', 'nudes']
+
+
+def test_find_all_in_order_of_appearance():
+    matcher = BannedWordMatcher(['gore', 'blood', 'child'])
+    assert matcher.find_all('blood and g0re, more blood') == ['blood', 'gore']
+    assert matcher.find_all('nothing here') == []
+
+
+def test_with_and_without_word_return_new_matchers():
+    matcher = BannedWordMatcher(['gore'])
+    extended = matcher.with_word('Blood')
+    assert extended.find('blood') == 'blood'
+    assert matcher.find('blood') is None
+
+    reduced = extended.without_word('gore')
+    assert reduced.find('gore') is None
+    assert reduced.find('blood') == 'blood'
+
+
+def test_empty_matcher():
+    matcher = BannedWordMatcher()
+    assert matcher.find('anything') is None
+    assert matcher.find_all('anything') == []
+
+
+def test_edits_match_a_rebuilt_matcher():
+    words = ['gore', 'go', 'blood', 'b100d', 'nude', 'nudes']
+    matcher = BannedWordMatcher()
+    for word in words:
+        matcher = matcher.with_word(word)
+    assert matcher._pattern.pattern == BannedWordMatcher(words)._pattern.pattern
+
+    for word in ['go', 'nudes']:
+        matcher = matcher.without_word(word)
+    rebuilt = BannedWordMatcher(['gore', 'blood', 'b100d', 'nude'])
+    assert matcher._pattern.pattern == rebuilt._pattern.pattern
+    assert matcher.words == rebuilt.words
+
+
+def test_removing_a_word_keeps_forms_shared_with_another():
+    # 'g0re' and 'gore' are both matched as 'gore' once leetspeak is undone
+    matcher = BannedWordMatcher(['gore', 'g0re'])
+    assert matcher.find('g0r3') == 'g0re'
+    reduced = matcher.without_word('g0re')
+    assert reduced.find('g0r3') == 'gore'
+    assert reduced.without_word('gore').find('g0r3') is None
+
+
+def test_edit_shares_unchanged_subtrees():
+    matcher = BannedWordMatcher(['apple', 'zebra'])
+    extended = matcher.with_word('zealot')
+    assert extended._trie.children['a'] is matcher._trie.children['a']
+    assert matcher.with_word('apple') is matcher
+    assert matcher.without_word('pear') is matcher
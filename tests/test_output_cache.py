@@ -0,0 +1,67 @@
+import os
+
+from Main.comfy_engine.output_cache import OutputCache, workflow_key
+
+
+def key(i):
+    return f"{i:064d}"
+
+
+def test_workflow_key_ignores_key_order():
+    assert workflow_key({'a': 1, 'b': {'c': 2}}) == workflow_key({'b': {'c': 2}, 'a': 1})
+    assert workflow_key({'a': 1}) != workflow_key({'a': 2})
+
+
+def test_put_and_get(tmp_path):
+    cache = OutputCache(str(tmp_path), 100)
+    cache.put(key(1), b'image', 'out.png')
+    assert cache.get(key(1)) == (b'image', 'out.png')
+    assert cache.get(key(2)) is None
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path):
+    cache = OutputCache(str(tmp_path), 30)
+    for i in range(3):
+        cache.put(key(i), b'x' * 10, 'out.png')
+    # Reading an entry makes it the most recent
+    assert cache.get(key(0)) is not None
+
+    cache.put(key(3), b'x' * 10, 'out.png')
+    assert cache.get(key(1)) is None
+    assert cache.get(key(0)) is not None
+    assert cache.get(key(2)) is not None
+    assert len(os.listdir(tmp_path)) == 3
+
+
+def test_oversized_entry_is_not_stored(tmp_path):
+    cache = OutputCache(str(tmp_path), 5)
+    cache.put(key(1), b'x' * 10, 'out.png')
+    assert cache.get(key(1)) is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_checked_out_entry_survives_eviction_until_released(tmp_path):
+    cache = OutputCache(str(tmp_path), 20)
+    cache.put(key(0), b'x' * 10, 'out.png')
+    path, filename = cache.checkout(key(0))
+    assert filename == 'out.png'
+
+    cache.put(key(1), b'x' * 10, 'out.png')
+    cache.put(key(2), b'x' * 10, 'out.png')
+    assert os.path.isfile(path)
+    assert cache.get(key(1)) is None
+
+    cache.release(key(0))
+    cache.put(key(3), b'x' * 10, 'out.png')
+    assert not os.path.exists(path)
+    assert cache.get(key(2)) is not None
+
+
+def test_index_is_rebuilt_from_directory(tmp_path):
+    cache = OutputCache(str(tmp_path), 100)
+    cache.put(key(1), b'image', 'out.png')
+    (tmp_path / 'unrelated.png').write_bytes(b'other')
+
+    reloaded = OutputCache(str(tmp_path), 100)
+    assert reloaded.get(key(1)) == (b'image', 'out.png')
+    assert (tmp_path / 'unrelated.png').exists()
@@ -0,0 +1,94 @@
+import asyncio
+from types import SimpleNamespace
+
+from Main.comfy_engine import ComfyEngine, GenerationJob
+from Main.comfy_engine.outputs import DELIVERY_REFERENCE, OutputRef
+
+
+class FakeRouter:
+    client_id = 'client'
+
+    def subscribe(self, prompt_id, image_nodes=()):
+        events = asyncio.Queue()
+        events.put_nowait({'type': 'executing', 'data': {'prompt_id': prompt_id, 'node': None}})
+        return events
+
+    def unsubscribe(self, prompt_id):
+        pass
+
+
+class FakeClient:
+    """Serves a history with several outputs and tracks concurrent downloads"""
+
+    def __init__(self, outputs):
+        self.outputs = outputs
+        self.active = 0
+        self.peak = 0
+        self.fetched = []
+
+    async def queue_prompt(self, workflow, client_id, prompt_id):
+        return {'prompt_id': prompt_id}
+
+    async def get_history(self, prompt_id):
+        return {prompt_id: {'outputs': self.outputs}}
+
+    async def get_output(self, filename, subfolder, folder_type):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        await asyncio.sleep(0.01)
+        self.active -= 1
+        self.fetched.append(filename)
+        return filename.encode()
+
+
+class QuietReporter:
+    async def progress(self, job, progress_data):
+        pass
+
+
+def make_job():
+    return GenerationJob(
+        request_id='r1', user_id='1', channel_id='2', interaction_id='3', original_message_id='4',
+        request_type='standard', workflow={}, prompt='a red fox', resolution='1024x1024'
+    )
+
+
+OUTPUTS = {
+    '8': {'images': [{'filename': 'ComfyUI_temp_00001_.png', 'subfolder': '', 'type': 'temp'}]},
+    '9': {'images': [{'filename': f'Flux_gen_{i:05}_.png', 'subfolder': '', 'type': 'output'} for i in range(6)]},
+    '10': {'gifs': [{'filename': 'AnimateDiff_00001.webp', 'subfolder': '', 'type': 'output'},
+                    {'filename': 'AnimateDiff_00001.mp4', 'subfolder': 'video', 'type': 'output'}]},
+}
+
+
+async def test_outputs_are_fetched_concurrently_up_to_the_cap():
+    client = FakeClient(OUTPUTS)
+    engine = ComfyEngine(['localhost:8188'], QuietReporter(), fetch_concurrency=3)
+    backend = SimpleNamespace(name='localhost:8188', client=client, router=FakeRouter())
+
+    outputs = await engine.get_outputs(make_job(), backend)
+
+    assert client.peak == 3
+    # Temporary previews and non-mp4 video frames are never downloaded
+    assert 'ComfyUI_temp_00001_.png' not in client.fetched
+    assert 'AnimateDiff_00001.webp' not in client.fetched
+    # Results keep the history's order whatever order the downloads finished in
+    assert [name for _, name in outputs['9']] == [f'Flux_gen_{i:05}_.png' for i in range(6)]
+    assert outputs['9'][0] == (b'Flux_gen_00000_.png', 'Flux_gen_00000_.png')
+    assert outputs['10'] == [(b'AnimateDiff_00001.mp4', 'AnimateDiff_00001.mp4')]
+    await engine.pool.stop()
+
+
+async def test_reference_delivery_downloads_nothing():
+    client = FakeClient(OUTPUTS)
+    engine = ComfyEngine(['localhost:8188'], QuietReporter(), delivery=DELIVERY_REFERENCE)
+    backend = SimpleNamespace(name='localhost:8188', client=client, router=FakeRouter())
+
+    outputs = await engine.get_outputs(make_job(), backend)
+
+    assert client.fetched == []
+    assert outputs['10'] == [(
+        OutputRef(filename='AnimateDiff_00001.mp4', subfolder='video', type='output', server='localhost:8188'),
+        'AnimateDiff_00001.mp4'
+    )]
+    await engine.pool.stop()
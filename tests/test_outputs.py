@@ -0,0 +1,81 @@
+import os
+
+import pytest
+
+from Main.comfy_engine.outputs import OutputRef, open_output, shared_output_path
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    output_dir = tmp_path / 'output'
+    cache_dir = tmp_path / 'cache'
+    (output_dir / 'videos').mkdir(parents=True)
+    cache_dir.mkdir()
+    (output_dir / 'videos' / 'clip.mp4').write_bytes(b'video')
+    (cache_dir / 'cached.png').write_bytes(b'image')
+    (tmp_path / '.env').write_text('DISCORD_TOKEN=secret')
+    return output_dir, cache_dir
+
+
+def test_ref_inside_output_dir(dirs):
+    output_dir, _ = dirs
+    ref = OutputRef(filename='clip.mp4', subfolder='videos')
+    assert shared_output_path(ref, str(output_dir)) == str(output_dir / 'videos' / 'clip.mp4')
+    assert shared_output_path(OutputRef(filename='missing.mp4'), str(output_dir)) is None
+    assert shared_output_path(ref, None) is None
+
+
+def test_subfolder_and_filename_traversal_rejected(dirs):
+    output_dir, _ = dirs
+    assert shared_output_path(OutputRef(filename='.env', subfolder='..'), str(output_dir)) is None
+    assert shared_output_path(OutputRef(filename='../.env'), str(output_dir)) is None
+    assert shared_output_path(OutputRef(filename=str(output_dir.parent / '.env')), str(output_dir)) is None
+
+
+def test_path_must_be_inside_output_or_cache_dir(dirs):
+    output_dir, cache_dir = dirs
+    cached = str(cache_dir / 'cached.png')
+    assert shared_output_path(OutputRef(filename='cached.png', path=cached), str(output_dir), str(cache_dir)) == cached
+    # The cache only counts when it is one of the allowed directories
+    assert shared_output_path(OutputRef(filename='cached.png', path=cached), str(output_dir)) is None
+
+    secret = str(output_dir.parent / '.env')
+    assert shared_output_path(OutputRef(filename='.env', path=secret), str(output_dir), str(cache_dir)) is None
+    escaped = os.path.join(str(cache_dir), '..', '.env')
+    assert shared_output_path(OutputRef(filename='.env', path=escaped), str(output_dir), str(cache_dir)) is None
+    assert shared_output_path(OutputRef(filename='.env', path=secret), None, None) is None
+
+
+def test_symlink_out_of_output_dir_rejected(dirs):
+    output_dir, _ = dirs
+    os.symlink(output_dir.parent / '.env', output_dir / 'link.png')
+    assert shared_output_path(OutputRef(filename='link.png'), str(output_dir)) is None
+    assert shared_output_path(OutputRef(filename='link.png', path=str(output_dir / 'link.png')), str(output_dir)) is None
+
+
+async def test_open_output_uses_local_file(dirs):
+    output_dir, _ = dirs
+    async with open_output(OutputRef(filename='clip.mp4', subfolder='videos'), lambda name: None, str(output_dir)) as path:
+        with open(path, 'rb') as f:
+            assert f.read() == b'video'
+
+
+async def test_open_output_rejects_unknown_server(dirs):
+    output_dir, _ = dirs
+    ref = OutputRef(filename='clip.png', server='169.254.169.254:80')
+    with pytest.raises(ValueError):
+        async with open_output(ref, lambda name: None, str(output_dir)):
+            pass
+
+
+async def test_open_output_streams_from_pool_backend(dirs):
+    class FakeClient:
+        async def save_output(self, filename, subfolder, folder_type, path):
+            with open(path, 'wb') as f:
+                f.write(b'remote')
+
+    clients = {'gpu1:8188': FakeClient()}
+    async with open_output(OutputRef(filename='out.png', server='gpu1:8188'), clients.get) as path:
+        with open(path, 'rb') as f:
+            assert f.read() == b'remote'
+    assert not os.path.exists(path)
@@ -0,0 +1,51 @@
+import pytest
+
+from Main.comfy_engine.pool import BackendPool, BackendUnavailable, parse_backend_address
+
+
+def test_parse_backend_address():
+    assert parse_backend_address('gpu1') == ('gpu1', 8188)
+    assert parse_backend_address('gpu1:8190') == ('gpu1', 8190)
+    assert parse_backend_address('http://gpu1:8190/') == ('gpu1', 8190)
+
+
+def test_acquire_prefers_least_pending_work():
+    pool = BackendPool(['a', 'b'])
+    a, b = pool.backends
+    a.queue_depth = 3
+    assert pool.acquire() is b
+    assert pool.acquire() is b
+    assert pool.acquire() is b
+    # Dispatches since the last poll count as pending work; ties go to the first backend
+    assert pool.acquire() is a
+
+
+def test_acquire_prefers_loaded_family_between_equals():
+    pool = BackendPool(['a', 'b'])
+    pool.backends[1].loaded_family = 'video'
+    assert pool.acquire(family='video') is pool.backends[1]
+
+
+def test_acquire_skips_unhealthy_and_excluded():
+    pool = BackendPool(['a', 'b'])
+    a, b = pool.backends
+    pool.mark_failed(a)
+    assert pool.acquire() is b
+    # An unhealthy backend is still tried when nothing else is left
+    assert pool.acquire(exclude={b.name}) is a
+    with pytest.raises(BackendUnavailable):
+        pool.acquire(exclude={a.name, b.name})
+
+
+def test_release_tracks_active_jobs():
+    pool = BackendPool(['a'])
+    backend = pool.acquire()
+    assert backend.active_jobs == 1
+    pool.release(backend)
+    pool.release(backend)
+    assert backend.active_jobs == 0
+
+
+def test_pool_needs_a_backend():
+    with pytest.raises(ValueError):
+        BackendPool([])
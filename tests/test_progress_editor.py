@@ -0,0 +1,95 @@
+import asyncio
+from types import SimpleNamespace
+
+from Main.custom_commands.progress_editor import ProgressEditor
+
+
+class FakeMessage:
+    def __init__(self, log, message_id, gate=None):
+        self.log = log
+        self.id = message_id
+        self.gate = gate
+
+    async def edit(self, content):
+        if self.gate is not None:
+            await self.gate.wait()
+        self.log.append((self.id, content))
+
+
+class FakeCache:
+    def __init__(self):
+        self.edits = []
+        self.gates = {}
+
+    async def message(self, channel_id, message_id):
+        return FakeMessage(self.edits, message_id, self.gates.get(message_id))
+
+    def forget_message(self, message_id):
+        pass
+
+
+def make_editor(interval=0.05):
+    cache = FakeCache()
+    return ProgressEditor(SimpleNamespace(discord_cache=cache), interval=interval), cache
+
+
+async def wait_idle(editor):
+    await asyncio.gather(*(state.task for state in editor._channels.values() if state.task))
+
+
+async def test_updates_to_one_message_are_coalesced():
+    editor, cache = make_editor()
+    for progress in range(10, 101, 10):
+        editor.submit(1, 100, f"{progress}%")
+    await wait_idle(editor)
+    assert cache.edits == [(100, '100%')]
+
+
+async def test_updates_during_interval_collapse_to_latest():
+    editor, cache = make_editor(interval=0.05)
+    editor.submit(1, 100, '10%')
+    await asyncio.sleep(0.01)
+    editor.submit(1, 100, '20%')
+    editor.submit(1, 100, '30%')
+    await wait_idle(editor)
+    assert cache.edits == [(100, '10%'), (100, '30%')]
+
+
+async def test_terminal_updates_go_first():
+    editor, cache = make_editor(interval=0.01)
+    editor.submit(1, 100, '10%')
+    editor.submit(1, 200, '50%')
+    editor.submit(1, 300, 'Error', terminal=True)
+    await wait_idle(editor)
+    assert cache.edits == [(300, 'Error'), (100, '10%'), (200, '50%')]
+
+
+async def test_channels_are_rate_limited_separately():
+    editor, cache = make_editor(interval=10)
+    editor.submit(1, 100, 'a')
+    editor.submit(2, 200, 'b')
+    await asyncio.sleep(0.01)
+    assert sorted(cache.edits) == [(100, 'a'), (200, 'b')]
+    for state in editor._channels.values():
+        state.task.cancel()
+
+
+async def test_close_waits_for_edit_in_flight_and_drops_pending():
+    editor, cache = make_editor(interval=0)
+    gate = cache.gates[100] = asyncio.Event()
+    editor.submit(1, 100, '10%')
+    await asyncio.sleep(0)
+    editor.submit(1, 100, '20%')
+
+    closing = asyncio.create_task(editor.close(1, 100))
+    await asyncio.sleep(0.01)
+    # The final result must not be posted while the 10% edit can still land on it
+    assert not closing.done()
+    gate.set()
+    await closing
+    assert cache.edits == [(100, '10%')]
+
+    # Nothing is edited after close, so the final content stays
+    editor.submit(1, 100, '30%')
+    await wait_idle(editor)
+    assert cache.edits == [(100, '10%')]
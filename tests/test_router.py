@@ -0,0 +1,99 @@
+import json
+import struct
+
+from Main.comfy_engine import router as router_module
+from Main.comfy_engine.router import OUTPUT_IMAGE, PREVIEW_IMAGE_EVENT, PromptRouter
+
+
+def send(router, message_type, **data):
+    router._dispatch_text(json.dumps({'type': message_type, 'data': data}))
+
+
+def events(queue):
+    received = []
+    while not queue.empty():
+        received.append(queue.get_nowait())
+    return received
+
+
+def image_frame(data=b'png-bytes', image_format=2):
+    return struct.pack('>II', PREVIEW_IMAGE_EVENT, image_format) + data
+
+
+def test_messages_go_to_their_prompt():
+    router = PromptRouter(client=None)
+    first = router.subscribe('p1')
+    second = router.subscribe('p2')
+    send(router, 'executing', prompt_id='p1', node='3')
+    send(router, 'executed', prompt_id='p2', node='9')
+
+    assert [e['type'] for e in events(first)] == ['executing']
+    assert [e['data']['node'] for e in events(second)] == ['9']
+
+
+def test_events_before_subscribe_are_replayed():
+    router = PromptRouter(client=None)
+    send(router, 'execution_start', prompt_id='p1')
+    send(router, 'executing', prompt_id='p1', node='3')
+
+    queue = router.subscribe('p1')
+    assert [e['type'] for e in events(queue)] == ['execution_start', 'executing']
+    # Replayed once; later events go straight to the queue
+    send(router, 'executed', prompt_id='p1', node='3')
+    assert [e['type'] for e in events(router.subscribe('p1'))] == ['executed']
+
+
+def test_backlog_is_bounded(monkeypatch):
+    monkeypatch.setattr(router_module, 'BACKLOG_PROMPTS', 2)
+    monkeypatch.setattr(router_module, 'BACKLOG_EVENTS', 3)
+    router = PromptRouter(client=None)
+    for prompt_id in ('p1', 'p2', 'p3'):
+        for node in range(5):
+            send(router, 'executing', prompt_id=prompt_id, node=str(node))
+
+    # The oldest unclaimed prompt was dropped and each kept only its first events
+    assert events(router.subscribe('p1')) == []
+    assert len(events(router.subscribe('p3'))) == 3
+
+
+def test_progress_without_prompt_id_uses_executing_prompt():
+    router = PromptRouter(client=None)
+    queue = router.subscribe('p1')
+    send(router, 'execution_start', prompt_id='p1')
+    send(router, 'progress', value=3, max=10)
+
+    received = events(queue)
+    assert [e['type'] for e in received] == ['execution_start', 'progress']
+
+
+def test_unsubscribe_drops_later_events():
+    router = PromptRouter(client=None)
+    queue = router.subscribe('p1')
+    router.unsubscribe('p1')
+    send(router, 'executed', prompt_id='p1', node='3')
+    assert events(queue) == []
+
+
+def test_binary_images_only_from_watched_nodes():
+    router = PromptRouter(client=None)
+    queue = router.subscribe('p1', image_nodes=['save'])
+    send(router, 'execution_start', prompt_id='p1')
+
+    # Sampler preview from another node is ignored
+    send(router, 'executing', prompt_id='p1', node='sampler')
+    router._dispatch_binary(image_frame(b'preview'))
+    send(router, 'executing', prompt_id='p1', node='save')
+    router._dispatch_binary(image_frame(b'final'))
+
+    images = [e for e in events(queue) if e['type'] == OUTPUT_IMAGE]
+    assert len(images) == 1
+    assert images[0]['data'] == {'prompt_id': 'p1', 'node': 'save', 'format': 'png', 'image': b'final'}
+
+
+def test_binary_frames_after_execution_ends_are_ignored():
+    router = PromptRouter(client=None)
+    queue = router.subscribe('p1', image_nodes=['save'])
+    send(router, 'executing', prompt_id='p1', node='save')
+    send(router, 'executing', prompt_id='p1', node=None)
+    router._dispatch_binary(image_frame())
+    assert all(e['type'] != OUTPUT_IMAGE for e in events(queue))
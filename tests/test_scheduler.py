@@ -0,0 +1,134 @@
+import asyncio
+
+import pytest
+
+from Main.comfy_engine.scheduler import FairScheduler
+
+
+def drain(queue, count=None):
+    count = queue.qsize() if count is None else count
+    return [queue.get_nowait() for _ in range(count)]
+
+
+def test_user_jobs_stay_fifo():
+    queue = FairScheduler()
+    for i in range(5):
+        queue.put_nowait(('a', i), user_id='a')
+    assert drain(queue) == [('a', i) for i in range(5)]
+
+
+def test_users_alternate_at_equal_weight():
+    queue = FairScheduler()
+    for i in range(4):
+        queue.put_nowait(('a', i), user_id='a', guild_id='g')
+    for i in range(4):
+        queue.put_nowait(('b', i), user_id='b', guild_id='g')
+    users = [user for user, _ in drain(queue)]
+    assert users == ['a', 'b'] * 4
+
+
+def test_user_weight_sets_share():
+    queue = FairScheduler()
+    queue.set_weights(user_weights={'a': 2.0})
+    for i in range(30):
+        queue.put_nowait('a', user_id='a', guild_id='g')
+        queue.put_nowait('b', user_id='b', guild_id='g')
+    served = drain(queue, 12)
+    assert served.count('a') == 8
+    assert served.count('b') == 4
+
+
+def test_guilds_share_before_users():
+    queue = FairScheduler()
+    # One busy guild with three users against a guild with one user
+    for user in ('a', 'b', 'c'):
+        for _ in range(4):
+            queue.put_nowait('busy', user_id=user, guild_id='busy')
+    for _ in range(4):
+        queue.put_nowait('quiet', user_id='d', guild_id='quiet')
+    served = drain(queue, 8)
+    assert served.count('quiet') == 4
+
+
+def test_guild_weight_sets_share():
+    queue = FairScheduler()
+    queue.set_guild_weight('big', 3.0)
+    for _ in range(20):
+        queue.put_nowait('big', user_id='a', guild_id='big')
+        queue.put_nowait('small', user_id='b', guild_id='small')
+    served = drain(queue, 8)
+    assert served.count('big') == 6
+
+
+def test_idle_user_cannot_bank_credit():
+    queue = FairScheduler()
+    for _ in range(10):
+        queue.put_nowait('a', user_id='a')
+    drain(queue, 6)
+    # b arrives late and is interleaved with a, not served six times in a row
+    for _ in range(6):
+        queue.put_nowait('b', user_id='b')
+    served = drain(queue, 6)
+    assert served.count('b') == 3
+
+
+def test_empty_queue_raises():
+    with pytest.raises(asyncio.QueueEmpty):
+        FairScheduler().get_nowait()
+
+
+async def test_get_waits_for_put_and_join_tracks_task_done():
+    queue = FairScheduler()
+    getter = asyncio.create_task(queue.get())
+    await asyncio.sleep(0)
+    assert not getter.done()
+
+    await queue.put('job', user_id='a')
+    assert await asyncio.wait_for(getter, 1) == 'job'
+
+    joined = asyncio.create_task(queue.join())
+    await asyncio.sleep(0)
+    assert not joined.done()
+    queue.task_done()
+    await asyncio.wait_for(joined, 1)
+    with pytest.raises(ValueError):
+        queue.task_done()
+
+
+def test_affinity_serves_same_family_within_window():
+    queue = FairScheduler(affinity_window=3)
+    queue.put_nowait('a1', user_id='a', family='flux')
+    queue.put_nowait('b1', user_id='b', family='pulid')
+    queue.put_nowait('a2', user_id='a', family='flux')
+    queue.put_nowait('c1', user_id='c', family='flux')
+    assert drain(queue) == ['a1', 'c1', 'a2', 'b1']
+
+
+def test_no_affinity_without_window():
+    queue = FairScheduler(affinity_window=0)
+    queue.put_nowait('a1', user_id='a', family='flux')
+    queue.put_nowait('b1', user_id='b', family='pulid')
+    queue.put_nowait('a2', user_id='a', family='flux')
+    queue.put_nowait('c1', user_id='c', family='flux')
+    assert drain(queue) == ['a1', 'b1', 'c1', 'a2']
+
+
+def test_affinity_delay_is_bounded_by_window():
+    queue = FairScheduler(affinity_window=2)
+    for i in range(10):
+        queue.put_nowait(f'a{i}', user_id='a', family='flux')
+    queue.put_nowait('b0', user_id='b', family='pulid')
+    # a's next job falls more than two units behind b after three jobs
+    assert drain(queue, 4) == ['a0', 'a1', 'a2', 'b0']
+
+
+def test_affinity_serves_every_job_once():
+    queue = FairScheduler(affinity_window=3)
+    families = ('flux', 'pulid', 'video')
+    for i in range(3000):
+        queue.put_nowait(i, user_id=f'u{i % 400}', guild_id=f'g{i % 20}', family=families[i * 7 % 3])
+    served = drain(queue)
+    assert sorted(served) == list(range(3000))
+    assert queue.empty()
+    # Tombstoned entries are cleared once the queue runs dry
+    assert not queue._dead
@@ -0,0 +1,76 @@
+import io
+
+import aiohttp
+import discord
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from Main.custom_commands import web_handlers
+from Main.custom_commands.spooled_upload import SpooledUpload, UploadTooLarge
+
+
+class FakePart:
+    """A multipart body part handing out fixed chunks"""
+
+    def __init__(self, chunks):
+        self._chunks = list(chunks)
+
+    async def read_chunk(self, size):
+        return self._chunks.pop(0) if self._chunks else b''
+
+
+async def test_small_upload_stays_in_memory():
+    upload = SpooledUpload(max_memory=10, max_size=100)
+    await upload.read_from(FakePart([b'abcd', b'efgh']))
+    assert not upload.on_disk
+    assert upload.size == 8
+    assert upload.file.read() == b'abcdefgh'
+    upload.close()
+
+
+async def test_large_upload_rolls_over_to_disk():
+    upload = SpooledUpload(max_memory=10, max_size=100)
+    await upload.read_from(FakePart([b'abcdefgh', b'ijklmnop', b'qrst']))
+    assert upload.on_disk
+    assert upload.size == 20
+    assert upload.file.read() == b'abcdefghijklmnopqrst'
+    upload.close()
+
+
+async def test_zero_memory_goes_straight_to_disk():
+    upload = SpooledUpload(max_memory=0, max_size=0)
+    await upload.read_from(FakePart([b'a']))
+    assert upload.on_disk
+    upload.close()
+
+
+async def test_upload_over_limit_is_refused():
+    upload = SpooledUpload(max_memory=10, max_size=16)
+    with pytest.raises(UploadTooLarge):
+        await upload.read_from(FakePart([b'abcdefgh', b'ijklmnop', b'q']))
+    upload.close()
+
+
+async def test_file_works_with_discord_file():
+    upload = SpooledUpload(max_memory=4, max_size=0)
+    await upload.read_from(FakePart([b'abcd', b'efgh']))
+    file = discord.File(upload.file, filename='output.mp4')
+    assert file.fp.read() == b'abcdefgh'
+    file.reset()
+    assert file.fp.read(3) == b'abc'
+    upload.close()
+
+
+async def test_oversized_request_is_rejected_with_413(monkeypatch):
+    monkeypatch.setattr(web_handlers, 'UPLOAD_MAX_BYTES', 1024)
+    app = web.Application()
+    app['bot'] = None
+    app.router.add_post('/send_image', web_handlers.handle_generated_image)
+
+    form = aiohttp.FormData()
+    form.add_field('channel_id', '1')
+    form.add_field('video_data', io.BytesIO(b'x' * 4096), filename='output.mp4')
+    async with TestClient(TestServer(app)) as client:
+        response = await client.post('/send_image', data=form)
+        assert response.status == 413
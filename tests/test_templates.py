@@ -0,0 +1,65 @@
+import json
+import os
+
+import pytest
+
+from Main.comfy_engine.templates import TemplateCache, WorkflowInstance
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    # Template paths are relative to the repository root, as when the bot runs
+    monkeypatch.chdir(ROOT)
+    return TemplateCache()
+
+
+def test_template_is_parsed_once(cache):
+    assert cache.get('Redux.json') is cache.get('Redux.json')
+
+
+def test_changed_template_is_parsed_again(tmp_path):
+    path = tmp_path / 'template.json'
+    path.write_text(json.dumps({'1': {'inputs': {'text': 'a'}}}))
+    cache = TemplateCache()
+    first = cache.get(str(path))
+
+    path.write_text(json.dumps({'1': {'inputs': {'text': 'changed'}}}))
+    second = cache.get(str(path))
+    assert second is not first
+    assert second['1']['inputs']['text'] == 'changed'
+
+
+def test_instance_edits_leave_template_unmodified(cache):
+    template = cache.get('Redux.json')
+    snapshot = json.loads(json.dumps(template))
+    node_id = next(node_id for node_id, node in template.items() if node.get('inputs'))
+    input_name = next(iter(template[node_id]['inputs']))
+
+    instance = cache.instance('Redux.json')
+    assert instance.template == 'Redux.json'
+    instance[node_id]['inputs'][input_name] = 'patched'
+    instance['new'] = {'inputs': {}}
+
+    assert template == snapshot
+    assert cache.instance('Redux.json')[node_id]['inputs'][input_name] == snapshot[node_id]['inputs'][input_name]
+    assert instance[node_id]['inputs'][input_name] == 'patched'
+
+
+def test_untouched_nodes_are_shared():
+    base = {'1': {'inputs': {'a': 1}}, '2': {'inputs': {'b': 2}}}
+    instance = WorkflowInstance(base)
+    instance['1']['inputs']['a'] = 5
+    assert dict.__getitem__(instance, '2') is base['2']
+    assert dict.__getitem__(instance, '1') is not base['1']
+    assert base['1']['inputs']['a'] == 1
+
+    copy = instance.copy()
+    copy['1']['inputs']['a'] = 6
+    assert instance['1']['inputs']['a'] == 5
+
+
+def test_instance_serialises_like_a_dict(cache):
+    instance = cache.instance('Redux.json')
+    assert json.loads(json.dumps(instance)) == cache.get('Redux.json')
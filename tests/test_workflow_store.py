@@ -0,0 +1,77 @@
+import json
+import sqlite3
+
+import pytest
+
+from Main import workflow_store
+from Main.workflow_store import compact_history, join_workflow, load_workflow, split_workflow, store_workflow
+
+
+def workflow(prompt, seed):
+    return {
+        '6': {'class_type': 'CLIPTextEncode', 'inputs': {'text': prompt, 'clip': ['11', 0]}},
+        '25': {'class_type': 'RandomNoise', 'inputs': {'noise_seed': seed}},
+        '45': {'class_type': 'Power Lora Loader', 'inputs': {
+            'model': ['12', 0], 'lora_1': {'on': True, 'lora': 'pixel.safetensors', 'strength': 0.8}
+        }},
+        'meta': 'not a node',
+    }
+
+
+@pytest.fixture
+def conn():
+    workflow_store._templates.clear()
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE workflow_templates (hash TEXT PRIMARY KEY, data BLOB NOT NULL)")
+    conn.execute('''CREATE TABLE image_history
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT, workflow JSON,
+                     workflow_hash TEXT, workflow_delta BLOB)''')
+    yield conn
+    conn.close()
+
+
+def test_split_and_join_round_trip():
+    original = workflow('a red fox', 42)
+    template, delta = split_workflow(original)
+    assert 'text' not in template['6']['inputs']
+    assert 'lora_1' not in template['45']['inputs']
+    assert delta['25'] == {'noise_seed': 42}
+    assert join_workflow(template, delta) == original
+
+
+def test_jobs_from_one_template_share_a_stored_template(conn):
+    first = store_workflow(conn, workflow('a red fox', 1))
+    second = store_workflow(conn, workflow('a blue whale', 2))
+    assert first[0] == second[0]
+    assert conn.execute("SELECT COUNT(*) FROM workflow_templates").fetchone()[0] == 1
+
+    for (template_hash, delta), expected in ((first, workflow('a red fox', 1)), (second, workflow('a blue whale', 2))):
+        assert load_workflow(conn, None, template_hash, delta) == expected
+
+
+def test_stored_row_is_much_smaller_than_the_json(conn):
+    big = workflow('a red fox', 1)
+    big['99'] = {'class_type': 'Note', 'inputs': {'notes': 'x' * 20000}}
+    _, delta = store_workflow(conn, big)
+    assert len(delta) < len(json.dumps(big)) / 50
+
+
+def test_load_falls_back_to_legacy_json(conn):
+    assert load_workflow(conn, json.dumps({'1': {}}), None, None) == {'1': {}}
+    assert load_workflow(conn, 'not json', None, None) is None
+    assert load_workflow(conn, None, 'f' * 64, None) is None
+
+
+def test_compact_history_moves_legacy_rows(conn):
+    conn.executemany("INSERT INTO image_history (workflow) VALUES (?)", [
+        (json.dumps(workflow('a red fox', 1)),),
+        (json.dumps(workflow('a blue whale', 2)),),
+        ('not json',),
+    ])
+    assert compact_history(conn, batch_size=1) == 2
+    rows = conn.execute("SELECT workflow, workflow_hash, workflow_delta FROM image_history ORDER BY id").fetchall()
+    assert rows[0][0] is None
+    assert load_workflow(conn, *rows[1]) == workflow('a blue whale', 2)
+    # Unreadable rows are left as they were
+    assert rows[2] == ('not json', None, None)
+    assert compact_history(conn) == 0
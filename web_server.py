@@ -1,9 +1,8 @@
 from aiohttp import web
-from Main.custom_commands.web_handlers import handle_generated_image
+from Main.custom_commands.web_handlers import handle_generated_image, apply_progress_update
+from Main.history_writer import history_record
 import logging
-from Main.custom_commands.message_constants import STATUS_MESSAGES
 from config import server_address
-import discord
 
 logging.basicConfig(level=logging.WARNING)
 logger = logging.getLogger(__name__)
@@ -20,44 +19,9 @@ async def update_progress(request):
         if request_id not in request.app['bot'].pending_requests:
             return web.Response(text="Unknown request_id", status=404)
             
-        request_item = request.app['bot'].pending_requests[request_id]
-        
         try:
-            channel = await request.app['bot'].fetch_channel(int(request_item.channel_id))
-            message = await channel.fetch_message(int(request_item.original_message_id))
-            
-            status = progress_data.get('status', '')
-            progress_message = progress_data.get('message', 'Processing...')
-            progress = progress_data.get('progress', 0)
-
-            status_info = STATUS_MESSAGES.get(status, {
-                'message': progress_message,
-                'emoji': '⚙️'
-            })
-
-            if status == 'generating' and progress == 100:
-                status = 'upscaling'
-                status_info = STATUS_MESSAGES['upscaling']
-                formatted_message = f"{status_info['emoji']} {status_info['message']}"
-            elif status == 'generating':
-                formatted_message = f"{status_info['emoji']} {status_info['message']} {progress}%"
-            elif status == 'error':
-                formatted_message = f"{status_info['emoji']} {status_info['message']} {progress_message}"
-                # Only remove on error
-                if request_id in request.app['bot'].pending_requests:
-                    del request.app['bot'].pending_requests[request_id]
-            else:
-                formatted_message = f"{status_info['emoji']} {status_info['message']}"
-            await message.edit(content=formatted_message)
-            logger.debug(f"Updated progress message: {formatted_message}")
+            await apply_progress_update(request.app['bot'], request_id, progress_data)
             return web.Response(text="Progress updated")
-            
-        except discord.errors.NotFound:
-            logger.warning(f"Message {request_item.original_message_id} not found")
-            return web.Response(text="Message not found", status=404)
-        except discord.errors.Forbidden:
-            logger.warning("Bot lacks permission to edit message")
-            return web.Response(text="Permission denied", status=403)
         except Exception as e:
             logger.error(f"Error updating progress message: {str(e)}")
             return web.Response(text=f"Error: {str(e)}", status=500)
@@ -66,6 +30,21 @@ async def update_progress(request):
         logger.error(f"Error in update_progress: {str(e)}")
         return web.Response(text="Internal server error", status=500)
 
+async def record_history(request):
+    try:
+        data = await request.json()
+        try:
+            record = history_record(data)
+        except (ValueError, TypeError) as e:
+            return web.Response(text=str(e), status=400)
+
+        request.app['bot'].history_writer.submit(record)
+        return web.Response(text="History queued")
+
+    except Exception as e:
+        logger.error(f"Error in record_history: {str(e)}")
+        return web.Response(text="Internal server error", status=500)
+
 async def start_web_server(bot):
     app = web.Application()
     
@@ -73,6 +52,7 @@ async def start_web_server(bot):
     app.router.add_post('/send_image', handle_generated_image)
     app.router.add_post('/update_progress', update_progress)
     app.router.add_post('/image_generated', handle_generated_image)
+    app.router.add_post('/history', record_history)
     
     app['bot'] = bot
     